@@ -1,70 +1,124 @@
 from langchain_core.prompts import ChatPromptTemplate
 from langchain_google_genai import ChatGoogleGenerativeAI
 from langgraph.graph import StateGraph, END
-from langchain_experimental.tools.python.tool import PythonAstREPLTool
-from typing import TypedDict
+from typing import TypedDict, Annotated
+import asyncio
 import logging
+import time
+import re
 import os
 
-from src.app.rag_pipelines.general_rag_pipeline import Rag_Pipeline
+from src.app.rag_pipelines.general_rag_pipeline import Rag_Pipeline, Index_Building
+from src.app.agent_workflow.fast_router import Fast_Router
+from src.app.code_sandbox.sandbox_pool import Sandbox_Pool, format_sandbox_result
+from src.app.agent_workflow.llm_gateway import Llm_Gateway
+from src.app.agent_workflow.conversation_memory import memory_node, format_conversation, contextual_input
+from src.app.core.config import TOOL_TIMEOUT_SECONDS, ROUTER_MAX_RETRIES
+from src.app.core.tracing import span
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s') 
 
+#None resets the value, that's how a new turn of a session starts without the tool results of the last one
+def add_or_reset(left: list, right: list) -> list:
+    return [] if right is None else (left or []) + right
+
+def merge_timings(left: dict, right: dict) -> dict:
+    return {} if right is None else {**(left or {}), **right}
+
 #Chatstate to help maintaining some data while navigating the nodes of the graph
+#tools can run in parallel, so nodes only return what they changed and the lists/timings are merged by reducers
 class ChatState(TypedDict):
     input: str
     output: str
-    tool_calls: list[dict]
-    tool_results: list[dict]
-    next_step: str
+    tool_calls: Annotated[list[dict], add_or_reset]
+    tool_results: Annotated[list[dict], add_or_reset]
+    #tools picked by the router, every one of them runs at the same time, empty goes straight to the final answer
+    next_steps: list[str]
     retries: int
+    #seconds spent in every node, by node name
+    timings: Annotated[dict[str, float], merge_timings]
+    #who took the routing decision ('heuristic', 'centroid' or 'llm') and how sure it was (None for the llm)
+    route_source: str
+    route_confidence: float | None
+    #only used with sessions (checkpointer): last turns word for word, a rolling summary of the older ones and the turn count
+    history: list[dict]
+    summary: str
+    turns: int
+
+def new_turn(input: str) -> dict:
+    #graph input for a request, with a session the rest of the state (history, summary) comes from the checkpointer
+    return {'input': input, 'output': '', 'tool_calls': None, 'tool_results': None, 'timings': None}
+
+def default_llm_factory(google_api_key):
+    #get_llm(model, temperature) -> chat model, the graph only talks to the LLMs through it so they can be swapped (fakes in the benchmarks)
+    def get_llm(model, temperature):
+        #retries, backoff and rate limits are handled by the llm gateway, the client only tries once
+        return ChatGoogleGenerativeAI(model=model, temperature=temperature, api_key=google_api_key, max_retries=1)
+    return get_llm
 
-async def router_node(state: ChatState, google_api_key, possible_tools:list[str]):
+def parse_tools(content: str, possible_tools: list[str]):
+    #"rag_retriever, code_interpreter" -> both tools, "final_answer" -> no tools, anything else -> None (not understood)
+    words = re.findall(r"[a-z_]+", content.lower())
+    tools = [tool for tool in possible_tools if tool in words]
+    if tools:
+        return tools
+    return [] if 'final_answer' in words else None
+
+async def router_node(state: ChatState, get_llm, possible_tools:list[str], fast_router: Fast_Router = None):
     #this node is the main node, it starts here and defines all the next steps
     #the router will decide which tool to use, the code interpreter or the RAG to help the user
-    llm = ChatGoogleGenerativeAI(model="gemini-2.5-flash-lite", temperature=0, api_key=google_api_key)
-    #added a retry system to handle unpredicted behavior of the model
-    state['retries'] = 0
-    try:
-        prompt = ChatPromptTemplate.from_messages([
-            ("system", "You are a router that decides the next step in a workflow based on the input, and possible tool calls."),
-            ("user", "Input: {input}\n\n Possible Tools: {possible_tools}\n\n Decide the next step to give the best answer possible, return ONLY: 'rag_retriever', 'code_interpreter' or 'final_answer'.")])
-        #the options 'rag_retriever', 'code_interpreter' or 'final_answer' are simple, the final_answer is called as a final step in every call
-        #if tools are not needed, just skips them and goes throw the final answer directly
-        response = await llm.ainvoke(prompt.format(input=state['input'], possible_tools=possible_tools))
-        if(response.content not in possible_tools + ['final_answer']):
-            logging.error(f"Router couldn't understand the input\nRetries: {state['retries']}/3\nretrying...")
-            state['retries'] += 1
-            if state['retries'] > 3:
-                logging.error("Max retries exceeded and still couldn't understand the input")
-                return 'final_answer'
-        state['tool_calls'] = []
-        state['tool_results'] = []
-        state['retries'] = 0
-        state['next_step'] = response.content
-        return state
-    except Exception as e:
-        logging.error(f"Error while in router_node: {e}", traceback=True)
-        state['retries'] += 1
-        if state['retries'] > 3:
-            logging.error("Max retries exceeded, something went wrong, try again...")
-            return None
+    #the local router answers the easy cases (code in the input, questions close to the labeled examples) without an LLM call
+    if fast_router is not None:
+        decision = await fast_router.route(state['input'])
+        if decision is not None:
+            next_steps = [decision['next_step']] if decision['next_step'] in possible_tools else []
+            return {'next_steps': next_steps, 'retries': 0, 'route_source': decision['source'],
+                    'route_confidence': decision['confidence']}
+    llm = get_llm("gemini-2.5-flash-lite", 0)
+    prompt = ChatPromptTemplate.from_messages([
+        ("system", "You are a router that decides the next step in a workflow based on the input, and possible tool calls."),
+        ("user", "Input: {input}\n\n Possible Tools: {possible_tools}\n\n Decide which tools are needed to give the best answer possible, return ONLY the tool names separated by commas (e.g. 'rag_retriever' or 'rag_retriever, code_interpreter'), or 'final_answer' if no tool is needed.")])
+    #the chosen tools run in parallel, the final_answer is called as a final step in every call
+    #if tools are not needed, just skips them and goes throw the final answer directly
+    #network errors and rate limits are already retried by the llm gateway, here we only retry answers we can't parse
+    retries = 0
+    while True:
+        try:
+            response = await llm.ainvoke(prompt.format(input=contextual_input(state), possible_tools=possible_tools))
+        except Exception as e:
+            logging.error(f"Error while in router_node, going straight to the final answer: {e}", exc_info=True)
+            return {'next_steps': [], 'retries': retries, 'route_source': 'llm', 'route_confidence': None}
+        next_steps = parse_tools(response.content, possible_tools)
+        if next_steps is not None:
+            return {'next_steps': next_steps, 'retries': retries, 'route_source': 'llm', 'route_confidence': None}
+        if retries >= ROUTER_MAX_RETRIES:
+            logging.error("Max retries exceeded and still couldn't understand the input")
+            return {'next_steps': [], 'retries': retries, 'route_source': 'llm', 'route_confidence': None}
+        retries += 1
+        logging.warning(f"Router couldn't understand the input\nRetries: {retries}/{ROUTER_MAX_RETRIES}\nretrying...")
     
-async def rag_retriever_node(state: ChatState):
+async def rag_retriever_node(state: ChatState, rag: Rag_Pipeline):
     #throw all to the RAG pipeline to get the most relevant data
-    rag = Rag_Pipeline()
-    rag_data = await rag.query_docs(state['input'])
-    #add the proper info to the state to the final_answer model be able to use it
-    state['tool_calls'].append({'tool': 'rag_retriever', 'input': state['input']})
-    state['tool_results'].append({'tool': 'rag_retriever', 'output': rag_data})
-    return state
-
-async def code_interpreter_node(state: ChatState, google_api_key):
+    #the pipeline is shared, so the embedding model and the chroma client are already warm
+    #it gives back the deduplicated, re-ranked chunks already packed as text in a token budget
+    try:
+        rag_data = await rag.query_context(contextual_input(state))
+    except Index_Building as e:
+        #first minutes of a cold start, the build goes on in the background and the answer is written without the docs
+        return {'tool_calls': [{'tool': 'rag_retriever', 'input': state['input']}],
+                'tool_results': [{'tool': 'rag_retriever', 'output': f"{e} Answer without it.", 'error': True}]}
+    #add the proper info to the state to the final_answer model be able to use it, only the text goes in the prompt
+    return {'tool_calls': [{'tool': 'rag_retriever', 'input': state['input']}],
+            'tool_results': [{'tool': 'rag_retriever', 'output': rag_data['context'], 'documents': len(rag_data['documents']),
+                              'sources': [doc.metadata.get('source') for doc in rag_data['documents']], 'stats': rag_data['stats']}],
+            'timings': {f"rag_retriever.{stage}": seconds for stage, seconds in rag_data['timings'].items()}}
+
+async def code_interpreter_node(state: ChatState, get_llm, sandbox: Sandbox_Pool):
     #this node is a bit more complex, we have a code spliter and interpreter and a final explainer and code builder
     #the first LLM will split the input in code and text and will return a brief description of what the code does or what error it has
     #the second LLM will be given the input, the code, the description and the output of the code, and will explain what the code does or what error it has and why
-    llm1 = ChatGoogleGenerativeAI(model="gemini-2.5-flash-lite", temperature=0, api_key=google_api_key)
-    llm2 = ChatGoogleGenerativeAI(model="gemini-2.5-flash-lite", temperature=0, api_key=google_api_key)
+    llm1 = get_llm("gemini-2.5-flash-lite", 0)
+    llm2 = get_llm("gemini-2.5-flash-lite", 0)
     prompt1 = ChatPromptTemplate.from_messages([
         ("system", """You are a code interpreter that is experts in python, what you will do:
             - Analyze the input and split in text and code
@@ -79,8 +133,8 @@ async def code_interpreter_node(state: ChatState, google_api_key):
     response_splited = response.content.split(' / ')
     code = response_splited[0]
     explanation_or_error = response_splited[1] if len(response_splited) > 1 else "No explanation or error provided."
-    tool = PythonAstREPLTool(description=code)
-    code_run_return = await tool.arun(code)
+    #the code runs in a worker of the sandbox pool, never inside the api process
+    code_run_return = format_sandbox_result(await sandbox.run(code))
     prompt2 = ChatPromptTemplate.from_messages([
         ("system", """You are a code interpreter that is experts in python, what you will do:
             - You will be given the input, the code that was run, a brief description and the output of the code
@@ -90,57 +144,108 @@ async def code_interpreter_node(state: ChatState, google_api_key):
         ])
     formatted_prompt2 = prompt2.format(input=state['input'], code=code, explanation_or_error=explanation_or_error, code_run_return=code_run_return)
     response2 = await llm2.ainvoke(formatted_prompt2)
-    state['tool_calls'].append({'tool': 'code_interpreter', 'input': state['input']})
-    state['tool_results'].append({'tool': 'code_interpreter', 'output': response2.content})
-    return state
+    return {'tool_calls': [{'tool': 'code_interpreter', 'input': state['input']}],
+            'tool_results': [{'tool': 'code_interpreter', 'output': response2.content}]}
+
+def format_tool_results(tool_results: list[dict]) -> str:
+    #only the outputs go in the prompt, the stats and sources next to them are for the api
+    return "\n\n".join(f"{result['tool']}:\n{result['output']}" for result in tool_results or []) or "(no tools used)"
 
-async def final_answer_node(state: ChatState, google_api_key):
+async def final_answer_node(state: ChatState, get_llm):
     #as simple as it looks, just give all the info to the model and let it answer
     #it will have the input, and the tool_results with the info of the RAG or the code interpreter if used
-    llm = ChatGoogleGenerativeAI(model="gemini-2.5-flash-lite", temperature=0.7, api_key=google_api_key)
+    #when the graph runs with stream_mode="messages" langgraph streams this call token by token, no extra code needed here
+    llm = get_llm("gemini-2.5-flash-lite", 0.7)
     prompt = ChatPromptTemplate.from_messages([
         ("system", """You are an expert in python and machine learning, answer shortly, what you will do:
             - You will be given the input and the results of some tools that were used to help you give the best answer possible
             - If the input is a question, answer it using the tool results if needed
             - If the input has no tool results, just answer it with your own knowledge if you can
+            - If there is a conversation, the input may be a follow-up of it
          Rules:
             - If the input is not related to python or machine learning, just answer that you can't help with that
             - If the input is related to python or machine learning, but you don't know the answer, just say that you don't know
             """),
-        ("user", "Input: {input}, tool results: {tool_results}"), 
+        ("user", "Conversation: {conversation}\n\nInput: {input}, tool results: {tool_results}"), 
     ])
-    formatted_prompt = prompt.format(input=state['input'], tool_results=state['tool_results'])
+    formatted_prompt = prompt.format(input=state['input'], tool_results=format_tool_results(state.get('tool_results')),
+                                     conversation=format_conversation(state) or "(new conversation)")
     response = await llm.ainvoke(formatted_prompt)
-    state['output'] = response.content
-    return state
+    return {'output': response.content}
 
-def create_graph(google_api_key: str):
+def timed_node(name: str, node):
+    #adds the seconds spent in the node to the 'timings' of the state, next to the ones the node reported itself
+    #and traces it, the llm calls, searches and sandbox runs made by the node are its child spans
+    async def run(state: ChatState):
+        start = time.perf_counter()
+        with span(f"node.{name}"):
+            update = await node(state)
+        return {**update, 'timings': {**(update.get('timings') or {}), name: time.perf_counter() - start}}
+    return run
+
+def tool_branch(name: str, node, timeout: float):
+    #each tool branch has its own deadline, a slow or broken tool ends up as an error result instead of holding the answer
+    async def run(state: ChatState):
+        try:
+            return await asyncio.wait_for(node(state), timeout=timeout)
+        except asyncio.TimeoutError:
+            logging.error(f"{name} timed out after {timeout}s")
+            error = f"The {name} tool timed out after {timeout}s, answer without it."
+        except Exception as e:
+            logging.error(f"Error while in {name}: {e}")
+            error = f"The {name} tool failed ({type(e).__name__}), answer without it."
+        return {'tool_calls': [{'tool': name, 'input': state['input']}],
+                'tool_results': [{'tool': name, 'output': error, 'error': True}]}
+    return timed_node(name, run)
+
+def create_graph(google_api_key: str, rag: Rag_Pipeline = None, llm_factory=None, fast_router: Fast_Router = None,
+                 sandbox: Sandbox_Pool = None, tool_timeouts: dict = TOOL_TIMEOUT_SECONDS, gateway: Llm_Gateway = None,
+                 checkpointer=None):
+    #with a checkpointer the graph keeps a conversation per thread_id (the session id), without one every call is standalone
     possible_tools = ['rag_retriever', 'code_interpreter']
+    #every llm call of every node goes through one gateway: clients are reused, calls are limited and retried
+    if gateway is None:
+        gateway = Llm_Gateway(llm_factory if llm_factory is not None else default_llm_factory(google_api_key))
+    get_llm = gateway.get_llm
+    #one pipeline for the whole graph, never one per request
+    if rag is None:
+        rag = Rag_Pipeline()
+    #the local router reuses the warm MiniLM of the pipeline for its centroids
+    if fast_router is None:
+        fast_router = Fast_Router(getattr(rag, 'embedded_model', None))
+    #the pool starts its workers on the first run if nobody started it before
+    if sandbox is None:
+        sandbox = Sandbox_Pool()
     builder = StateGraph(ChatState)
     
 
 
-    async def router_node_async(state: ChatState): return await router_node(state, google_api_key, possible_tools) 
-    async def rag_retriever_node_async(state: ChatState): return await rag_retriever_node(state) 
-    async def code_interpreter_node_async(state: ChatState): return await code_interpreter_node(state, google_api_key) 
-    async def final_answer_node_async(state: ChatState): return await final_answer_node(state, google_api_key) 
+    async def router_node_async(state: ChatState): return await router_node(state, get_llm, possible_tools, fast_router) 
+    async def rag_retriever_node_async(state: ChatState): return await rag_retriever_node(state, rag) 
+    async def code_interpreter_node_async(state: ChatState): return await code_interpreter_node(state, get_llm, sandbox) 
+    async def final_answer_node_async(state: ChatState): return await final_answer_node(state, get_llm) 
+    async def memory_node_async(state: ChatState): return await memory_node(state, get_llm) 
     async def router_condition(state: ChatState):
-        next_step = state.get('next_step', 'final_answer')
-        if next_step not in ["rag_retriever", "code_interpreter", "final_answer"]:
-            next_step = "final_answer"
-        return next_step
-    builder.add_node("router", router_node_async) 
-    builder.add_node("rag_retriever", rag_retriever_node_async) 
-    builder.add_node("code_interpreter", code_interpreter_node_async) 
-    builder.add_node("final_answer", final_answer_node_async) 
+        #returning several nodes makes langgraph run them in the same step, in parallel
+        next_steps = [step for step in state.get('next_steps') or [] if step in possible_tools]
+        return next_steps or ["final_answer"]
+    builder.add_node("router", timed_node("router", router_node_async)) 
+    builder.add_node("rag_retriever", tool_branch("rag_retriever", rag_retriever_node_async, tool_timeouts["rag_retriever"])) 
+    builder.add_node("code_interpreter", tool_branch("code_interpreter", code_interpreter_node_async, tool_timeouts["code_interpreter"])) 
+    builder.add_node("final_answer", timed_node("final_answer", final_answer_node_async)) 
     builder.set_entry_point("router") 
     builder.add_conditional_edges( "router", router_condition, 
                                   { "rag_retriever": "rag_retriever", 
                                    "code_interpreter": "code_interpreter", 
                                    "final_answer": "final_answer", }, 
                                    ) 
+    #final_answer waits for every branch that was started, it runs once after all of them
     builder.add_edge("rag_retriever", "final_answer") 
     builder.add_edge("code_interpreter", "final_answer") 
-    builder.add_edge("final_answer", END)
-
-    return builder.compile()
\ No newline at end of file
+    if checkpointer is None:
+        builder.add_edge("final_answer", END)
+        return builder.compile()
+    builder.add_node("memory", timed_node("memory", memory_node_async))
+    builder.add_edge("final_answer", "memory")
+    builder.add_edge("memory", END)
+    return builder.compile(checkpointer=checkpointer)
\ No newline at end of file
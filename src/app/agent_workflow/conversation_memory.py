@@ -0,0 +1,77 @@
+import logging
+from langchain_core.prompts import ChatPromptTemplate
+
+from src.app.core.config import MEMORY_TOKEN_BUDGET, MEMORY_SUMMARY_TOKENS, MEMORY_MAX_TURN_TOKENS
+
+#conversation memory of a session: the last turns word for word, everything older folded into a rolling summary
+#the recent turns are kept under MEMORY_TOKEN_BUDGET and the summary under MEMORY_SUMMARY_TOKENS,
+#so the prompt has the same size on turn 200 as on turn 10
+#tokens are estimated (~4 chars per token), it's a budget, not a bill
+
+def count_tokens(text: str) -> int:
+    return (len(text) + 3) // 4
+
+def clip_tokens(text: str, max_tokens: int) -> str:
+    max_chars = max_tokens * 4
+    if len(text) <= max_chars:
+        return text
+    #room for the marker, the clipped text is still within max_tokens
+    clipped = text[:max_chars - len(" [...]")]
+    cut = clipped.rfind(" ")
+    return (clipped[:cut] if cut > max_chars // 2 else clipped) + " [...]"
+
+def history_tokens(history: list[dict]) -> int:
+    return sum(count_tokens(turn['content']) + 2 for turn in history)
+
+def format_turns(history: list[dict]) -> str:
+    return "\n".join(f"{turn['role']}: {turn['content']}" for turn in history)
+
+def format_conversation(state) -> str:
+    #what goes in the prompts, "" for the first turn of a session (or a request without session)
+    parts = []
+    if state.get('summary'):
+        parts.append(f"Summary of the earlier conversation: {state['summary']}")
+    if state.get('history'):
+        parts.append(format_turns(state['history']))
+    return "\n".join(parts)
+
+def contextual_input(state) -> str:
+    #follow-ups like "and for regression?" mean nothing alone, for routing and retrieval they get the previous question
+    history = state.get('history') or []
+    previous = [turn['content'] for turn in history if turn['role'] == 'user']
+    if previous and len(state['input'].split()) <= 6:
+        return f"{clip_tokens(previous[-1], 100)} {state['input']}"
+    return state['input']
+
+async def summarize(get_llm, summary: str, turns: list[dict], max_tokens: int) -> str:
+    llm = get_llm("gemini-2.5-flash-lite", 0)
+    prompt = ChatPromptTemplate.from_messages([
+        ("system", """You keep the running summary of a conversation between a student and a python / machine learning tutor.
+            - Merge the current summary and the new turns into one summary
+            - Keep the topics, the student's code and libraries, and any open questions
+            - At most {max_words} words, no preamble"""),
+        ("user", "Current summary: {summary}\n\nNew turns:\n{turns}"),
+    ])
+    response = await llm.ainvoke(prompt.format(max_words=int(max_tokens * 0.75), summary=summary or "(empty)", turns=format_turns(turns)))
+    #the model doesn't always respect the length, the budget is enforced here
+    return clip_tokens(response.content.strip(), max_tokens)
+
+async def memory_node(state, get_llm, token_budget=MEMORY_TOKEN_BUDGET, summary_tokens=MEMORY_SUMMARY_TOKENS,
+                      max_turn_tokens=MEMORY_MAX_TURN_TOKENS):
+    #runs after the final answer, so the compaction never delays the first token of the answer
+    history = list(state.get('history') or []) + [
+        {'role': 'user', 'content': clip_tokens(state['input'], max_turn_tokens)},
+        {'role': 'assistant', 'content': clip_tokens(state.get('output') or '', max_turn_tokens)},
+    ]
+    summary = state.get('summary') or ''
+    if history_tokens(history) > token_budget:
+        #compacts down to half the budget, so the summary call happens every few turns and not on every turn
+        old = []
+        while len(history) > 2 and history_tokens(history) > token_budget // 2:
+            old.append(history.pop(0))
+        try:
+            summary = await summarize(get_llm, summary, old, summary_tokens)
+        except Exception as e:
+            #the old turns are dropped anyway, the memory must stay bounded even when the llm is down
+            logging.error(f"Could not summarize the conversation, dropping {len(old)} old messages: {e}")
+    return {'history': history, 'summary': summary, 'turns': (state.get('turns') or 0) + 1}
@@ -0,0 +1,120 @@
+import re
+import ast
+import asyncio
+import numpy as np
+
+from src.app.core.config import ROUTER_MIN_CONFIDENCE, ROUTER_SOFTMAX_TEMPERATURE
+
+#local router, answers most of the routing decisions without calling the LLM:
+#   1. code detection (fenced code, tracebacks, parseable python) -> code_interpreter
+#   2. nearest centroid over MiniLM embeddings of a small labeled set
+#when neither is confident enough it returns None and the LLM router decides
+
+#an attribute or a subscript alone is not code: "pd.merge_asof" or "torch.compile" is a bare api name, the kind of lookup
+#the docs answer, and it parses as an expression. it counts once there is a call, an assignment, a statement...
+CODE_NODES = (ast.Call, ast.Assign, ast.AugAssign, ast.AnnAssign, ast.Import, ast.ImportFrom, ast.FunctionDef,
+              ast.AsyncFunctionDef, ast.ClassDef, ast.For, ast.While, ast.If, ast.With, ast.Try, ast.Lambda, ast.Return)
+
+ERROR_LINE = re.compile(r"^\s*[A-Z]\w*(Error|Exception|Warning): ", re.MULTILINE)
+
+def looks_like_code(text: str) -> bool:
+    if "```" in text or "Traceback (most recent call last)" in text or ERROR_LINE.search(text):
+        return True
+    try:
+        tree = ast.parse(text)
+    except SyntaxError:
+        #code pasted after a question ("why does this fail? df.merge(...)") doesn't parse as a whole
+        lines = [line for line in text.splitlines() if line.strip()]
+        return len(lines) > 1 and _parses_as_code("\n".join(lines[1:]))
+    #some prose parses too ("what is overfitting" is a comparison), so ask for something that only code has
+    return any(isinstance(node, CODE_NODES) for node in ast.walk(tree))
+
+def _parses_as_code(text: str) -> bool:
+    try:
+        tree = ast.parse(text)
+    except SyntaxError:
+        return False
+    return any(isinstance(node, CODE_NODES) for node in ast.walk(tree))
+
+#small labeled set for the centroids, rag_retriever = library/api questions the docs answer,
+#final_answer = concepts the model knows by itself or things out of scope
+ROUTING_EXAMPLES = [
+    ("How do I use StandardScaler in scikit-learn?", "rag_retriever"),
+    ("What parameters does RandomForestClassifier accept?", "rag_retriever"),
+    ("How to merge two dataframes in pandas?", "rag_retriever"),
+    ("How do I read a parquet file with pandas?", "rag_retriever"),
+    ("How to build a custom training loop in PyTorch?", "rag_retriever"),
+    ("What does torch.compile do?", "rag_retriever"),
+    ("How do I save and load a Keras model in TensorFlow?", "rag_retriever"),
+    ("How to create a subplot grid in matplotlib?", "rag_retriever"),
+    ("How do I make a heatmap with seaborn?", "rag_retriever"),
+    ("How do I use numpy broadcasting?", "rag_retriever"),
+    ("How to start a Spark session and read a csv?", "rag_retriever"),
+    ("How do I plot an interactive line chart with plotly?", "rag_retriever"),
+    ("What does GridSearchCV return and how to access the best estimator?", "rag_retriever"),
+    ("What are the rules of ML for good data analysis from Google?", "rag_retriever"),
+    ("Explain the difference between classification and regression.", "final_answer"),
+    ("What are the main assumptions of linear regression?", "final_answer"),
+    ("What is overfitting and how can I avoid it?", "final_answer"),
+    ("Explain the bias variance tradeoff.", "final_answer"),
+    ("What is gradient descent?", "final_answer"),
+    ("Explain how a decision tree makes a prediction.", "final_answer"),
+    ("What is the difference between precision and recall?", "final_answer"),
+    ("Write a Python function to calculate the factorial of a number.", "final_answer"),
+    ("Explain overfitting using an analogy.", "final_answer"),
+    ("Hi, who are you?", "final_answer"),
+    ("What's the weather like today?", "final_answer"),
+    ("Tell me a joke about football.", "final_answer"),
+    ("Why does my code raise an error when I run it?", "code_interpreter"),
+    ("What does this code print?", "code_interpreter"),
+    ("Can you run this snippet and tell me the output?", "code_interpreter"),
+    ("Fix the bug in my function below", "code_interpreter"),
+]
+
+class Fast_Router:
+    def __init__(self, embedded_model=None, examples=ROUTING_EXAMPLES, min_confidence=ROUTER_MIN_CONFIDENCE,
+                 temperature=ROUTER_SOFTMAX_TEMPERATURE):
+        #without an embedder only the code detection runs
+        self.embedded_model = embedded_model
+        self.examples = examples
+        self.min_confidence = min_confidence
+        self.temperature = temperature
+        self.labels = sorted({label for _, label in examples})
+        self.centroids = None
+        self._lock = asyncio.Lock()
+
+    def _fit(self):
+        vectors = np.asarray(self.embedded_model.embed_documents([text for text, _ in self.examples]), dtype=np.float32)
+        vectors /= np.linalg.norm(vectors, axis=1, keepdims=True) + 1e-12
+        centroids = []
+        for label in self.labels:
+            centroid = vectors[[i for i, (_, l) in enumerate(self.examples) if l == label]].mean(axis=0)
+            centroids.append(centroid / (np.linalg.norm(centroid) + 1e-12))
+        return np.vstack(centroids)
+
+    async def _centroids(self):
+        if self.centroids is None:
+            async with self._lock:
+                if self.centroids is None:
+                    self.centroids = await asyncio.to_thread(self._fit)
+        return self.centroids
+
+    async def route(self, text: str):
+        #returns {"next_step", "confidence", "source"} or None when the llm should decide
+        if looks_like_code(text):
+            return {"next_step": "code_interpreter", "confidence": 1.0, "source": "heuristic"}
+        if self.embedded_model is None:
+            return None
+        centroids = await self._centroids()
+        vector = np.asarray(await asyncio.to_thread(self.embedded_model.embed_query, text), dtype=np.float32)
+        vector /= np.linalg.norm(vector) + 1e-12
+        scores = centroids @ vector
+        #softmax over the class similarities, a low temperature because cosine gaps between classes are small
+        probs = np.exp((scores - scores.max()) / self.temperature)
+        probs /= probs.sum()
+        best = int(np.argmax(probs))
+        decision = {"next_step": self.labels[best], "confidence": float(probs[best]), "source": "centroid"}
+        #"code_interpreter" without any code in the input means there is nothing to run, let the llm sort it out
+        if decision["confidence"] < self.min_confidence or decision["next_step"] == "code_interpreter":
+            return None
+        return decision
@@ -0,0 +1,159 @@
+import re
+import time
+import random
+import asyncio
+import hashlib
+import logging
+
+from src.app.core.config import (LLM_MAX_CONCURRENCY, LLM_RATE_PER_SECOND, LLM_BURST, LLM_MAX_RETRIES, LLM_BACKOFF_BASE,
+                                 LLM_BACKOFF_MAX, LLM_CALL_TIMEOUT)
+from src.app.core.tracing import span, CLIENT
+from src.app.agent_workflow.conversation_memory import count_tokens
+
+#one place between the graph and the llm provider:
+#   - one client per (model, temperature), created once and reused, so connections are reused too
+#   - a global cap of calls in flight and a token bucket for the request rate, a burst of users can't trigger a 429 storm
+#   - transient errors (429, 5xx, timeouts) are retried with jittered exponential backoff, unless the call already
+#     streamed part of its answer
+#   - identical deterministic (temperature 0) prompts that are already in flight share the same call
+
+TRANSIENT_STATUS = {408, 429, 500, 502, 503, 504}
+TRANSIENT_NAMES = {"ResourceExhausted", "TooManyRequests", "ServiceUnavailable", "DeadlineExceeded", "InternalServerError"}
+#only the provider's own phrases, a bare number in a message ("max 500 tokens") says nothing about the error
+TRANSIENT_MESSAGE = re.compile(r"resource(?: has been)?.?exhausted|rate.?limit|service.?unavailable|deadline.?exceeded", re.IGNORECASE)
+
+def record_usage(s, input, response):
+    #token counts of the call, from the provider when it reports them, estimated from the text otherwise
+    usage = getattr(response, "usage_metadata", None) or {}
+    s.set("tokens.input", usage.get("input_tokens") or count_tokens(str(input)))
+    s.set("tokens.output", usage.get("output_tokens") or count_tokens(str(getattr(response, "content", response))))
+
+def is_transient(error: Exception) -> bool:
+    #the error and the ones it wraps, the google client re-raises the grpc/http error under its own type
+    cause, seen = error, set()
+    while cause is not None and id(cause) not in seen:
+        seen.add(id(cause))
+        if isinstance(cause, (asyncio.TimeoutError, ConnectionError)) or type(cause).__name__ in TRANSIENT_NAMES:
+            return True
+        status = getattr(cause, "status_code", None) or getattr(cause, "status", None) or getattr(cause, "code", None)
+        if isinstance(status, int) and status in TRANSIENT_STATUS:
+            return True
+        cause = cause.__cause__
+    #sometimes only the message tells
+    return bool(TRANSIENT_MESSAGE.search(str(error)))
+
+class Token_Bucket:
+    def __init__(self, rate, burst):
+        #rate tokens per second, up to burst saved, rate 0 means no limit
+        self.rate = rate
+        self.capacity = max(burst, 1)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    async def acquire(self):
+        if not self.rate:
+            return
+        while True:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            #no await between the check and the update, so no lock needed on a single event loop
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return
+            await asyncio.sleep((1 - self.tokens) / self.rate)
+
+class _Gateway_Llm:
+    #what get_llm returns, only ainvoke is used by the nodes
+    def __init__(self, gateway, model, temperature):
+        self.gateway = gateway
+        self.model = model
+        self.temperature = temperature
+
+    async def ainvoke(self, input, config=None, **kwargs):
+        return await self.gateway.ainvoke(self.model, self.temperature, input, config, **kwargs)
+
+class Llm_Gateway:
+    def __init__(self, llm_factory, max_concurrency=LLM_MAX_CONCURRENCY, rate_per_second=LLM_RATE_PER_SECOND, burst=LLM_BURST,
+                 max_retries=LLM_MAX_RETRIES, backoff_base=LLM_BACKOFF_BASE, backoff_max=LLM_BACKOFF_MAX, call_timeout=LLM_CALL_TIMEOUT):
+        #llm_factory(model, temperature) -> chat model, only called once per (model, temperature)
+        self.llm_factory = llm_factory
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.call_timeout = call_timeout
+        self.semaphore = asyncio.Semaphore(max_concurrency)
+        self.bucket = Token_Bucket(rate_per_second, burst)
+        self.clients = {}
+        self.in_flight = {}
+        self.stats = {"calls": 0, "upstream_calls": 0, "retries": 0, "deduplicated": 0, "failures": 0}
+
+    def get_llm(self, model, temperature):
+        return _Gateway_Llm(self, model, temperature)
+
+    def client(self, model, temperature):
+        key = (model, temperature)
+        if key not in self.clients:
+            self.clients[key] = self.llm_factory(model, temperature)
+        return self.clients[key]
+
+    async def ainvoke(self, model, temperature, input, config=None, **kwargs):
+        self.stats["calls"] += 1
+        #llm.call is what the node waited for (queue, retries, a shared call), the tokens are on the llm.request under it
+        with span("llm.call", model=model, temperature=temperature) as s:
+            #only deterministic calls are shared, a temperature > 0 answer is expected to be different every time
+            if temperature != 0:
+                return await self._call(model, temperature, input, config, **kwargs)
+            key = (model, hashlib.sha1(str(input).encode('utf-8')).hexdigest())
+            task = self.in_flight.get(key)
+            s.set("deduplicated", task is not None)
+            if task is not None:
+                self.stats["deduplicated"] += 1
+            else:
+                task = asyncio.ensure_future(self._call(model, temperature, input, config, **kwargs))
+                self.in_flight[key] = task
+                task.add_done_callback(lambda _: self.in_flight.pop(key, None))
+            #shielded, one caller giving up (branch timeout) doesn't cancel the call for the others
+            return await asyncio.shield(task)
+
+    async def _call(self, model, temperature, input, config=None, **kwargs):
+        with span("llm.request", CLIENT, model=model) as s:
+            response = await self._call_with_retries(s, model, temperature, input, config, **kwargs)
+            if s.recording:
+                record_usage(s, input, response)
+            return response
+
+    async def _stream(self, client, input, config, output, **kwargs):
+        #streamed, so the gateway knows when the first token went out: the callbacks (the "messages" stream of /chat/stream)
+        #get every token as it comes, without the call being streamed there's nothing to know it by
+        response = None
+        async for chunk in client.astream(input, config, **kwargs):
+            if chunk.content:
+                output["started"] = True
+            response = chunk if response is None else response + chunk
+        return response
+
+    async def _call_with_retries(self, s, model, temperature, input, config=None, **kwargs):
+        client = self.client(model, temperature)
+        attempt = 0
+        while True:
+            await self.bucket.acquire()
+            async with self.semaphore:
+                self.stats["upstream_calls"] += 1
+                s.set("retries", attempt)
+                output = {"started": False}
+                try:
+                    return await asyncio.wait_for(self._stream(client, input, config, output, **kwargs), timeout=self.call_timeout)
+                except Exception as e:
+                    #a retry after tokens reached the client would send the answer twice, the request fails instead
+                    if attempt >= self.max_retries or not is_transient(e) or output["started"]:
+                        self.stats["failures"] += 1
+                        s.set("output_started", output["started"])
+                        raise
+                    error = e
+            #full jitter, so the clients that got a 429 together don't all come back at the same moment
+            delay = random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+            attempt += 1
+            self.stats["retries"] += 1
+            logging.warning(f"LLM call failed ({type(error).__name__}: {error}), retry {attempt}/{self.max_retries} in {delay:.2f}s")
+            await asyncio.sleep(delay)
@@ -1,8 +1,22 @@
 from fastapi import FastAPI, Query, Request 
+from fastapi.responses import StreamingResponse, PlainTextResponse
 from contextlib import asynccontextmanager
 
-from src.app.agent_workflow.agent_graph import ChatState, create_graph
+from src.app.agent_workflow.agent_graph import create_graph, default_llm_factory, new_turn
+from src.app.agent_workflow.llm_gateway import Llm_Gateway
+from src.app.agent_workflow.fast_router import Fast_Router
+from src.app.agent_workflow.conversation_memory import memory_node
+from src.app.api.sessions import Session_Store, open_checkpointer
+from src.app.rag_pipelines.general_rag_pipeline import Rag_Pipeline
+from src.app.api.response_cache import Response_Cache
+from src.app.code_sandbox.sandbox_pool import Sandbox_Pool
+from src.app.core.config import SESSION_DB_PATH
+from src.app.core.tracing import tracer, span, SERVER, new_request_id, current_request_id, set_request_id, reset_request_id
 from dotenv import load_dotenv
+import asyncio
+import json
+import logging
+import time
 import os
 
 load_dotenv()
@@ -10,14 +24,213 @@ google_api_key = os.getenv("GOOGLE_API_KEY") #You need to set your Google API ke
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    app.state.agent_graph = create_graph(google_api_key)
+    #pieces can be swapped before the app starts by putting them in app.state.overrides, the load test boots the real app
+    #with fakes that way (and so do the tests): rag, sandbox, llm_factory, gateway_options (kwargs of Llm_Gateway),
+    #session_db_path, response_cache
+    overrides = getattr(app.state, "overrides", {})
+    #the retrieval service is created once here and shared by every request
+    start = time.perf_counter()
+    rag = overrides.get("rag") or await asyncio.to_thread(Rag_Pipeline)
+    await rag.warmup()
+    logging.info(f"Retrieval service warmed up in {time.perf_counter() - start:.2f}s")
+    app.state.rag = rag
+    #a missing corpus or index is built in the background, rag requests answer without the docs until it's done
+    index_build = rag.start_index_build()
+    #code interpreter workers are started here too, so the first code request doesn't pay the imports
+    sandbox = overrides.get("sandbox") or Sandbox_Pool()
+    await sandbox.start()
+    app.state.sandbox = sandbox
+    #one llm gateway for the whole app, its limits are global and not per request
+    gateway = Llm_Gateway(overrides.get("llm_factory") or default_llm_factory(google_api_key), **overrides.get("gateway_options", {}))
+    app.state.llm_gateway = gateway
+    #two compiled graphs over the same pieces: standalone requests, and requests of a session (with the checkpointer)
+    sessions = Session_Store(await open_checkpointer(overrides.get("session_db_path", SESSION_DB_PATH)))
+    await sessions.setup()
+    app.state.sessions = sessions
+    graph_parts = dict(rag=rag, sandbox=sandbox, gateway=gateway, fast_router=Fast_Router(rag.embedded_model))
+    app.state.agent_graph = create_graph(google_api_key, **graph_parts)
+    app.state.session_graph = create_graph(google_api_key, checkpointer=sessions.checkpointer, **graph_parts)
+    #the cache reuses the warm MiniLM from the retrieval service for the similarity matches
+    app.state.response_cache = overrides.get("response_cache") or Response_Cache(rag.embedded_model)
+    eviction = asyncio.create_task(sessions.run_eviction())
     yield
+    eviction.cancel()
+    if index_build is not None:
+        index_build.cancel()
+    await sandbox.close()
+    await sessions.close()
+    if tracer.exporter is not None:
+        await asyncio.to_thread(tracer.exporter.flush)
+
+class Request_Context_Middleware:
+    #plain asgi and not BaseHTTPMiddleware, which would run the endpoint in another task and buffer the event streams
+    #every request gets an id (the client's X-Request-ID or a new one), sent back in the same header, and a server span
+    #that every span of the request (graph nodes, llm calls, searches...) ends up under
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        request_id = dict(scope["headers"]).get(b"x-request-id", b"").decode("latin-1").strip()[:128] or new_request_id()
+        token = set_request_id(request_id)
+        status = {}
+
+        async def send_with_id(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+                message["headers"] = list(message.get("headers", [])) + [(b"x-request-id", request_id.encode("latin-1"))]
+            await send(message)
+
+        try:
+            with span(scope["method"], SERVER, **{"http.method": scope["method"], "http.target": scope["path"]}) as s:
+                try:
+                    await self.app(scope, receive, send_with_id)
+                finally:
+                    #named after the route template, "/sessions/{session_id}" and not one name (one metric) per session,
+                    #and paths that match no route share one name too
+                    route = getattr(scope.get("route"), "path", None)
+                    s.name = f"{scope['method']} {route or 'unmatched'}"
+                    s.set("http.status_code", status.get("code"))
+        finally:
+            reset_request_id(token)
 
 chat_router = FastAPI(lifespan=lifespan)
+chat_router.add_middleware(Request_Context_Middleware)
+
+def cacheable(state: dict) -> bool:
+    #answers that went through the code interpreter are about that exact code, never reuse them
+    #and an answer written without a tool that timed out or failed is not worth keeping either
+    if any(call['tool'] == 'code_interpreter' for call in state.get('tool_calls', [])):
+        return False
+    return not any(result.get('error') for result in state.get('tool_results', []))
+
+def pick_graph(app_state, session_id):
+    return app_state.session_graph if session_id else app_state.agent_graph
+
+async def open_turn(agent_graph, sessions: Session_Store, session_id):
+    #-> (graph config, whether the shared response cache can be used)
+    if not session_id:
+        return None, True
+    config = sessions.config(session_id)
+    snapshot = await agent_graph.aget_state(config)
+    #a follow-up depends on the conversation, its answer can't come from (or go to) the shared cache
+    return config, not snapshot.values.get('history')
+
+async def close_turn(agent_graph, sessions: Session_Store, config, input, cached_output=None):
+    if config is None:
+        return
+    if cached_output is not None:
+        #the graph didn't run, the turn is written to the session memory here so the next follow-up has it
+        update = await memory_node({'input': input, 'output': cached_output}, get_llm=None)
+        await agent_graph.aupdate_state(config, update, as_node="memory")
+    await sessions.touch(config["configurable"]["thread_id"])
 
 @chat_router.get("/chat")
-async def create_app(request: Request, input: str = Query(...)):
-    agent_graph = request.app.state.agent_graph
-    state = ChatState(input=input)
-    state = await agent_graph.ainvoke(state)
-    return state
\ No newline at end of file
+async def create_app(request: Request, input: str = Query(...), session_id: str | None = Query(None)):
+    response_cache = request.app.state.response_cache
+    sessions = request.app.state.sessions
+    agent_graph = pick_graph(request.app.state, session_id)
+    config, use_cache = await open_turn(agent_graph, sessions, session_id)
+    cached = await response_cache.lookup(input) if use_cache else None
+    if cached is not None:
+        await close_turn(agent_graph, sessions, config, input, cached.get("output") or "")
+        return {**cached, "input": input, "cached": True, "request_id": current_request_id()}
+    state = await agent_graph.ainvoke(new_turn(input), config)
+    await close_turn(agent_graph, sessions, config, input)
+    if use_cache and cacheable(state):
+        await response_cache.store(input, {"output": state.get('output'), "tool_calls": state.get('tool_calls', [])})
+    return {**state, "request_id": current_request_id()}
+
+def sse_event(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+def progress_data(node: str, update: dict) -> dict:
+    #small summary of what a node just did, the ui shows it while the answer is not streaming yet
+    data = {"node": node}
+    if node == "router":
+        data["next_steps"] = update.get("next_steps")
+        data["route_source"] = update.get("route_source")
+    elif node in ("rag_retriever", "code_interpreter"):
+        results = [r for r in update.get("tool_results", []) if r['tool'] == node]
+        if node == "rag_retriever" and results and not results[-1].get('error'):
+            data["documents"] = results[-1].get('documents')
+            data["prompt_tokens_saved"] = (results[-1].get('stats') or {}).get('prompt_tokens_saved')
+    data["seconds"] = (update.get("timings") or {}).get(node)
+    return data
+
+async def stream_chat_events(agent_graph, response_cache, input: str, sessions: Session_Store = None, session_id: str = None):
+    #server-sent events: "progress" after every node, "token" for every final answer chunk and "done" at the end
+    #or "error" when the request fails: the 200 is already sent by then, so the client would only see the stream stop
+    try:
+        async for event in _chat_events(agent_graph, response_cache, input, sessions, session_id):
+            yield event
+    except Exception as e:
+        logging.error(f"Streamed request {current_request_id()} failed: {type(e).__name__}: {e}", exc_info=True)
+        yield sse_event("error", {"error": f"The answer could not be completed ({type(e).__name__}).",
+                                  "request_id": current_request_id()})
+
+async def _chat_events(agent_graph, response_cache, input: str, sessions: Session_Store = None, session_id: str = None):
+    config, use_cache = await open_turn(agent_graph, sessions, session_id)
+    cached = await response_cache.lookup(input) if use_cache else None
+    if cached is not None:
+        await close_turn(agent_graph, sessions, config, input, cached.get("output") or "")
+        yield sse_event("token", {"text": cached.get("output") or ""})
+        yield sse_event("done", {**cached, "input": input, "cached": True, "request_id": current_request_id()})
+        return
+    #nodes only send what they changed, the lists and timings are merged here the same way the graph reducers do
+    final_state = {"tool_calls": [], "tool_results": [], "timings": {}}
+    async for mode, chunk in agent_graph.astream(new_turn(input), config, stream_mode=["updates", "messages"]):
+        if mode == "messages":
+            message, metadata = chunk
+            #router and code interpreter also call LLMs, only the final answer goes to the user
+            if metadata.get("langgraph_node") == "final_answer" and message.content:
+                yield sse_event("token", {"text": message.content})
+        else:
+            for node, update in chunk.items():
+                update = update or {}
+                if node not in ("final_answer", "memory"):
+                    yield sse_event("progress", progress_data(node, update))
+                final_state["tool_calls"] += update.get("tool_calls", [])
+                final_state["tool_results"] += update.get("tool_results", [])
+                final_state["timings"].update(update.get("timings", {}))
+                if "output" in update:
+                    final_state["output"] = update["output"]
+    await close_turn(agent_graph, sessions, config, input)
+    if use_cache and cacheable(final_state):
+        await response_cache.store(input, {"output": final_state.get('output'), "tool_calls": final_state.get('tool_calls', [])})
+    yield sse_event("done", {"input": input, "output": final_state.get('output'), "timings": final_state["timings"], "cached": False,
+                             "request_id": current_request_id()})
+
+@chat_router.get("/chat/stream")
+async def stream_chat(request: Request, input: str = Query(...), session_id: str | None = Query(None)):
+    events = stream_chat_events(pick_graph(request.app.state, session_id), request.app.state.response_cache, input,
+                                request.app.state.sessions, session_id)
+    return StreamingResponse(events, media_type="text/event-stream", headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+@chat_router.get("/cache/stats")
+async def cache_stats(request: Request):
+    stats = request.app.state.response_cache.stats()
+    embedded_model = request.app.state.rag.embedded_model
+    if hasattr(embedded_model, "hit_rates"):
+        stats["embeddings"] = embedded_model.hit_rates()
+    return stats
+
+@chat_router.get("/llm/stats")
+async def llm_stats(request: Request):
+    return request.app.state.llm_gateway.stats
+
+@chat_router.get("/metrics")
+async def metrics():
+    #prometheus scrape endpoint, histograms of every traced operation plus token and cache counters
+    return PlainTextResponse(tracer.metrics.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+@chat_router.delete("/sessions/{session_id}")
+async def delete_session(request: Request, session_id: str):
+    await request.app.state.sessions.delete(session_id)
+    return {"deleted": session_id}
+
+@chat_router.get("/sessions/stats")
+async def session_stats(request: Request):
+    sessions = request.app.state.sessions
+    return {**sessions.stats, "sessions": await sessions.count()}
@@ -0,0 +1,203 @@
+import re
+import time
+import json
+import sqlite3
+import asyncio
+import threading
+from collections import OrderedDict
+import numpy as np
+
+from src.app.agent_workflow.fast_router import looks_like_code
+from src.app.core.config import (CACHE_BACKEND, CACHE_SQLITE_PATH, CACHE_SIMILARITY_THRESHOLD, CACHE_TTL_SECONDS,
+                                 CACHE_MAX_ENTRIES, CACHE_MAX_OUTPUT_CHARS)
+from src.app.core.tracing import span
+
+#students ask the same things over and over, so answers are cached in front of the whole graph
+#a lookup first tries the exact normalized text and then the closest cached question by embedding similarity
+#entries are {"input", "output", "vector", "created", "last_used"}
+#requests with code (same detection the router uses) bypass it, a "similar" snippet is a different question
+
+def normalize_text(text: str) -> str:
+    text = re.sub(r"\s+", " ", text.strip().lower())
+    return text.rstrip(" ?!.")
+
+class Memory_Cache_Backend:
+    def __init__(self):
+        self.entries = OrderedDict()
+
+    def get(self, key):
+        return self.entries.get(key)
+
+    def set(self, key, entry):
+        self.entries[key] = entry
+        self.entries.move_to_end(key)
+
+    def touch(self, key, last_used):
+        self.entries[key]["last_used"] = last_used
+        self.entries.move_to_end(key)
+
+    def delete(self, key):
+        self.entries.pop(key, None)
+
+    def least_recently_used(self, n):
+        return [key for key, _ in zip(self.entries, range(n))]
+
+    def items(self):
+        return list(self.entries.items())
+
+    def __len__(self):
+        return len(self.entries)
+
+class Sqlite_Cache_Backend:
+    def __init__(self, path=CACHE_SQLITE_PATH):
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.lock = threading.Lock()
+        with self.lock, self.conn:
+            self.conn.execute("""CREATE TABLE IF NOT EXISTS entries (key TEXT PRIMARY KEY, input TEXT, output TEXT,
+                                 vector BLOB, created REAL, last_used REAL)""")
+            self.conn.execute("CREATE INDEX IF NOT EXISTS entries_last_used ON entries (last_used)")
+
+    def _to_entry(self, row):
+        return {"input": row[0], "output": json.loads(row[1]), "vector": np.frombuffer(row[2], dtype=np.float32),
+                "created": row[3], "last_used": row[4]}
+
+    def get(self, key):
+        with self.lock:
+            row = self.conn.execute("SELECT input, output, vector, created, last_used FROM entries WHERE key = ?", (key,)).fetchone()
+        return self._to_entry(row) if row else None
+
+    def set(self, key, entry):
+        with self.lock, self.conn:
+            self.conn.execute("INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?, ?)",
+                              (key, entry["input"], json.dumps(entry["output"]), entry["vector"].astype(np.float32).tobytes(),
+                               entry["created"], entry["last_used"]))
+
+    def touch(self, key, last_used):
+        with self.lock, self.conn:
+            self.conn.execute("UPDATE entries SET last_used = ? WHERE key = ?", (last_used, key))
+
+    def delete(self, key):
+        with self.lock, self.conn:
+            self.conn.execute("DELETE FROM entries WHERE key = ?", (key,))
+
+    def least_recently_used(self, n):
+        with self.lock:
+            return [row[0] for row in self.conn.execute("SELECT key FROM entries ORDER BY last_used LIMIT ?", (n,))]
+
+    def items(self):
+        with self.lock:
+            rows = self.conn.execute("SELECT key, input, output, vector, created, last_used FROM entries").fetchall()
+        return [(row[0], self._to_entry(row[1:])) for row in rows]
+
+    def __len__(self):
+        with self.lock:
+            return self.conn.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+
+class Response_Cache:
+    def __init__(self, embedded_model, backend=None, threshold=CACHE_SIMILARITY_THRESHOLD, ttl=CACHE_TTL_SECONDS,
+                 max_entries=CACHE_MAX_ENTRIES, max_output_chars=CACHE_MAX_OUTPUT_CHARS):
+        self.embedded_model = embedded_model
+        self.backend = backend if backend is not None else make_cache_backend()
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_output_chars = max_output_chars
+        self.counters = {"hits_exact": 0, "hits_semantic": 0, "misses": 0, "bypassed": 0, "evicted": 0}
+        #every cached vector lives in memory too, the similarity scan is a single matrix product
+        self._keys = []
+        self._matrix = np.zeros((0, 0), dtype=np.float32)
+        self._load_vectors()
+
+    def _load_vectors(self):
+        now = time.time()
+        keys, vectors = [], []
+        for key, entry in self.backend.items():
+            if now - entry["created"] > self.ttl:
+                self.backend.delete(key)
+                continue
+            keys.append(key)
+            vectors.append(entry["vector"])
+        self._keys = keys
+        self._matrix = np.vstack(vectors).astype(np.float32) if vectors else np.zeros((0, 0), dtype=np.float32)
+
+    def _remove(self, key):
+        self.backend.delete(key)
+        if key in self._keys:
+            index = self._keys.index(key)
+            del self._keys[index]
+            self._matrix = np.delete(self._matrix, index, axis=0)
+
+    def _fresh(self, key, entry, now):
+        if now - entry["created"] > self.ttl:
+            self._remove(key)
+            return False
+        return True
+
+    async def _embed(self, text):
+        vector = np.asarray(await asyncio.to_thread(self.embedded_model.embed_query, text), dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    async def lookup(self, text: str):
+        #returns the cached output, or None when the graph has to run
+        if looks_like_code(text):
+            self.counters["bypassed"] += 1
+            return None
+        with span("cache.lookup") as s:
+            output, match = await self._lookup(text)
+            s.set("cache.hit", output is not None)
+            s.set("match", match)
+            return output
+
+    async def _lookup(self, text: str):
+        #-> (output, "exact" / "semantic" / None)
+        now = time.time()
+        key = normalize_text(text)
+        entry = self.backend.get(key)
+        if entry is not None and self._fresh(key, entry, now):
+            self.backend.touch(key, now)
+            self.counters["hits_exact"] += 1
+            return entry["output"], "exact"
+        if len(self._keys):
+            vector = await self._embed(text)
+            scores = self._matrix @ vector
+            best = int(np.argmax(scores))
+            if scores[best] >= self.threshold:
+                best_key = self._keys[best]
+                entry = self.backend.get(best_key)
+                if entry is not None and self._fresh(best_key, entry, now):
+                    self.backend.touch(best_key, now)
+                    self.counters["hits_semantic"] += 1
+                    return entry["output"], "semantic"
+        self.counters["misses"] += 1
+        return None, None
+
+    async def store(self, text: str, output: dict):
+        #output is the json-able part of the final state that should be served on a hit
+        if looks_like_code(text) or len(output.get("output") or "") > self.max_output_chars:
+            return
+        now = time.time()
+        key = normalize_text(text)
+        vector = await self._embed(text)
+        if key in self._keys:
+            self._remove(key)
+        self.backend.set(key, {"input": text, "output": output, "vector": vector, "created": now, "last_used": now})
+        self._keys.append(key)
+        self._matrix = vector[None, :] if not self._matrix.size else np.vstack([self._matrix, vector])
+        overflow = len(self._keys) - self.max_entries
+        if overflow > 0:
+            for old_key in self.backend.least_recently_used(overflow):
+                self._remove(old_key)
+                self.counters["evicted"] += 1
+
+    def stats(self):
+        lookups = self.counters["hits_exact"] + self.counters["hits_semantic"] + self.counters["misses"]
+        hits = self.counters["hits_exact"] + self.counters["hits_semantic"]
+        return {**self.counters, "entries": len(self._keys), "hit_rate": hits / lookups if lookups else 0.0}
+
+def make_cache_backend(kind=CACHE_BACKEND):
+    if kind == "memory":
+        return Memory_Cache_Backend()
+    if kind == "sqlite":
+        return Sqlite_Cache_Backend()
+    raise ValueError(f"Unknown cache backend: {kind}")
@@ -0,0 +1,87 @@
+import time
+import asyncio
+import logging
+import aiosqlite
+from langgraph.checkpoint.sqlite.aio import AsyncSqliteSaver
+
+from src.app.core.config import SESSION_DB_PATH, SESSION_TTL_SECONDS, SESSION_MAX_SESSIONS, SESSION_EVICT_INTERVAL
+
+#server side sessions: the conversation state lives in the langgraph checkpointer (sqlite, thread_id = session id)
+#and this keeps a small table next to it with when every session was last used, so it can evict:
+#   - sessions idle for more than the ttl, checked in the background
+#   - the least recently used ones when there are more than max_sessions
+#only the last checkpoint of a session is kept, langgraph saves one per step and we never go back in time
+
+async def open_checkpointer(path=SESSION_DB_PATH):
+    conn = await aiosqlite.connect(path)
+    checkpointer = AsyncSqliteSaver(conn)
+    await checkpointer.setup()
+    return checkpointer
+
+class Session_Store:
+    def __init__(self, checkpointer: AsyncSqliteSaver, ttl=SESSION_TTL_SECONDS, max_sessions=SESSION_MAX_SESSIONS):
+        self.checkpointer = checkpointer
+        self.ttl = ttl
+        self.max_sessions = max_sessions
+        self.stats = {"evicted_idle": 0, "evicted_cap": 0}
+
+    def config(self, session_id: str) -> dict:
+        return {"configurable": {"thread_id": session_id}}
+
+    async def setup(self):
+        #same connection and lock as the checkpointer, sqlite wants a single writer anyway
+        async with self.checkpointer.lock:
+            await self.checkpointer.conn.execute("CREATE TABLE IF NOT EXISTS sessions (id TEXT PRIMARY KEY, last_seen REAL, turns INTEGER)")
+            await self.checkpointer.conn.commit()
+
+    async def _execute(self, query, params=()):
+        async with self.checkpointer.lock:
+            cursor = await self.checkpointer.conn.execute(query, params)
+            rows = await cursor.fetchall()
+            await self.checkpointer.conn.commit()
+        return rows
+
+    async def touch(self, session_id: str):
+        #called after every turn: marks the session as used and drops the checkpoints older than the last one
+        await self._execute("""INSERT INTO sessions VALUES (?, ?, 1)
+                               ON CONFLICT(id) DO UPDATE SET last_seen = excluded.last_seen, turns = turns + 1""",
+                            (session_id, time.time()))
+        async with self.checkpointer.lock:
+            for table in ("checkpoints", "writes"):
+                await self.checkpointer.conn.execute(
+                    f"""DELETE FROM {table} WHERE thread_id = ? AND checkpoint_id != (
+                        SELECT MAX(checkpoint_id) FROM checkpoints WHERE thread_id = ?)""", (session_id, session_id))
+            await self.checkpointer.conn.commit()
+        overflow = (await self._execute("SELECT COUNT(*) FROM sessions"))[0][0] - self.max_sessions
+        if overflow > 0:
+            for (old_id,) in await self._execute("SELECT id FROM sessions ORDER BY last_seen LIMIT ?", (overflow,)):
+                await self.delete(old_id)
+                self.stats["evicted_cap"] += 1
+
+    async def delete(self, session_id: str):
+        await self.checkpointer.adelete_thread(session_id)
+        await self._execute("DELETE FROM sessions WHERE id = ?", (session_id,))
+
+    async def evict_idle(self) -> int:
+        idle = await self._execute("SELECT id FROM sessions WHERE last_seen < ?", (time.time() - self.ttl,))
+        for (session_id,) in idle:
+            await self.delete(session_id)
+        self.stats["evicted_idle"] += len(idle)
+        return len(idle)
+
+    async def run_eviction(self, interval=SESSION_EVICT_INTERVAL):
+        #background task of the api lifespan
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                evicted = await self.evict_idle()
+                if evicted:
+                    logging.info(f"Evicted {evicted} idle sessions")
+            except Exception as e:
+                logging.error(f"Session eviction failed: {e}")
+
+    async def count(self) -> int:
+        return (await self._execute("SELECT COUNT(*) FROM sessions"))[0][0]
+
+    async def close(self):
+        await self.checkpointer.conn.close()
@@ -0,0 +1,179 @@
+import os
+import sys
+import json
+import signal
+import asyncio
+import logging
+import time
+import shutil
+import tempfile
+
+from src.app.core.config import (SANDBOX_POOL_SIZE, SANDBOX_MAX_USES, SANDBOX_CPU_SECONDS, SANDBOX_WALL_SECONDS,
+                                 SANDBOX_MEMORY_MB, SANDBOX_MAX_OUTPUT_CHARS, SANDBOX_PRELOAD, SANDBOX_ENV_ALLOWLIST)
+from src.app.core.tracing import span
+
+#user code never runs inside the api process, it goes to a pool of pre-started python workers
+#each execution has a cpu time, wall clock and memory limit and runs in a fork of the worker (see sandbox_worker.py)
+#a worker is replaced after a crash, a timeout, a reply that doesn't parse, a caller that gave up while its code ran,
+#or max_uses executions, so a runaway snippet only ever takes down its own worker
+
+WORKER_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "sandbox_worker.py")
+
+class _Worker:
+    def __init__(self, process):
+        self.process = process
+        self.uses = 0
+
+    def kill(self):
+        #the whole process group (the worker has its own session), so the fork running the snippet goes too
+        if self.process.returncode is None:
+            try:
+                os.killpg(self.process.pid, signal.SIGKILL)
+            except ProcessLookupError:
+                pass
+
+def sandbox_env(home=None) -> dict:
+    #the user code gets none of the server's environment (api keys...), only the allowlisted variables
+    env = {name: os.environ[name] for name in SANDBOX_ENV_ALLOWLIST if name in os.environ}
+    if home is not None:
+        env["HOME"] = home
+    #one thread per blas library is plenty, and keeps a single snippet from eating every core
+    return {**env, "OMP_NUM_THREADS": "1", "OPENBLAS_NUM_THREADS": "1", "MKL_NUM_THREADS": "1"}
+
+class Sandbox_Pool:
+    def __init__(self, size=SANDBOX_POOL_SIZE, max_uses=SANDBOX_MAX_USES, cpu_seconds=SANDBOX_CPU_SECONDS,
+                 wall_seconds=SANDBOX_WALL_SECONDS, memory_mb=SANDBOX_MEMORY_MB, max_output_chars=SANDBOX_MAX_OUTPUT_CHARS,
+                 preload=SANDBOX_PRELOAD):
+        self.size = size
+        self.max_uses = max_uses
+        self.cpu_seconds = cpu_seconds
+        self.wall_seconds = wall_seconds
+        self.worker_config = json.dumps({"memory_mb": memory_mb, "max_output_chars": max_output_chars, "preload": preload})
+        self.idle = None
+        self.started = False
+        #working dir (and home) of the workers, an empty dir of their own: in the server's dir a snippet could read
+        #.env or the session and cache dbs with a relative path
+        self.workdir = None
+        self.workers = set()
+        self.stats = {"executions": 0, "timeouts": 0, "crashes": 0, "recycled": 0, "cancelled": 0}
+        self._start_lock = asyncio.Lock()
+
+    async def _spawn(self):
+        process = await asyncio.create_subprocess_exec(sys.executable, WORKER_PATH, self.worker_config,
+                                                       stdin=asyncio.subprocess.PIPE, stdout=asyncio.subprocess.PIPE,
+                                                       stderr=asyncio.subprocess.DEVNULL, env=sandbox_env(self.workdir),
+                                                       cwd=self.workdir, start_new_session=True)
+        worker = _Worker(process)
+        self.workers.add(worker)
+        #waits for the imports to finish, so an idle worker is always ready to run right away
+        ready = await process.stdout.readline()
+        if not ready:
+            self.workers.discard(worker)
+            raise RuntimeError("Sandbox worker failed to start")
+        return worker
+
+    async def _replace(self, worker: _Worker):
+        #runs in the background, the request that killed the worker doesn't wait for the new one
+        worker.kill()
+        await worker.process.wait()
+        self.workers.discard(worker)
+        if not self.started:
+            #the pool was closed meanwhile, and its dir is gone
+            return
+        try:
+            self.idle.put_nowait(await self._spawn())
+        except Exception as e:
+            logging.error(f"Could not replace sandbox worker: {e}")
+
+    async def start(self):
+        async with self._start_lock:
+            if self.started:
+                return
+            self.idle = asyncio.Queue()
+            self.workdir = tempfile.mkdtemp(prefix="sandbox-")
+            workers = await asyncio.gather(*[self._spawn() for _ in range(self.size)])
+            for worker in workers:
+                self.idle.put_nowait(worker)
+            self.started = True
+
+    def _crash_message(self, returncode):
+        if returncode in (-signal.SIGXCPU, -signal.SIGKILL):
+            return f"TimeoutError: the code went over the sandbox cpu time limit ({self.cpu_seconds}s)"
+        return f"RuntimeError: the sandbox worker crashed (exit code {returncode})"
+
+    def _error(self, start, error):
+        return {"stdout": "", "stderr": "", "result": None, "duration": time.perf_counter() - start, "error": error}
+
+    async def run(self, code: str) -> dict:
+        #returns {"stdout", "stderr", "result", "error", "duration"}
+        with span("sandbox.run", code_chars=len(code)) as s:
+            result = await self._run(code)
+            #the error of the user code (or of the sandbox limits), the span itself only fails when the pool does
+            s.set("sandbox.error", (result.get("error") or "").split(":")[0] or None)
+            return result
+
+    async def _run(self, code: str) -> dict:
+        await self.start()
+        worker = await self.idle.get()
+        start = time.perf_counter()
+        self.stats["executions"] += 1
+        healthy = False
+        try:
+            result, healthy = await self._execute(worker, code, start)
+            return result
+        except BaseException:
+            #the caller gave up while the code runs (branch deadline, client gone): the reply would go to the next caller
+            self.stats["cancelled"] += 1
+            raise
+        finally:
+            #only a worker that gave a clean reply goes back to the pool, any other one is killed and replaced in the
+            #background, the request that broke it doesn't wait for the new one
+            if healthy and worker.uses < self.max_uses:
+                self.idle.put_nowait(worker)
+            else:
+                if healthy:
+                    self.stats["recycled"] += 1
+                worker.kill()
+                asyncio.create_task(self._replace(worker))
+
+    async def _execute(self, worker: _Worker, code: str, start: float):
+        #-> (result, whether the worker can take another request)
+        try:
+            worker.process.stdin.write((json.dumps({"code": code, "cpu_seconds": self.cpu_seconds}) + "\n").encode())
+            await worker.process.stdin.drain()
+            line = await asyncio.wait_for(worker.process.stdout.readline(), timeout=self.wall_seconds)
+        except asyncio.TimeoutError:
+            self.stats["timeouts"] += 1
+            return self._error(start, f"TimeoutError: the code went over the sandbox wall clock limit ({self.wall_seconds}s)"), False
+        except (BrokenPipeError, ConnectionResetError):
+            line = b""
+        if not line:
+            self.stats["crashes"] += 1
+            return self._error(start, self._crash_message(await worker.process.wait())), False
+        try:
+            result = json.loads(line)
+        except ValueError:
+            result = None
+        if not isinstance(result, dict):
+            #the worker itself is broken, nothing it sends can be trusted anymore
+            self.stats["crashes"] += 1
+            return self._error(start, "RuntimeError: the sandbox worker sent an invalid reply"), False
+        worker.uses += 1
+        return {**result, "duration": time.perf_counter() - start}, True
+
+    async def close(self):
+        for worker in list(self.workers):
+            worker.kill()
+            await worker.process.wait()
+        self.workers.clear()
+        self.started = False
+        if self.workdir is not None:
+            shutil.rmtree(self.workdir, ignore_errors=True)
+            self.workdir = None
+
+def format_sandbox_result(result: dict) -> str:
+    #text that goes to the explainer LLM, close to what the old PythonAstREPLTool returned
+    parts = [result[key] for key in ("stdout", "stderr", "result") if result.get(key)]
+    if result.get("error"):
+        parts.append(result["error"])
+    return "\n".join(part.rstrip("\n") for part in parts)
@@ -0,0 +1,138 @@
+import io
+import os
+import sys
+import ast
+import json
+import signal
+import resource
+import importlib
+import traceback
+import contextlib
+
+#worker process of the sandbox pool, started with: python -m src.app.code_sandbox.sandbox_worker
+#protocol: one json per line, the parent writes {"code", "cpu_seconds"} and reads {"stdout", "stderr", "result", "error"}
+#the protocol uses private copies of stdin/stdout, so the user code printing or calling input() can't break it
+#every snippet runs in a fork of the worker, so whatever it changes (builtins, module attributes, globals of a library)
+#is gone with the fork and the next user gets the worker as it was preloaded
+
+#taken before any user code runs, a snippet that patches json in its fork can only break its own reply
+_dumps = json.dumps
+
+def _protocol_streams():
+    proto_in = os.fdopen(os.dup(0), 'r', encoding='utf-8')
+    proto_out = os.fdopen(os.dup(1), 'w', encoding='utf-8')
+    devnull = os.open(os.devnull, os.O_RDWR)
+    os.dup2(devnull, 0)
+    os.dup2(devnull, 1)
+    return proto_in, proto_out
+
+def _preload(modules):
+    #the whole point of pre-forking: numpy/pandas/sklearn are already imported when a request arrives
+    for name in modules:
+        try:
+            importlib.import_module(name)
+        except ImportError:
+            pass
+
+def _limit_memory(memory_mb):
+    if memory_mb:
+        limit = memory_mb * 1024 * 1024
+        resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+
+def _limit_cpu(cpu_seconds):
+    #the limit is absolute for the process, so it's set relative to what the process already used
+    #going over it sends SIGXCPU and kills the fork running the snippet, the worker reports it
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    used = int(usage.ru_utime + usage.ru_stime)
+    _, hard = resource.getrlimit(resource.RLIMIT_CPU)
+    soft = used + cpu_seconds + 1
+    if hard != resource.RLIM_INFINITY and soft > hard:
+        soft = hard
+    resource.setrlimit(resource.RLIMIT_CPU, (soft, hard))
+
+def _truncate(text, max_chars):
+    if len(text) > max_chars:
+        return text[:max_chars] + f"\n... [truncated {len(text) - max_chars} chars]"
+    return text
+
+def execute(code: str, max_chars: int) -> dict:
+    #same semantics as PythonAstREPLTool: run every statement and return the value of the last one if it's an expression
+    stdout, stderr = io.StringIO(), io.StringIO()
+    result, error = None, None
+    namespace = {"__name__": "__main__"}
+    with contextlib.redirect_stdout(stdout), contextlib.redirect_stderr(stderr):
+        try:
+            tree = ast.parse(code, filename="<sandbox>")
+            last = tree.body[-1] if tree.body and isinstance(tree.body[-1], ast.Expr) else None
+            body = tree.body[:-1] if last is not None else tree.body
+            exec(compile(ast.Module(body=body, type_ignores=[]), "<sandbox>", "exec"), namespace)
+            if last is not None:
+                value = eval(compile(ast.Expression(body=last.value), "<sandbox>", "eval"), namespace)
+                if value is not None:
+                    result = repr(value)
+        except SyntaxError as e:
+            error = "".join(traceback.format_exception_only(type(e), e))
+        except MemoryError:
+            error = "MemoryError: the code went over the sandbox memory limit"
+        except BaseException as e:
+            #skips the frame of this function, the user only needs to see their own code
+            tb = e.__traceback__.tb_next if e.__traceback__ is not None else None
+            error = "".join(traceback.format_exception(type(e), e, tb))
+    return {"stdout": _truncate(stdout.getvalue(), max_chars), "stderr": _truncate(stderr.getvalue(), max_chars),
+            "result": _truncate(result, max_chars) if result is not None else None, "error": error}
+
+def _error(message):
+    return {"stdout": "", "stderr": "", "result": None, "error": message}
+
+def run_forked(request: dict, max_chars: int, protocol_fds=()) -> dict:
+    #the fork inherits the preloaded modules (copy on write, a few ms) and sends its result back through a pipe
+    cpu_seconds = request.get("cpu_seconds", 5)
+    read_fd, write_fd = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        status = 1
+        try:
+            os.close(read_fd)
+            #the user code can't write to the protocol of the worker either
+            for fd in protocol_fds:
+                os.close(fd)
+            _limit_cpu(cpu_seconds)
+            reply = _dumps(execute(request["code"], max_chars)).encode('utf-8')
+            with os.fdopen(write_fd, 'wb') as f:
+                f.write(reply)
+            status = 0
+        finally:
+            #never back in the loop of the worker, whatever happened
+            os._exit(status)
+    os.close(write_fd)
+    #read everything before waiting, a big reply would otherwise block the fork on a full pipe
+    with os.fdopen(read_fd, 'rb') as f:
+        reply = f.read()
+    _, status = os.waitpid(pid, 0)
+    if os.WIFSIGNALED(status):
+        if os.WTERMSIG(status) in (signal.SIGXCPU, signal.SIGKILL):
+            return _error(f"TimeoutError: the code went over the sandbox cpu time limit ({cpu_seconds}s)")
+        return _error(f"RuntimeError: the code crashed the sandbox (signal {os.WTERMSIG(status)})")
+    try:
+        response = json.loads(reply)
+    except ValueError:
+        response = None
+    if not isinstance(response, dict) or set(response) != {"stdout", "stderr", "result", "error"}:
+        return _error("RuntimeError: the code broke the sandbox reply")
+    return response
+
+def main():
+    config = json.loads(sys.argv[1]) if len(sys.argv) > 1 else {}
+    proto_in, proto_out = _protocol_streams()
+    _preload(config.get("preload", []))
+    _limit_memory(config.get("memory_mb"))
+    proto_out.write(json.dumps({"ready": True}) + "\n")
+    proto_out.flush()
+    for line in proto_in:
+        request = json.loads(line)
+        response = run_forked(request, config.get("max_output_chars", 10000), (proto_in.fileno(), proto_out.fileno()))
+        proto_out.write(json.dumps(response) + "\n")
+        proto_out.flush()
+
+if __name__ == "__main__":
+    main()
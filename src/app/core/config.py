@@ -13,4 +13,166 @@ URLS_GUIDES = ['https://developers.google.com/machine-learning/guides/good-data-
                'https://developers.google.com/machine-learning/guides/deep-learning-tuning-playbook?hl=pt-br',
                'https://mlguidebook.com/en/latest',
                'https://pub.towardsai.net/the-ultimate-beginner-to-advance-guide-to-machine-learning-b4dd361aefbb',
-               'https://spark.apache.org/docs/latest/quick-start.html']
\ No newline at end of file
+               'https://spark.apache.org/docs/latest/quick-start.html']
+
+#shared paths and model names, so every component points to the same place
+EMBEDDING_MODEL_NAME = "sentence-transformers/all-MiniLM-L6-v2"
+CHROMA_DIR = "./src/chroma_db"
+#scrapped corpus, one parquet row per chunk. the old data.csv is still read when it's the only corpus there
+CORPUS_PATH = "src/data/corpus.parquet"
+DATA_CSV_PATH = "src/data/data.csv"
+
+
+#crawler settings, depth follows the old RecursiveUrlLoader meaning (2 = seed page + its children)
+CRAWL_MAX_DEPTH = 2
+CRAWL_MAX_CONCURRENCY = 32
+CRAWL_MAX_PER_HOST = 4
+CRAWL_TIMEOUT = 20
+#html extraction, boilerplate stripping and chunking run in this many processes while the fetches go on, None = every core,
+#0 = a thread of the crawler process like before
+CRAWL_PARSE_WORKERS = None
+#chunks per parquet row group, what the indexer reads at a time
+CORPUS_ROW_GROUP_SIZE = 4096
+#a crawl that gets no page, or fewer pages than this share of the corpus it would replace (sites down, blocked, no network),
+#is thrown away and the old corpus is kept, otherwise the next indexer run would delete most of the store
+CORPUS_MIN_PAGES_RATIO = 0.5
+
+#chunking settings, shared by every piece that reads the corpus so the chunk ids stay stable
+CHUNK_SIZE = 1000
+CHUNK_OVERLAP = 200
+INDEX_MANIFEST_PATH = "./src/index_manifest.sqlite"
+
+#streaming ingestion, chunks per embedding forward pass and how many batches can wait between stages
+EMBED_BATCH_SIZE = 64
+INGEST_QUEUE_SIZE = 4
+
+#persistent embedding cache shared by ingestion and queries, one sub dir per model
+EMBEDDING_CACHE_ENABLED = True
+EMBEDDING_CACHE_DIR = "./src/embedding_cache"
+EMBEDDING_CACHE_LRU_SIZE = 4096
+
+#hybrid retrieval: dense (chroma) + lexical (bm25) fused with reciprocal rank fusion
+BM25_DIR = "./src/bm25_index"
+BM25_K1 = 1.5
+BM25_B = 0.75
+RETRIEVAL_K = 4
+RETRIEVAL_FETCH_K = 20
+RRF_K = 60
+DENSE_WEIGHT = 1.0
+LEXICAL_WEIGHT = 1.0
+#the index is sharded per library: one chroma collection per key, picked from the source url (domain + path prefix)
+#sources that match nothing go to the general shard
+LIBRARY_SOURCES = {
+    "sklearn": ["scikit-learn.org"],
+    "tensorflow": ["tensorflow.org"],
+    "pytorch": ["pytorch.org"],
+    "pandas": ["pandas.pydata.org"],
+    "numpy": ["numpy.org"],
+    "matplotlib": ["matplotlib.org"],
+    "seaborn": ["seaborn.pydata.org"],
+    "plotly": ["plotly.com"],
+    "spark": ["spark.apache.org"],
+    "ml_guides": ["developers.google.com/machine-learning", "mlguidebook.com", "pub.towardsai.net"],
+}
+GENERAL_LIBRARY = "general"
+#query side, a question that names one of these only searches that library's shard, otherwise every shard
+#only names that belong to a single library: short aliases and generic words route questions away from where the answer is
+#("tf" matches tf-idf, reshape/arange/dataframe/groupby are numpy, torch and spark too, heatmap is seaborn, matplotlib and plotly)
+#dotted names only match as a whole, "nn.module" and not "module"
+LIBRARY_KEYWORDS = {
+    "sklearn": ["sklearn", "scikit", "standardscaler", "gridsearchcv", "onehotencoder",
+                "train_test_split", "cross_val_score", "randomforestclassifier", "logisticregression"],
+    "tensorflow": ["tensorflow", "keras", "tf.data", "tf.keras"],
+    "pytorch": ["pytorch", "torch", "dataloader", "nn.module", "torchvision"],
+    "pandas": ["pandas", "merge_asof", "read_csv", "read_parquet", "iloc"],
+    "numpy": ["numpy", "ndarray"],
+    "matplotlib": ["matplotlib", "plt", "pyplot", "savefig"],
+    "seaborn": ["seaborn", "sns", "pairplot"],
+    "plotly": ["plotly", "plotly.express"],
+    "spark": ["spark", "pyspark", "sparksession", "rdd"],
+}
+#False searches every shard every time, a routed search that finds fewer than RETRIEVAL_K chunks is retried on every shard
+SHARD_ROUTING = True
+
+#vector backend of the shards: "chroma", or "ivf": int8 vectors in memory-mapped files behind an inverted file index, the
+#best IVF_RESCORE candidates re-scored with the exact float32 vectors. it opens without reading the vectors (a new worker serves
+#in milliseconds) and only the probed lists are paged in. IVF_NLIST None is 2 * sqrt(chunks), IVF_NPROBE lists searched per query
+VECTOR_BACKEND = "chroma"
+IVF_DIR = "./src/ivf_index"
+IVF_NLIST = None
+IVF_NPROBE = 16
+IVF_RESCORE = 100
+
+#context of the final answer: RERANK_CANDIDATES hybrid hits, near duplicates dropped (shingle containment over the threshold),
+#re-ranked by a small cpu cross-encoder and packed in RAG_CONTEXT_TOKENS estimated tokens
+#past RERANK_BUDGET_MS the re-ranking is given up and the retrieval order is kept
+RERANK_ENABLED = True
+RERANK_MODEL_NAME = "cross-encoder/ms-marco-MiniLM-L-6-v2"
+RERANK_CANDIDATES = 20
+RERANK_BUDGET_MS = 300
+#when the measured cost says nothing fits the budget, one call out of this many still re-ranks a small head to measure again
+RERANK_PROBE_EVERY = 20
+DEDUP_THRESHOLD = 0.8
+RAG_CONTEXT_TOKENS = 800
+
+#concurrent retrieval queries are embedded and searched in one batch, 1 turns the batching off
+#the wait is how long a batch waits for more requests, 0 still batches whatever queued up during the previous batch
+RETRIEVAL_BATCH_MAX_SIZE = 32
+RETRIEVAL_BATCH_MAX_WAIT_MS = 0
+
+#response cache in front of the agent graph, backend is "memory" or "sqlite"
+CACHE_BACKEND = "memory"
+CACHE_SQLITE_PATH = "./src/response_cache.sqlite"
+CACHE_SIMILARITY_THRESHOLD = 0.92
+CACHE_TTL_SECONDS = 24 * 60 * 60
+CACHE_MAX_ENTRIES = 5000
+CACHE_MAX_OUTPUT_CHARS = 20000
+
+#local router, below this confidence the LLM router decides
+ROUTER_MIN_CONFIDENCE = 0.6
+ROUTER_SOFTMAX_TEMPERATURE = 0.05
+ROUTER_MAX_RETRIES = 3
+
+#sessions: conversation state in a langgraph sqlite checkpointer, evicted after an idle ttl or over the cap
+SESSION_DB_PATH = "./src/sessions.sqlite"
+SESSION_TTL_SECONDS = 2 * 60 * 60
+SESSION_MAX_SESSIONS = 1000
+SESSION_EVICT_INTERVAL = 60
+#conversation memory in the prompt, estimated tokens: recent turns, rolling summary and the cap of a single message
+MEMORY_TOKEN_BUDGET = 1500
+MEMORY_SUMMARY_TOKENS = 300
+MEMORY_MAX_TURN_TOKENS = 500
+
+#llm gateway, shared by every node: max calls in flight, request rate (token bucket) and retries of transient errors
+LLM_MAX_CONCURRENCY = 16
+LLM_RATE_PER_SECOND = 20
+LLM_BURST = 40
+LLM_MAX_RETRIES = 4
+LLM_BACKOFF_BASE = 0.5
+LLM_BACKOFF_MAX = 8
+LLM_CALL_TIMEOUT = 60
+
+#deadline of every tool branch of the agent graph, past it the answer is written without that tool
+TOOL_TIMEOUT_SECONDS = {"rag_retriever": 10, "code_interpreter": 30}
+
+#tracing: a span per request, graph node, embedding, search, crawl fetch, sandbox run and llm call
+#exported as OpenTelemetry (OTLP json) spans, "file" appends them to TRACE_FILE_PATH, "console" logs them
+#metrics: the spans are also aggregated into prometheus histograms/counters served on /metrics
+#with both off a span is a shared no-op object
+TRACING_ENABLED = False
+TRACE_EXPORTER = "file"
+TRACE_FILE_PATH = "./src/traces.jsonl"
+METRICS_ENABLED = True
+METRICS_BUCKETS = [0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30]
+SERVICE_NAME = "ml-tutorbot"
+
+#code interpreter sandbox, a pool of python worker processes with per execution limits
+SANDBOX_POOL_SIZE = 4
+SANDBOX_MAX_USES = 50
+SANDBOX_CPU_SECONDS = 5
+SANDBOX_WALL_SECONDS = 10
+SANDBOX_MEMORY_MB = 2048
+SANDBOX_MAX_OUTPUT_CHARS = 10000
+SANDBOX_PRELOAD = ["numpy", "pandas", "sklearn"]
+#the only environment variables the workers get, nothing else of the server's environment (api keys) reaches the user code
+SANDBOX_ENV_ALLOWLIST = ["PATH", "HOME", "LANG", "LC_ALL", "LC_CTYPE", "TZ", "TMPDIR"]
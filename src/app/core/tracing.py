@@ -0,0 +1,277 @@
+import json
+import time
+import bisect
+import uuid
+import queue
+import random
+import logging
+import threading
+import contextvars
+
+from src.app.core.config import (TRACING_ENABLED, TRACE_EXPORTER, TRACE_FILE_PATH, METRICS_ENABLED, METRICS_BUCKETS,
+                                 SERVICE_NAME)
+
+#per request tracing without the opentelemetry sdk: spans are plain objects kept in a contextvar (so asyncio tasks and
+#asyncio.to_thread inherit the parent), written out in the OTLP json format (one ExportTraceServiceRequest per line, the
+#same as the collector's file exporter) by a background thread, and aggregated into prometheus metrics
+#span attributes with a meaning for the metrics:
+#   tokens.<kind>   counted in tutorbot_tokens_total{span, kind}
+#   cache.hit       counted in tutorbot_cache_lookups_total{span, result}
+#   cache.hits / cache.misses   the same for a batch of lookups
+#usage: with span("llm.call", model=model) as s: ...; s.set("tokens.output", n)
+
+_current_span = contextvars.ContextVar("current_span", default=None)
+_request_id = contextvars.ContextVar("request_id", default=None)
+
+def new_request_id() -> str:
+    return uuid.uuid4().hex
+
+def current_request_id():
+    return _request_id.get()
+
+def set_request_id(request_id: str):
+    #returns the token to give back to reset_request_id
+    return _request_id.set(request_id)
+
+def reset_request_id(token):
+    _request_id.reset(token)
+
+def current_span_context():
+    #(trace id, span id) of the active span, what a span started in another task links to (micro-batches)
+    current = _current_span.get()
+    return (current.trace_id, current.span_id) if current is not None and current.span_id is not None else None
+
+class Span:
+    __slots__ = ("name", "kind", "trace_id", "span_id", "parent_id", "request_id", "attributes", "links", "start_ns",
+                 "start", "duration", "error", "_token")
+    #False on the no-op span, for the attributes that cost something to compute
+    recording = True
+
+    def __init__(self, name, kind, attributes, links):
+        parent = _current_span.get()
+        self.name = name
+        self.kind = kind
+        if tracer.exporter is not None:
+            self.trace_id = parent.trace_id if parent is not None and parent.trace_id else f"{random.getrandbits(128):032x}"
+            self.span_id = f"{random.getrandbits(64):016x}"
+        else:
+            #metrics only, nobody will read the ids
+            self.trace_id = self.span_id = None
+        self.parent_id = parent.span_id if parent is not None else None
+        self.request_id = _request_id.get()
+        self.attributes = attributes
+        self.links = links
+        self.duration = None
+        self.error = None
+
+    def set(self, key, value):
+        self.attributes[key] = value
+
+    def __enter__(self):
+        self._token = _current_span.set(self)
+        self.start_ns = time.time_ns()
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.duration = time.perf_counter() - self.start
+        if exc is not None and not isinstance(exc, GeneratorExit):
+            self.error = f"{exc_type.__name__}: {exc}"
+        _current_span.reset(self._token)
+        tracer.finish(self)
+        return False
+
+    def to_otlp(self) -> dict:
+        attributes = dict(self.attributes)
+        if self.request_id is not None:
+            attributes["request.id"] = self.request_id
+        otlp = {"traceId": self.trace_id, "spanId": self.span_id, "name": self.name, "kind": self.kind,
+                "startTimeUnixNano": str(self.start_ns), "endTimeUnixNano": str(self.start_ns + int(self.duration * 1e9)),
+                "attributes": [{"key": key, "value": otlp_value(value)} for key, value in attributes.items() if value is not None],
+                "status": {"code": 2, "message": self.error} if self.error else {"code": 1}}
+        if self.parent_id is not None:
+            otlp["parentSpanId"] = self.parent_id
+        if self.links:
+            otlp["links"] = [{"traceId": trace_id, "spanId": span_id} for trace_id, span_id in self.links]
+        return otlp
+
+class _Noop_Span:
+    #what span() gives when tracing and metrics are both off, one shared object and nothing recorded
+    recording = False
+
+    def set(self, key, value):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+NOOP_SPAN = _Noop_Span()
+
+#otlp span kinds
+INTERNAL, SERVER, CLIENT = 1, 2, 3
+
+def otlp_value(value) -> dict:
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    if isinstance(value, (list, tuple)):
+        return {"arrayValue": {"values": [otlp_value(item) for item in value]}}
+    return {"stringValue": str(value)}
+
+class Jsonl_Span_Exporter:
+    #the request path only puts the span in a queue, serializing and writing happen in a daemon thread
+    def __init__(self, path=TRACE_FILE_PATH, flush_interval=1.0):
+        self.path = path
+        self.flush_interval = flush_interval
+        self.queue = queue.SimpleQueue()
+        self.write_lock = threading.Lock()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def export(self, span: Span):
+        self.queue.put(span)
+
+    def _drain(self, first):
+        spans = [first]
+        while True:
+            try:
+                spans.append(self.queue.get_nowait())
+            except queue.Empty:
+                return spans
+
+    def _write(self, spans):
+        request = {"resourceSpans": [{"resource": {"attributes": [{"key": "service.name", "value": {"stringValue": SERVICE_NAME}}]},
+                                      "scopeSpans": [{"scope": {"name": SERVICE_NAME}, "spans": [span.to_otlp() for span in spans]}]}]}
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(request) + "\n")
+
+    def _run(self):
+        while True:
+            first = self.queue.get()
+            with self.write_lock:
+                spans = self._drain(first)
+                try:
+                    self._write(spans)
+                except Exception as e:
+                    logging.error(f"Could not write {len(spans)} spans to {self.path}: {e}")
+            time.sleep(self.flush_interval)
+
+    def flush(self, timeout=5.0):
+        deadline = time.monotonic() + timeout
+        while not self.queue.empty() and time.monotonic() < deadline:
+            time.sleep(0.01)
+        #the batch taken out of the queue last may still be on its way to the file
+        with self.write_lock:
+            pass
+
+class Console_Span_Exporter:
+    def export(self, span: Span):
+        logging.info(f"span {json.dumps(span.to_otlp())}")
+
+    def flush(self, timeout=5.0):
+        pass
+
+def escape_label(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+class Metrics_Registry:
+    #prometheus histograms and counters, labels are a tuple of (name, value) pairs
+    def __init__(self, buckets=METRICS_BUCKETS):
+        self.buckets = list(buckets)
+        self.lock = threading.Lock()
+        self.histograms = {}
+        self.counters = {}
+        self.help = {}
+
+    def observe(self, name, labels, value, help=""):
+        with self.lock:
+            self.help.setdefault(name, help)
+            series = self.histograms.setdefault(name, {}).get(labels)
+            if series is None:
+                series = self.histograms[name][labels] = [[0] * len(self.buckets), 0.0, 0]
+            #per bucket counts, made cumulative when rendered, so an observation is one bisect and not a loop on the buckets
+            i = bisect.bisect_left(self.buckets, value)
+            if i < len(self.buckets):
+                series[0][i] += 1
+            series[1] += value
+            series[2] += 1
+
+    def inc(self, name, labels, value=1, help=""):
+        with self.lock:
+            self.help.setdefault(name, help)
+            counter = self.counters.setdefault(name, {})
+            counter[labels] = counter.get(labels, 0) + value
+
+    def render(self) -> str:
+        #prometheus text exposition format 0.0.4
+        def label_text(labels, extra=()):
+            pairs = list(labels) + list(extra)
+            if not pairs:
+                return ""
+            return "{" + ",".join(f'{key}="{escape_label(value)}"' for key, value in pairs) + "}"
+        lines = []
+        with self.lock:
+            for name, series in self.histograms.items():
+                lines += [f"# HELP {name} {self.help.get(name, '')}", f"# TYPE {name} histogram"]
+                for labels, (counts, total, count) in series.items():
+                    cumulative = 0
+                    for bound, bucket_count in zip(self.buckets, counts):
+                        cumulative += bucket_count
+                        lines.append(f"{name}_bucket{label_text(labels, [('le', bound)])} {cumulative}")
+                    lines.append(f"{name}_bucket{label_text(labels, [('le', '+Inf')])} {count}")
+                    lines.append(f"{name}_sum{label_text(labels)} {total}")
+                    lines.append(f"{name}_count{label_text(labels)} {count}")
+            for name, series in self.counters.items():
+                lines += [f"# HELP {name} {self.help.get(name, '')}", f"# TYPE {name} counter"]
+                for labels, value in series.items():
+                    lines.append(f"{name}{label_text(labels)} {value}")
+        return "\n".join(lines) + "\n"
+
+class Tracer:
+    def __init__(self, enabled=TRACING_ENABLED, exporter=TRACE_EXPORTER, metrics_enabled=METRICS_ENABLED):
+        self.metrics = Metrics_Registry()
+        self.exporter = None
+        self.configure(enabled, exporter, metrics_enabled)
+
+    def configure(self, enabled=False, exporter=TRACE_EXPORTER, metrics_enabled=METRICS_ENABLED, path=TRACE_FILE_PATH):
+        #exporter is "file", "console" or an object with export(span) / flush()
+        if enabled and isinstance(exporter, str):
+            exporter = Jsonl_Span_Exporter(path) if exporter == "file" else Console_Span_Exporter()
+        self.exporter = exporter if enabled else None
+        self.metrics_enabled = metrics_enabled
+        self.active = self.exporter is not None or metrics_enabled
+
+    def span(self, name, kind=INTERNAL, links=None, **attributes):
+        if not self.active:
+            return NOOP_SPAN
+        return Span(name, kind, attributes, links)
+
+    def finish(self, span: Span):
+        if self.metrics_enabled:
+            labels = (("span", span.name),)
+            self.metrics.observe("tutorbot_span_duration_seconds", labels, span.duration, "Duration of the traced operations")
+            if span.error:
+                self.metrics.inc("tutorbot_span_errors_total", labels, help="Traced operations that raised")
+            for key, value in span.attributes.items():
+                if key.startswith("tokens.") and isinstance(value, (int, float)):
+                    self.metrics.inc("tutorbot_tokens_total", labels + (("kind", key[len("tokens."):]),), value,
+                                     "Tokens sent to / received from the llms, estimated when the provider doesn't say")
+                elif key == "cache.hit" and value is not None:
+                    self.metrics.inc("tutorbot_cache_lookups_total", labels + (("result", "hit" if value else "miss"),),
+                                     help="Cache lookups by result")
+                elif key in ("cache.hits", "cache.misses") and value:
+                    self.metrics.inc("tutorbot_cache_lookups_total", labels + (("result", key[len("cache."):-1]),), value,
+                                     "Cache lookups by result")
+        if self.exporter is not None:
+            self.exporter.export(span)
+
+tracer = Tracer()
+
+def span(name, kind=INTERNAL, links=None, **attributes):
+    return tracer.span(name, kind, links, **attributes)
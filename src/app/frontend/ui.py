@@ -1,7 +1,7 @@
 import gradio as gr
 import requests
-import time
 import json
+import uuid
 import os
 
 BOT_AVATAR_PATH = os.path.join(
@@ -10,7 +10,15 @@ BOT_AVATAR_PATH = os.path.join(
     "ML-TutorBot.jpg"
 )
 
-CHAT_URL = "http://localhost:8000/chat?input={input}"
+STREAM_URL = "http://localhost:8000/chat/stream"
+SESSIONS_URL = "http://localhost:8000/sessions"
+
+#what to show while the graph is working and no token arrived yet
+PROGRESS_MESSAGES = {
+    "router": "🧭 Thinking about the best way to answer...",
+    "rag_retriever": "📚 Found relevant documentation, writing the answer...",
+    "code_interpreter": "🐍 Ran your code, writing the explanation...",
+}
 
 # --- Custom CSS for styling (versão final e mais abrangente) ---
 custom_css = """
@@ -50,7 +58,22 @@ custom_css = """
 }
 """
 
-def stream_chat(message: str, history: list):
+def iter_sse(response):
+    #minimal server-sent events parser, yields (event, data) with the data already decoded
+    event, data = "message", []
+    for line in response.iter_lines(decode_unicode=True):
+        if line is None:
+            continue
+        if line == "":
+            if data:
+                yield event, json.loads("\n".join(data))
+            event, data = "message", []
+        elif line.startswith("event:"):
+            event = line[len("event:"):].strip()
+        elif line.startswith("data:"):
+            data.append(line[len("data:"):].strip())
+
+def stream_chat(message: str, history: list, session_id: str):
     """
     Handles the chat logic, streaming the response to the UI.
     This function is a generator, yielding updates to the UI step-by-step.
@@ -65,28 +88,54 @@ def stream_chat(message: str, history: list):
         stop_btn: gr.Button("Stop", variant="stop", visible=True),
     }
 
+    #one id per message, the backend puts it on the traces of the request, so an error report can be found there
+    request_id = uuid.uuid4().hex
     try:
-        response = requests.get(CHAT_URL.format(input=message), timeout=20)
-        response.raise_for_status()  
-        
-        full_response = response.json().get("output", "Sorry, I couldn't get a response.")
-
-        for i in range(0, len(full_response), 5):
-            time.sleep(0.01) 
-            chunk = full_response[i:i+5]
-            history[-1][1] += chunk
+        #the backend answers with server-sent events, tokens are rendered as soon as they arrive
+        #the conversation memory is kept by the backend under this session id, one per browser tab
+        response = requests.get(STREAM_URL, params={"input": message, "session_id": session_id}, stream=True, timeout=(5, 120),
+                                headers={"X-Request-ID": request_id})
+        response.raise_for_status()
+
+        streaming = False
+        finished = False
+        for event, data in iter_sse(response):
+            if event == "progress" and not streaming:
+                history[-1][1] = f"*{PROGRESS_MESSAGES.get(data.get('node'), 'Working...')}*"
+                yield {chatbot: history}
+            elif event == "token":
+                if not streaming:
+                    history[-1][1] = ""
+                    streaming = True
+                history[-1][1] += data.get("text", "")
+                yield {chatbot: history}
+            elif event == "done":
+                finished = True
+                if not streaming:
+                    history[-1][1] = data.get("output") or "Sorry, I couldn't get a response."
+                    yield {chatbot: history}
+            elif event == "error":
+                #the backend failed after the stream started, what was already streamed stays above the error
+                finished = True
+                error = f"⚠️ **Backend Error:** {data.get('error')} \n\n*Request id: {data.get('request_id') or request_id}*"
+                history[-1][1] = f"{history[-1][1]}\n\n{error}" if streaming else error
+                yield {chatbot: history}
+        if not finished:
+            #the connection dropped before the end, never leave a progress message as the answer
+            error = f"⚠️ **Backend Error:** The response stopped before the answer was complete. \n\n*Request id: {request_id}*"
+            history[-1][1] = f"{history[-1][1]}\n\n{error}" if streaming else error
             yield {chatbot: history}
 
     except requests.exceptions.RequestException as e:
-        history[-1][1] = f"⚠️ **Network Error:** Could not connect to the backend. Please ensure it's running. \n\n*Details: {e}*"
+        history[-1][1] = f"⚠️ **Network Error:** Could not connect to the backend. Please ensure it's running. \n\n*Details: {e}*\n*Request id: {request_id}*"
         yield {chatbot: history}
         
     except json.JSONDecodeError:
-        history[-1][1] = f"⚠️ **Backend Error:** Received an invalid response from the backend. \n\n*Response Text: {response.text}*"
+        history[-1][1] = f"⚠️ **Backend Error:** Received an invalid event from the backend. \n\n*Request id: {request_id}*"
         yield {chatbot: history}
 
     except Exception as e:
-        history[-1][1] = f"⚠️ **An unexpected error occurred:** {e}"
+        history[-1][1] = f"⚠️ **An unexpected error occurred:** {e} \n\n*Request id: {request_id}*"
         yield {chatbot: history}
 
     finally:
@@ -96,6 +145,15 @@ def stream_chat(message: str, history: list):
             stop_btn: gr.Button("Stop", variant="stop", visible=False, interactive=True),
         }
 
+def new_session(session_id: str):
+    #clearing the chat also starts a new conversation on the backend, the old one is deleted (best effort, it expires anyway)
+    if session_id:
+        try:
+            requests.delete(f"{SESSIONS_URL}/{session_id}", timeout=2)
+        except requests.exceptions.RequestException:
+            pass
+    return [], "", str(uuid.uuid4())
+
 theme = gr.themes.Soft(
     primary_hue="blue",
     secondary_hue="sky",
@@ -116,6 +174,8 @@ with gr.Blocks(theme=theme, title="ML Tutor Bot 🤖", css=custom_css) as demo:
         """
     )
     
+    session_id = gr.State(lambda: str(uuid.uuid4()))
+
     chatbot = gr.Chatbot(
         label="Chat History",
         bubble_full_width=False,
@@ -165,18 +225,18 @@ with gr.Blocks(theme=theme, title="ML Tutor Bot 🤖", css=custom_css) as demo:
     
     chat_submission = user_input.submit(
         stream_chat, 
-        [user_input, chatbot], 
+        [user_input, chatbot, session_id], 
         [chatbot, user_input, send_btn, stop_btn]
     )
     send_btn.click(
         stream_chat, 
-        [user_input, chatbot], 
+        [user_input, chatbot, session_id], 
         [chatbot, user_input, send_btn, stop_btn]
     )
 
     stop_btn.click(fn=None, inputs=None, outputs=None, cancels=[chat_submission])
 
-    clear_btn.click(lambda: ([], ""), None, [chatbot, user_input])
+    clear_btn.click(new_session, [session_id], [chatbot, user_input, session_id])
 
 if __name__ == "__main__":
     demo.launch(server_name="0.0.0.0", server_port=7860, share=False)
\ No newline at end of file
@@ -0,0 +1,123 @@
+import os
+import asyncio
+import re
+import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from urllib.parse import urljoin, urldefrag
+
+import aiohttp
+
+from src.app.core.config import CRAWL_MAX_DEPTH, CRAWL_MAX_CONCURRENCY, CRAWL_MAX_PER_HOST, CRAWL_TIMEOUT, CRAWL_PARSE_WORKERS
+from src.app.rag_pipelines.scrapp_data import robust_html_extractor
+from src.app.rag_pipelines.chunking import split_content, content_hash
+from src.app.core.tracing import span, CLIENT
+
+#same link pattern RecursiveUrlLoader uses, we just don't want to parse the html twice to find links
+HREF_PATTERN = re.compile(r'href=["\'](.*?)["\']', re.IGNORECASE)
+
+def extract_links(html: str, page_url: str, base_url: str) -> list[str]:
+    #only follow links that stay inside the seed, like RecursiveUrlLoader(prevent_outside=True)
+    links = []
+    for href in HREF_PATTERN.findall(html):
+        link, _ = urldefrag(urljoin(page_url, href))
+        if link.startswith(base_url):
+            links.append(link)
+    return links
+
+def process_page(html: str, page_url: str, base_url: str, extractor=robust_html_extractor):
+    #cpu bound part of the crawl: html parsing, boilerplate stripping, chunking, and the links to follow
+    #-> (hash of the page text, chunk texts, links). runs in the parse processes, so it and the extractor are top level functions
+    text = extractor(html)
+    chunks = [doc.page_content for doc in split_content(text, page_url)] if text else []
+    return content_hash(text), chunks, extract_links(html, page_url, base_url)
+
+class Async_Crawler:
+    def __init__(self, max_depth=CRAWL_MAX_DEPTH, max_concurrency=CRAWL_MAX_CONCURRENCY,
+                 max_per_host=CRAWL_MAX_PER_HOST, timeout=CRAWL_TIMEOUT, extractor=robust_html_extractor,
+                 parse_workers=CRAWL_PARSE_WORKERS):
+        self.max_depth = max_depth
+        self.max_concurrency = max_concurrency
+        self.max_per_host = max_per_host
+        self.timeout = timeout
+        self.extractor = extractor
+        #None = every core, 0 = a thread of this process (the gil then makes the parsing one page at a time)
+        self.parse_workers = os.cpu_count() if parse_workers is None else parse_workers
+
+    async def _fetch(self, session: aiohttp.ClientSession, url: str):
+        with span("crawl.fetch", CLIENT, url=url) as s:
+            return await self._fetch_unspanned(session, url, s)
+
+    async def _fetch_unspanned(self, session: aiohttp.ClientSession, url: str, s):
+        try:
+            async with session.get(url) as resp:
+                s.set("http.status_code", resp.status)
+                if resp.status != 200:
+                    logging.warning(f"Failed to scrapp data from {url}, status code: {resp.status}")
+                    return None
+                if 'text/html' not in resp.headers.get('Content-Type', 'text/html'):
+                    return None
+                return await resp.text(errors='replace')
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            logging.warning(f"Failed to scrapp data from {url}: {e}")
+            s.set("error", type(e).__name__)
+            return None
+
+    async def _parse(self, executor, html, url, base_url):
+        if executor is None:
+            return await asyncio.to_thread(process_page, html, url, base_url, self.extractor)
+        return await asyncio.get_running_loop().run_in_executor(executor, process_page, html, url, base_url, self.extractor)
+
+    async def _worker(self, session, queue: asyncio.Queue, visited: set, on_page, executor, pages: list):
+        while True:
+            url, depth, base_url = await queue.get()
+            try:
+                html = await self._fetch(session, url)
+                if html is None:
+                    continue
+                try:
+                    #the raw html goes to a parse process, this one only fetches and writes
+                    page_hash, chunks, links = await self._parse(executor, html, url, base_url)
+                except Exception as e:
+                    logging.warning(f"Failed to parse {url}: {e}")
+                    continue
+                if chunks:
+                    on_page(url, page_hash, chunks)
+                    pages[0] += 1
+                if depth + 1 < self.max_depth:
+                    for link in links:
+                        #visited is shared by every seed, so a page linked from two guides is fetched once
+                        if link not in visited:
+                            visited.add(link)
+                            queue.put_nowait((link, depth + 1, base_url))
+            finally:
+                queue.task_done()
+
+    async def crawl(self, seeds: list[str], on_page) -> int:
+        #on_page(source, page_hash, chunks) gets every page as soon as it's parsed, so nothing piles up in memory
+        #-> number of pages
+        queue = asyncio.Queue()
+        visited = set()
+        pages = [0]
+        for seed in seeds:
+            if seed != '' and seed not in visited:
+                visited.add(seed)
+                queue.put_nowait((seed, 0, seed))
+        #spawn and not fork: the api process has threads (chroma, sqlite, the batcher) that a fork would copy mid-flight
+        #at most max_concurrency pages wait for a parse process, every fetch worker waits for its own page
+        executor = ProcessPoolExecutor(self.parse_workers, mp_context=multiprocessing.get_context("spawn")) if self.parse_workers else None
+        #the connector keeps a pool of keep-alive connections and enforces the global and per host caps
+        connector = aiohttp.TCPConnector(limit=self.max_concurrency, limit_per_host=self.max_per_host)
+        timeout = aiohttp.ClientTimeout(total=self.timeout)
+        try:
+            async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+                workers = [asyncio.create_task(self._worker(session, queue, visited, on_page, executor, pages))
+                           for _ in range(self.max_concurrency)]
+                await queue.join()
+                for worker in workers:
+                    worker.cancel()
+                await asyncio.gather(*workers, return_exceptions=True)
+        finally:
+            if executor is not None:
+                executor.shutdown(cancel_futures=True)
+        return pages[0]
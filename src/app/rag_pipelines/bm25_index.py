@@ -0,0 +1,175 @@
+import os
+import re
+import json
+import shutil
+from array import array
+from collections import Counter
+import numpy as np
+
+from src.app.core.config import BM25_DIR, BM25_K1, BM25_B
+from src.app.core.tracing import span
+
+#lexical index over the same chunks that go to chroma, dense MiniLM is bad at exact api names
+#("StandardScaler", "pd.merge_asof", "torch.compile") and those are exactly what students type
+#postings are CSR numpy arrays (offsets / doc ids / precomputed bm25 impacts) saved as .npy files and
+#memory-mapped on load, so a query is a few array slices and sums, no python dict-of-lists anywhere
+#one index covers every library shard, the shard of each chunk is a small code array used to filter the hits
+
+TOKEN_PATTERN = re.compile(r"[A-Za-z0-9_]+(?:\.[A-Za-z0-9_]+)*")
+STOPWORDS = frozenset("""a an and are as at be by can do does for from how i in is it of on or that the this to
+was what when where which who why will with you your""".split())
+
+def tokenize(text: str) -> list[str]:
+    #"pd.merge_asof" gives "pd.merge_asof", "pd" and "merge_asof", so both the dotted name and its parts match
+    tokens = []
+    for match in TOKEN_PATTERN.findall(text.lower()):
+        if match not in STOPWORDS:
+            tokens.append(match)
+        if "." in match:
+            tokens.extend(part for part in match.split(".") if part and part not in STOPWORDS)
+    return tokens
+
+class Bm25_Index:
+    def __init__(self, vocabulary, offsets, doc_ids, impacts, chunk_ids, shards=None, shard_names=None):
+        self.vocabulary = vocabulary
+        self.offsets = offsets
+        self.doc_ids = doc_ids
+        self.impacts = impacts
+        self.chunk_ids = chunk_ids
+        #shard code per chunk and the names behind the codes, None for an index built without shards
+        self.shards = shards
+        self.shard_names = shard_names or []
+
+    @classmethod
+    def build(cls, chunks, k1=BM25_K1, b=BM25_B):
+        #chunks: iterable of (chunk_id, text) or (chunk_id, text, shard), consumed once
+        vocabulary = {}
+        term_col, doc_col, tf_col = array('i'), array('i'), array('H')
+        doc_lengths = array('i')
+        chunk_ids = []
+        shard_col, shard_names = array('h'), {}
+        for doc, (cid, text, *shard) in enumerate(chunks):
+            counts = Counter(tokenize(text))
+            chunk_ids.append(cid)
+            if shard:
+                shard_col.append(shard_names.setdefault(shard[0], len(shard_names)))
+            doc_lengths.append(sum(counts.values()))
+            for term, tf in counts.items():
+                term_col.append(vocabulary.setdefault(term, len(vocabulary)))
+                doc_col.append(doc)
+                tf_col.append(min(tf, 65535))
+
+        terms = np.frombuffer(term_col, dtype=np.int32)
+        docs = np.frombuffer(doc_col, dtype=np.int32)
+        tfs = np.frombuffer(tf_col, dtype=np.uint16).astype(np.float32)
+        lengths = np.frombuffer(doc_lengths, dtype=np.int32).astype(np.float32)
+        n_docs = len(chunk_ids)
+
+        #group the postings by term, stable so doc ids stay sorted inside each list
+        order = np.argsort(terms, kind='stable')
+        terms, docs, tfs = terms[order], docs[order], tfs[order]
+        counts = np.bincount(terms, minlength=len(vocabulary))
+        offsets = np.zeros(len(vocabulary) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum(counts)
+        df = counts.astype(np.float32)
+
+        #the whole bm25 formula is precomputed per posting, a query only has to add numbers
+        avgdl = float(lengths.mean()) if n_docs else 0.0
+        idf = np.log(1.0 + (n_docs - df + 0.5) / (df + 0.5))
+        norm = k1 * (1.0 - b + b * lengths[docs] / max(avgdl, 1e-9))
+        impacts = (idf[terms] * tfs * (k1 + 1.0) / (tfs + norm)).astype(np.float32)
+        shards = np.frombuffer(shard_col, dtype=np.int16).copy() if len(shard_col) == n_docs and n_docs else None
+        return cls(vocabulary, offsets, docs.astype(np.int32), impacts, np.array(chunk_ids, dtype='S'),
+                   shards, list(shard_names) if shards is not None else None)
+
+    def save(self, directory=BM25_DIR):
+        #written to a temp dir and swapped, a query never sees half of a new index
+        #leftovers of a save that crashed halfway are thrown away first, a non-empty .old would make the swap fail forever
+        tmp = directory.rstrip('/') + '.tmp'
+        old = directory.rstrip('/') + '.old'
+        for leftover in (tmp, old):
+            shutil.rmtree(leftover, ignore_errors=True)
+        os.makedirs(tmp)
+        np.save(os.path.join(tmp, 'offsets.npy'), self.offsets)
+        np.save(os.path.join(tmp, 'doc_ids.npy'), self.doc_ids)
+        np.save(os.path.join(tmp, 'impacts.npy'), self.impacts)
+        np.save(os.path.join(tmp, 'chunk_ids.npy'), self.chunk_ids)
+        with open(os.path.join(tmp, 'vocabulary.json'), 'w', encoding='utf-8') as f:
+            json.dump(self.vocabulary, f)
+        if self.shards is not None:
+            np.save(os.path.join(tmp, 'shards.npy'), self.shards)
+            with open(os.path.join(tmp, 'shard_names.json'), 'w', encoding='utf-8') as f:
+                json.dump(self.shard_names, f)
+        if os.path.exists(directory):
+            os.replace(directory, old)
+            os.replace(tmp, directory)
+            shutil.rmtree(old)
+        else:
+            os.replace(tmp, directory)
+
+    @classmethod
+    def load(cls, directory=BM25_DIR):
+        def arr(name):
+            return np.load(os.path.join(directory, name), mmap_mode='r')
+        with open(os.path.join(directory, 'vocabulary.json'), encoding='utf-8') as f:
+            vocabulary = json.load(f)
+        shards, shard_names = None, None
+        if os.path.exists(os.path.join(directory, 'shards.npy')):
+            shards = arr('shards.npy')
+            with open(os.path.join(directory, 'shard_names.json'), encoding='utf-8') as f:
+                shard_names = json.load(f)
+        return cls(vocabulary, arr('offsets.npy'), arr('doc_ids.npy'), arr('impacts.npy'), arr('chunk_ids.npy'),
+                   shards, shard_names)
+
+    def __len__(self):
+        return len(self.chunk_ids)
+
+    def _top(self, query: str, k: int, shards=None):
+        #positions of the k best chunks and their scores, best first
+        with span("bm25.search", k=k, shards=len(shards) if shards else None):
+            return self._top_unspanned(query, k, shards)
+
+    def _top_unspanned(self, query: str, k: int, shards=None):
+        term_ids = {self.vocabulary[t] for t in tokenize(query) if t in self.vocabulary}
+        if not term_ids or k <= 0:
+            return [], []
+        scores = np.zeros(len(self.chunk_ids), dtype=np.float32)
+        touched = []
+        for term in term_ids:
+            start, end = self.offsets[term], self.offsets[term + 1]
+            docs = self.doc_ids[start:end]
+            #doc ids are unique inside a posting list, so a fancy-index add is safe here
+            scores[docs] += self.impacts[start:end]
+            touched.append(docs)
+        candidates = np.unique(np.concatenate(touched)) if len(touched) > 1 else np.asarray(touched[0])
+        if shards and self.shards is not None:
+            codes = [self.shard_names.index(shard) for shard in shards if shard in self.shard_names]
+            candidates = candidates[np.isin(self.shards[candidates], codes)]
+        candidate_scores = scores[candidates]
+        if len(candidates) > k:
+            top = np.argpartition(-candidate_scores, k)[:k]
+        else:
+            top = np.arange(len(candidates))
+        top = top[np.argsort(-candidate_scores[top])]
+        return candidates[top], candidate_scores[top]
+
+    def search(self, query: str, k: int, shards=None) -> list[tuple[str, float]]:
+        #returns [(chunk_id, score)] best first, shards restricts the hits to those shards (ignored by an unsharded index)
+        positions, scores = self._top(query, k, shards)
+        return [(self.chunk_ids[position].decode(), float(score)) for position, score in zip(positions, scores)]
+
+    def search_shards(self, query: str, k: int, shards=None) -> list[tuple[str, float, str]]:
+        #same with the shard of every hit, None for an unsharded index
+        positions, scores = self._top(query, k, shards)
+        return [(self.chunk_ids[position].decode(), float(score),
+                 self.shard_names[self.shards[position]] if self.shards is not None else None)
+                for position, score in zip(positions, scores)]
+
+def reciprocal_rank_fusion(rankings, weights=None, k=60):
+    #rankings: lists of keys best first, returns every key ordered by sum(weight / (k + rank))
+    weights = weights or [1.0] * len(rankings)
+    fused = {}
+    for ranking, weight in zip(rankings, weights):
+        for rank, key in enumerate(ranking, start=1):
+            fused[key] = fused.get(key, 0.0) + weight / (k + rank)
+    return sorted(fused, key=fused.get, reverse=True)
@@ -0,0 +1,47 @@
+import csv
+import sys
+import hashlib
+from langchain_core.documents import Document
+from langchain_text_splitters import RecursiveCharacterTextSplitter
+
+from src.app.core.config import CHUNK_SIZE, CHUNK_OVERLAP
+from src.app.rag_pipelines.library_shards import library_of
+
+def content_hash(text: str) -> str:
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+def chunk_id(source: str, index: int) -> str:
+    #stable id: same source and same position always gives the same id, so re-indexing can upsert in place
+    return f"{hashlib.sha1(source.encode('utf-8')).hexdigest()[:16]}-{index}"
+
+def make_splitter():
+    return RecursiveCharacterTextSplitter(chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP)
+
+def iter_csv_rows(file_path: str, content_column: str = 'text', source_column: str = 'source'):
+    #yields (source, content) one row at a time, the scrapped pages can be huge so the field limit goes up
+    csv.field_size_limit(sys.maxsize)
+    with open(file_path, mode='r', encoding='utf-8') as csvfile:
+        reader = csv.DictReader(csvfile, delimiter=',')
+        for row in reader:
+            yield row[source_column], row[content_column]
+
+def split_content(content: str, source: str, splitter=None) -> list[Document]:
+    #small pages go as a single chunk, the big ones get splitted
+    #the library decides the shard (chroma collection) the chunk is stored in
+    metadata = {"source": source, "library": library_of(source)}
+    if len(content) > CHUNK_SIZE:
+        splitter = splitter or make_splitter()
+        return splitter.create_documents([content], metadatas=[metadata])
+    return [Document(page_content=content, metadata=metadata)]
+
+def iter_csv_chunks(file_path: str, content_column: str = 'text', source_column: str = 'source', skip=frozenset()):
+    #yields (chunk_id, Document) lazily, chunk indexes are counted per source, the sources in skip are not even split
+    splitter = make_splitter()
+    next_index = {}
+    for source, content in iter_csv_rows(file_path, content_column, source_column):
+        if source in skip:
+            continue
+        for doc in split_content(content, source, splitter):
+            index = next_index.get(source, 0)
+            next_index[source] = index + 1
+            yield chunk_id(source, index), doc
@@ -0,0 +1,120 @@
+import os
+import hashlib
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+from langchain_core.documents import Document
+
+from src.app.core.config import CORPUS_PATH, DATA_CSV_PATH, CORPUS_ROW_GROUP_SIZE, CORPUS_MIN_PAGES_RATIO
+from src.app.rag_pipelines.chunking import iter_csv_rows, iter_csv_chunks, chunk_id
+from src.app.rag_pipelines.library_shards import library_of
+
+#the scrapped corpus on disk, a parquet file with one row per chunk, the chunks are made at crawl time in the parse processes:
+#   source      url of the page
+#   chunk       position of the chunk in the page, what the chunk id is made of
+#   page_hash   sha256 of the whole page text, the same hash the indexer used to compute over the csv rows of a page
+#   text
+#against the old data.csv (one row per page, split again by every reader, and fields so big the csv module needs its limit
+#raised) the indexer reads the chunks as they are, a row group at a time, and its first pass only reads two small columns
+#every reader still takes a .csv, split the same way, so the chunk ids and hashes are the same in both formats
+#the library is not stored, it's derived from the source when read so a change of the shard layout applies right away
+
+SCHEMA = pa.schema([("source", pa.string()), ("chunk", pa.int32()), ("page_hash", pa.string()), ("text", pa.string())])
+
+def is_parquet(path: str) -> bool:
+    return path.endswith(".parquet")
+
+def corpus_path() -> str:
+    #the parquet corpus, or the old data.csv when it's the only one there (scrapped before the switch)
+    if not os.path.exists(CORPUS_PATH) and os.path.exists(DATA_CSV_PATH):
+        return DATA_CSV_PATH
+    return CORPUS_PATH
+
+class Crawl_Too_Small(Exception):
+    pass
+
+class Corpus_Writer:
+    #pages are added as they are parsed and written a row group at a time, into a temp file that replaces the corpus
+    #only once the crawl is done, so the indexer never reads half a crawl and a failed crawl keeps the old corpus
+    #a crawl that came back (almost) empty counts as failed too, see CORPUS_MIN_PAGES_RATIO
+    def __init__(self, path=CORPUS_PATH, row_group_size=CORPUS_ROW_GROUP_SIZE, min_pages_ratio=CORPUS_MIN_PAGES_RATIO):
+        self.path = path
+        self.tmp_path = f"{path}.tmp"
+        self.row_group_size = row_group_size
+        self.min_pages_ratio = min_pages_ratio
+        self.pages = 0
+        self.chunks = 0
+        self._columns = {name: [] for name in SCHEMA.names}
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._writer = pq.ParquetWriter(self.tmp_path, SCHEMA, compression="zstd")
+
+    def add_page(self, source: str, page_hash: str, chunks: list[str]):
+        for index, text in enumerate(chunks):
+            self._columns["source"].append(source)
+            self._columns["chunk"].append(index)
+            self._columns["page_hash"].append(page_hash)
+            self._columns["text"].append(text)
+        self.pages += 1
+        self.chunks += len(chunks)
+        if len(self._columns["source"]) >= self.row_group_size:
+            self._flush()
+
+    def _flush(self):
+        if self._columns["source"]:
+            self._writer.write_table(pa.table(self._columns, schema=SCHEMA), row_group_size=self.row_group_size)
+            self._columns = {name: [] for name in SCHEMA.names}
+
+    def close(self):
+        self._flush()
+        self._writer.close()
+        previous = len(source_hashes(self.path)) if os.path.exists(self.path) else 0
+        if self.pages == 0 or self.pages < previous * self.min_pages_ratio:
+            os.remove(self.tmp_path)
+            raise Crawl_Too_Small(f"The crawl got {self.pages} pages against {previous} in {self.path}, the old corpus is kept")
+        os.replace(self.tmp_path, self.path)
+
+    def abort(self):
+        self._writer.close()
+        os.remove(self.tmp_path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+        return False
+
+def source_hashes(path: str) -> dict:
+    #{source: hash of its page text}, only the two small columns are read from a parquet corpus
+    if is_parquet(path):
+        hashes = {}
+        for batch in pq.ParquetFile(path).iter_batches(columns=["source", "page_hash"]):
+            hashes.update(zip(batch.column(0).to_pylist(), batch.column(1).to_pylist()))
+        return hashes
+    hashes = {}
+    for source, content in iter_csv_rows(path):
+        hashes.setdefault(source, hashlib.sha256()).update(content.encode('utf-8'))
+    return {source: h.hexdigest() for source, h in hashes.items()}
+
+def iter_chunks(path: str, skip=frozenset(), content_column: str = 'text', source_column: str = 'source'):
+    #lazy iterator of (chunk_id, Document) of every source not in skip
+    if is_parquet(path):
+        return _iter_parquet_chunks(path, skip)
+    return iter_csv_chunks(path, content_column, source_column, skip)
+
+def _iter_parquet_chunks(path, skip):
+    skipped = pa.array(list(skip), type=pa.string()) if skip else None
+    libraries = {}
+    #a row group worth of text in memory at a time, the default batch would be 65536 chunks
+    for batch in pq.ParquetFile(path).iter_batches(batch_size=CORPUS_ROW_GROUP_SIZE, columns=["source", "chunk", "text"]):
+        if skipped is not None:
+            #the unchanged pages are dropped before their text is turned into python strings
+            batch = batch.filter(pc.invert(pc.is_in(batch.column(0), value_set=skipped)))
+        for source, index, text in zip(batch.column(0).to_pylist(), batch.column(1).to_pylist(), batch.column(2).to_pylist()):
+            library = libraries.get(source)
+            if library is None:
+                library = libraries[source] = library_of(source)
+            yield chunk_id(source, index), Document(page_content=text, metadata={"source": source, "library": library})
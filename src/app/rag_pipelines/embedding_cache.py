@@ -0,0 +1,228 @@
+import os
+import re
+import fcntl
+import sqlite3
+import hashlib
+import threading
+import contextlib
+import unicodedata
+from collections import OrderedDict
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+from src.app.core.config import EMBEDDING_MODEL_NAME, EMBEDDING_CACHE_DIR, EMBEDDING_CACHE_LRU_SIZE
+from src.app.core.tracing import span
+
+#MiniLM forward passes are most of the cost of a rebuild and of every query on a cpu box, and the same texts
+#come back all the time (same chunks on a rebuild, same question for the router, the response cache and retrieval)
+#vectors live in a float32 matrix on disk (memory-mapped, so the os pages in only what's used) and a small
+#sqlite table maps the text hash to its row, hot query vectors are also kept in memory
+
+SQLITE_MAX_VARIABLES = 900
+
+def normalize_text(text: str) -> str:
+    #only changes that can't change the embedding, the tokenizer splits on whitespace anyway
+    return " ".join(unicodedata.normalize("NFC", text).split())
+
+def text_key(kind: str, text: str) -> str:
+    #queries and documents are kept apart, some models embed them differently
+    return hashlib.sha1(f"{kind}\0{normalize_text(text)}".encode('utf-8')).hexdigest()
+
+class Embedding_Store:
+    #the api and the indexer cli can write to the same store at the same time (two processes): the row allocation and the
+    #growth of the file happen under an exclusive lock on a file next to them, and every writer reads the next free row
+    #and the file size again under it. the file only ever grows, so a mapping another process made stays valid
+    def __init__(self, directory, initial_rows=1024):
+        os.makedirs(directory, exist_ok=True)
+        self.vectors_path = os.path.join(directory, "vectors.f32")
+        self.initial_rows = initial_rows
+        self.conn = sqlite3.connect(os.path.join(directory, "keys.sqlite"), check_same_thread=False)
+        self.lock = threading.Lock()
+        self.lock_file = open(os.path.join(directory, "write.lock"), 'a')
+        with self.lock, self._exclusive(), self.conn:
+            self.conn.execute("CREATE TABLE IF NOT EXISTS keys (key TEXT PRIMARY KEY, row INTEGER)")
+            self.conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value INTEGER)")
+        self.dim = self._get_meta('dim')
+        self.matrix = None
+        self._map()
+
+    @contextlib.contextmanager
+    def _exclusive(self):
+        fcntl.flock(self.lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(self.lock_file, fcntl.LOCK_UN)
+
+    def _get_meta(self, key):
+        row = self.conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def _next_row(self):
+        #rows written by any process, stores from before the 'rows' counter only have the keys to go by
+        used = self.conn.execute("SELECT COALESCE(MAX(row) + 1, 0) FROM keys").fetchone()[0]
+        return max(self._get_meta('rows') or 0, used)
+
+    def _file_rows(self):
+        return os.path.getsize(self.vectors_path) // (self.dim * 4) if os.path.exists(self.vectors_path) else 0
+
+    def _map(self):
+        #maps the whole file as it is now, called again when rows past the mapping are needed
+        rows = self._file_rows() if self.dim else 0
+        if self.matrix is not None:
+            self.matrix.flush()
+        self.matrix = np.memmap(self.vectors_path, dtype=np.float32, mode='r+', shape=(rows, self.dim)) if rows else None
+
+    def _reserve(self, start, n):
+        #only under the exclusive lock. the file grows by doubling, a sparse extend is cheap and the memmap only has to be
+        #reopened now and then (or when another process grew it)
+        capacity = self._file_rows()
+        if start + n > capacity:
+            new_capacity = max(capacity * 2, start + n, self.initial_rows)
+            with open(self.vectors_path, 'ab') as f:
+                f.truncate(new_capacity * self.dim * 4)
+        if self.matrix is None or len(self.matrix) < start + n:
+            self._map()
+
+    def get(self, keys) -> dict:
+        found = {}
+        with self.lock:
+            if self.dim is None:
+                #another process may have written the first vectors
+                self.dim = self._get_meta('dim')
+                if self.dim is None:
+                    return found
+            rows = {}
+            for i in range(0, len(keys), SQLITE_MAX_VARIABLES):
+                part = keys[i:i + SQLITE_MAX_VARIABLES]
+                query = f"SELECT key, row FROM keys WHERE key IN ({','.join('?' * len(part))})"
+                rows.update(self.conn.execute(query, part))
+            if rows and (self.matrix is None or max(rows.values()) >= len(self.matrix)):
+                #appended by another process after this one mapped the file, a key only exists once its row is on disk
+                self._map()
+            for key, row in rows.items():
+                found[key] = np.array(self.matrix[row])
+        return found
+
+    def put(self, keys, vectors):
+        vectors = np.asarray(vectors, dtype=np.float32)
+        if not len(keys):
+            return
+        with self.lock, self._exclusive():
+            self.dim = self.dim or self._get_meta('dim')
+            if self.dim is None:
+                self.dim = vectors.shape[1]
+                with self.conn:
+                    self.conn.execute("INSERT OR REPLACE INTO meta VALUES ('dim', ?)", (self.dim,))
+            if vectors.shape[1] != self.dim:
+                raise ValueError(f"Embedding cache holds {self.dim}-d vectors, got {vectors.shape[1]}-d")
+            start = self._next_row()
+            self._reserve(start, len(keys))
+            self.matrix[start:start + len(keys)] = vectors
+            self.matrix.flush()
+            #keys only point to rows that are already on disk, a crash just leaves some unused rows at the end
+            #a key another process stored in the meantime keeps its row, it's the vector of the same text
+            with self.conn:
+                self.conn.executemany("INSERT OR IGNORE INTO keys VALUES (?, ?)",
+                                      ((key, start + i) for i, key in enumerate(keys)))
+                self.conn.execute("INSERT OR REPLACE INTO meta VALUES ('rows', ?)", (start + len(keys),))
+
+    def __len__(self):
+        with self.lock:
+            return self.conn.execute("SELECT COUNT(*) FROM keys").fetchone()[0]
+
+    def close(self):
+        with self.lock:
+            if self.matrix is not None:
+                self.matrix.flush()
+            self.conn.close()
+            self.lock_file.close()
+
+class Cached_Embeddings(Embeddings):
+    #drop-in wrapper, anything that takes the embedder (chroma, the ingest pipeline, the caches) gets it for free
+    def __init__(self, embedded_model, model_name=EMBEDDING_MODEL_NAME, directory=EMBEDDING_CACHE_DIR,
+                 lru_size=EMBEDDING_CACHE_LRU_SIZE):
+        self.embedded_model = embedded_model
+        self.store = Embedding_Store(os.path.join(directory, re.sub(r"[^A-Za-z0-9_.-]+", "_", model_name)))
+        self.lru_size = lru_size
+        self.lru = OrderedDict()
+        self.lru_lock = threading.Lock()
+        self.stats = {"document_hits": 0, "document_misses": 0, "query_memory_hits": 0, "query_disk_hits": 0, "query_misses": 0}
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        with span("embedding.documents", texts=len(texts)) as s:
+            keys = [text_key("document", text) for text in texts]
+            found = self.store.get(list(set(keys)))
+            #misses go to the model in one batch, duplicates inside the batch are embedded once
+            missing = {}
+            for key, text in zip(keys, texts):
+                if key not in found:
+                    missing.setdefault(key, text)
+            if missing:
+                vectors = self.embedded_model.embed_documents(list(missing.values()))
+                self.store.put(list(missing), vectors)
+                found.update(zip(missing, np.asarray(vectors, dtype=np.float32)))
+            self.stats["document_misses"] += len(missing)
+            self.stats["document_hits"] += len(keys) - len(missing)
+            s.set("cache.hits", len(keys) - len(missing))
+            s.set("cache.misses", len(missing))
+            return [found[key].tolist() for key in keys]
+
+    def _remember(self, key, vector):
+        with self.lru_lock:
+            self.lru[key] = vector
+            self.lru.move_to_end(key)
+            while len(self.lru) > self.lru_size:
+                self.lru.popitem(last=False)
+
+    def embed_query(self, text: str) -> list[float]:
+        return self.embed_queries([text])[0]
+
+    def embed_queries(self, texts: list[str]) -> list[list[float]]:
+        #batched embed_query, used by the retrieval micro-batcher: memory, then disk, then one model call for the rest
+        with span("embedding.queries", texts=len(texts)) as s:
+            return self._embed_queries(s, texts)
+
+    def _embed_queries(self, s, texts: list[str]) -> list[list[float]]:
+        keys = [text_key("query", text) for text in texts]
+        found = {}
+        with self.lru_lock:
+            for key in keys:
+                vector = self.lru.get(key)
+                if vector is not None:
+                    self.lru.move_to_end(key)
+                    found[key] = vector
+                    self.stats["query_memory_hits"] += 1
+        on_disk = self.store.get([key for key in set(keys) if key not in found])
+        self.stats["query_disk_hits"] += len(on_disk)
+        found.update(on_disk)
+        missing = {}
+        for key, text in zip(keys, texts):
+            if key not in found:
+                missing.setdefault(key, text)
+        if missing:
+            self.stats["query_misses"] += len(missing)
+            if len(missing) == 1:
+                vectors = [self.embedded_model.embed_query(next(iter(missing.values())))]
+            else:
+                #same forward pass as embed_query for sentence-transformers, just for the whole batch
+                vectors = self.embedded_model.embed_documents(list(missing.values()))
+            vectors = np.asarray(vectors, dtype=np.float32)
+            self.store.put(list(missing), vectors)
+            found.update(zip(missing, vectors))
+        s.set("cache.hits", len(set(keys)) - len(missing))
+        s.set("cache.misses", len(missing))
+        for key in set(keys):
+            self._remember(key, found[key])
+        return [found[key].tolist() for key in keys]
+
+    def hit_rates(self) -> dict:
+        documents = self.stats["document_hits"] + self.stats["document_misses"]
+        query_hits = self.stats["query_memory_hits"] + self.stats["query_disk_hits"]
+        queries = query_hits + self.stats["query_misses"]
+        return {**self.stats, "vectors": len(self.store),
+                "document_hit_rate": self.stats["document_hits"] / documents if documents else 0.0,
+                "query_hit_rate": query_hits / queries if queries else 0.0}
+
+    def close(self):
+        self.store.close()
@@ -1,7 +1,9 @@
 import os
-import csv
-import sys
+import json
+import time
 import asyncio
+import logging
+import threading
 from langchain_community.document_loaders import CSVLoader
 from langchain.docstore.document import Document
 from langchain.text_splitter import RecursiveCharacterTextSplitter
@@ -11,12 +13,100 @@ from langchain.prompts import ChatPromptTemplate
 from langchain.schema.runnable import RunnablePassthrough
 from langchain.schema.output_parser import StrOutputParser
 
-from src.app.core.config import URLS_DOCS, URLS_GUIDES
+from src.app.core.config import (URLS_DOCS, URLS_GUIDES, EMBEDDING_MODEL_NAME, EMBEDDING_CACHE_ENABLED, CHROMA_DIR,
+                                 BM25_DIR, RETRIEVAL_K, RETRIEVAL_FETCH_K, RRF_K, DENSE_WEIGHT, LEXICAL_WEIGHT,
+                                 RETRIEVAL_BATCH_MAX_SIZE, SHARD_ROUTING, RERANK_ENABLED, RERANK_CANDIDATES, RAG_CONTEXT_TOKENS)
 from src.app.rag_pipelines.scrapping_manager import Scrap_manager
+from src.app.rag_pipelines.corpus import corpus_path, iter_chunks
+from src.app.rag_pipelines.incremental_indexer import Incremental_Indexer
+from src.app.rag_pipelines.bm25_index import Bm25_Index, reciprocal_rank_fusion
+from src.app.rag_pipelines.embedding_cache import Cached_Embeddings
+from src.app.rag_pipelines.micro_batcher import Micro_Batcher
+from src.app.rag_pipelines.library_shards import Library_Router, shard_names
+from src.app.rag_pipelines.vector_stores import open_vector_store, vector_index_exists, matches_where
+from src.app.rag_pipelines.reranker import Cross_Encoder_Reranker, dedup_chunks, pack_context
+from src.app.agent_workflow.conversation_memory import count_tokens
+from src.app.core.tracing import span
+
+_embedded_model = None
+_embedded_model_lock = threading.Lock()
+
+def get_embedded_model():
+    #process-wide singleton, loading MiniLM from disk takes seconds so we only want to do it once
+    global _embedded_model
+    with _embedded_model_lock:
+        if _embedded_model is None:
+            _embedded_model = HuggingFaceEmbeddings(model_name=EMBEDDING_MODEL_NAME)
+            #every caller (indexing, retrieval, router, response cache) goes through the same vector cache
+            if EMBEDDING_CACHE_ENABLED:
+                _embedded_model = Cached_Embeddings(_embedded_model, model_name=EMBEDDING_MODEL_NAME)
+    return _embedded_model
+
+class Index_Building(Exception):
+    pass
+
+def _log_index_build(task):
+    if not task.cancelled() and task.exception() is not None:
+        logging.error(f"Could not build the documentation index: {task.exception()!r}")
 
 class Rag_Pipeline:
-    def __init__(self):
-        self.embedded_model = HuggingFaceEmbeddings(model_name="sentence-transformers/all-MiniLM-L6-v2")
+    def __init__(self, embedded_model=None):
+        self.embedded_model = embedded_model if embedded_model is not None else get_embedded_model()
+        #one vector store per library shard (a chroma collection or an ivf index, VECTOR_BACKEND), opened once and reused
+        self.vector_stores = {}
+        self.shards = shard_names()
+        #picks the shards a question is about, None searches every shard
+        self.library_router = Library_Router() if SHARD_ROUTING else None
+        #None keeps the retrieval order
+        self.reranker = Cross_Encoder_Reranker() if RERANK_ENABLED else None
+        #the bm25 index is memory-mapped, opening it is cheap and it's shared the same way
+        self.bm25 = None
+        #what the loaded index was read from, a rebuild swaps the whole directory (a new inode), see _open_bm25
+        self._bm25_key = None
+        self._bm25_checked = 0.0
+        #dense searches of concurrent requests share one embedding forward pass and one vector store query
+        self.dense_batcher = Micro_Batcher(self._dense_search_batch) if RETRIEVAL_BATCH_MAX_SIZE > 1 else None
+        self._index_lock = asyncio.Lock()
+        #set once the csv and the index are known to exist, requests then skip the check
+        self.index_ready = False
+        self._index_task = None
+
+    async def warmup(self):
+        #called once by the api lifespan
+        #first forward pass is slow (lazy init of the tokenizer and weights), so pay it here and not in the first request
+        await asyncio.to_thread(self.embedded_model.embed_query, "warmup")
+        if self.reranker is not None:
+            try:
+                await asyncio.to_thread(self.reranker.warmup)
+            except Exception as e:
+                logging.error(f"Could not load the re-ranker, answers will use the retrieval order: {e}")
+                self.reranker = None
+        if vector_index_exists():
+            for library in self.shards:
+                self._open_vector_store(library)
+        self._open_bm25()
+
+    def _open_vector_store(self, library):
+        if library not in self.vector_stores:
+            self.vector_stores[library] = open_vector_store(library, self.embedded_model)
+        return self.vector_stores[library]
+
+    def _open_bm25(self):
+        #a rebuild by the indexer cli (another process) is picked up within a second, like the ivf store does
+        #an index set from outside (benchmarks) has no key and is kept as it is
+        if self.bm25 is not None and (self._bm25_key is None or time.monotonic() - self._bm25_checked < 1.0):
+            return self.bm25
+        self._bm25_checked = time.monotonic()
+        try:
+            stat = os.stat(BM25_DIR)
+            key = (stat.st_ino, stat.st_mtime_ns)
+            if self.bm25 is None or key != self._bm25_key:
+                self.bm25 = Bm25_Index.load(BM25_DIR)
+                self._bm25_key = key
+        except OSError:
+            #no index yet, or caught in the middle of a swap, the next check gets it
+            pass
+        return self.bm25
 
     async def _scrapp_data(self, URLS=URLS_DOCS+URLS_GUIDES):
         #throw the urls to the scrap manager to get all the data and save it in a csv :)
@@ -24,26 +114,10 @@ class Rag_Pipeline:
         scp = Scrap_manager(URLS)
         await scp.scrapp_and_save()
 
-    async def _load_and_split_large_csv(self, file_path: str, content_column: str, source_column: str):
-        csv.field_size_limit(sys.maxsize)
-
-        all_docs = []
-        text_splitter = RecursiveCharacterTextSplitter(chunk_size=1000, chunk_overlap=200)
-
-        with open(file_path, mode='r', encoding='utf-8') as csvfile:
-            reader = csv.DictReader(csvfile, delimiter=',') 
-            for row in reader:
-                content = row[content_column]
-                source = row[source_column]
-                metadata = {"source": source}
-                if len(content) > 1000:
-                    chunks = text_splitter.create_documents([content], metadatas=[metadata])
-                    all_docs.extend(chunks)
-                else:
-                    doc = Document(page_content=content, metadata=metadata)
-                    all_docs.append(doc)
-
-        return all_docs
+    async def _load_and_split_large_csv(self, file_path: str, content_column: str = 'text', source_column: str = 'source'):
+        #the parquet corpus is already chunked (in the crawl's parse processes), a csv is split with the rules in chunking.py,
+        #so the incremental indexer produces exactly the same chunks either way
+        return [doc for _, doc in iter_chunks(file_path, content_column=content_column, source_column=source_column)]
 
     async def _load_docs(self):
         #pick all the data and load it to be processed
@@ -57,26 +131,176 @@ class Rag_Pipeline:
 
     async def _embedd_and_vec_store(self, splited_data):
         #just embedds
-        await Chroma.afrom_documents(documents=splited_data, embedding=self.embedded_model, persist_directory="./src/chroma_db")
+        self.vector_store = await Chroma.afrom_documents(documents=splited_data, embedding=self.embedded_model, persist_directory=CHROMA_DIR)
+
+    def _embed_queries(self, texts):
+        if hasattr(self.embedded_model, "embed_queries"):
+            return self.embedded_model.embed_queries(texts)
+        if len(texts) == 1:
+            return [self.embedded_model.embed_query(texts[0])]
+        #sentence-transformers models encode queries and documents the same way, so this is one forward pass
+        return self.embedded_model.embed_documents(texts)
+
+    def _dense_search_batch(self, requests):
+        #requests: [(input, k, libraries, where)] -> [(chunk id, Document)] per request, the ids are what bm25 is fused on
+        #every shard gets one query with all the requests that search it, and the hits of a request are merged by distance
+        #(same embedding model everywhere, so the distances compare across shards)
+        #a request on several shards only asks them for ids and distances, the text is fetched for the k winners only,
+        #otherwise a fan-out on every shard reads k documents per shard to keep k
+        with span("vector.search", queries=len(requests)) as s:
+            return self._dense_search_spanned(s, requests)
 
-    async def _retrieve(self, input):
-        #retrieve the most relevant data
-        vector_store = Chroma(persist_directory="./src/chroma_db", embedding_function=self.embedded_model)
-        retrieve = vector_store.as_retriever()
-        retrieved = await retrieve.ainvoke(input)
-        return retrieved
+    def _dense_search_spanned(self, s, requests):
+        embeddings = self._embed_queries([request[0] for request in requests])
+        groups = {}
+        for i, (_, _, libraries, where) in enumerate(requests):
+            for library in libraries or self.shards:
+                groups.setdefault((library, json.dumps(where, sort_keys=True) if where else None), []).append(i)
+        fan_out = any(len(request[2] or self.shards) > 1 for request in requests)
+        s.set("shards", len({library for library, _ in groups}))
+        s.set("fan_out", fan_out)
+        hits = [[] for _ in requests]
+        docs = {}
+        for (library, where_key), indexes in groups.items():
+            rows = self._open_vector_store(library).query([embeddings[i] for i in indexes], max(requests[i][1] for i in indexes),
+                                                          where=json.loads(where_key) if where_key else None, documents=not fan_out)
+            for row, i in zip(rows, indexes):
+                hits[i].extend((distance, cid, library) for cid, distance, _ in row)
+                if not fan_out:
+                    docs.update({cid: doc for cid, _, doc in row})
+        hits = [sorted(request_hits)[:k] for (_, k, _, _), request_hits in zip(requests, hits)]
+        if fan_out:
+            by_library = {}
+            for request_hits in hits:
+                for _, cid, library in request_hits:
+                    by_library.setdefault(library, set()).add(cid)
+            for library, ids in by_library.items():
+                docs.update(self._get_by_ids(list(ids), [library]))
+        return [[(cid, docs[cid]) for _, cid, _ in request_hits if cid in docs] for request_hits in hits]
 
-    async def query_docs(self, input):
+    async def _dense_search(self, input, k, libraries=None, where=None):
+        request = (input, k, tuple(libraries) if libraries else None, where)
+        if self.dense_batcher is None:
+            return (await asyncio.to_thread(self._dense_search_batch, [request]))[0]
+        return await self.dense_batcher.submit(request)
+
+    def _get_by_ids(self, ids, libraries=None):
+        #a get on every shard the ids could be in, a missing id costs nothing
+        docs = {}
+        for library in libraries or self.shards:
+            docs.update(self._open_vector_store(library).get(ids))
+            if len(docs) == len(ids):
+                break
+        return docs
+
+    def _get_lexical_hits(self, hits, libraries=None):
+        #hits: [(chunk_id, shard)] from bm25, the shard is known so it's one get per shard and not one on every shard
+        by_library = {}
+        for cid, library in hits:
+            by_library.setdefault(library, []).append(cid)
+        docs = {}
+        for library, ids in by_library.items():
+            docs.update(self._get_by_ids(ids, [library] if library else libraries))
+        return docs
+
+    async def _retrieve(self, input, k=RETRIEVAL_K, fetch_k=RETRIEVAL_FETCH_K, libraries=None, where=None):
+        #retrieve the most relevant data, hybrid: dense hits and bm25 hits fused by reciprocal rank
+        #libraries restricts the search to those shards (None = all), where is a {metadata field: value} filter
+        bm25 = self._open_bm25()
+        if bm25 is None:
+            return [doc for _, doc in await self._dense_search(input, k, libraries, where)]
+        dense, lexical = await asyncio.gather(self._dense_search(input, fetch_k, libraries, where),
+                                              asyncio.to_thread(bm25.search_shards, input, fetch_k, libraries))
+        docs = dict(dense)
+        shard_of = {cid: library for cid, _, library in lexical}
+        lexical_ids = [cid for cid, _, _ in lexical]
+        if where:
+            #the bm25 index has no metadata, its hits are checked against the filter once their text is fetched
+            missing = [cid for cid in lexical_ids if cid not in docs]
+            if missing:
+                docs.update(await asyncio.to_thread(self._get_lexical_hits, [(cid, shard_of[cid]) for cid in missing], libraries))
+            lexical_ids = [cid for cid in lexical_ids if cid in docs and matches_where(docs[cid].metadata, where)]
+        fused = reciprocal_rank_fusion([[cid for cid, _ in dense], lexical_ids],
+                                       weights=[DENSE_WEIGHT, LEXICAL_WEIGHT], k=RRF_K)[:k]
+        #lexical-only hits still need their text, one batched get per shard for all of them
+        missing = [cid for cid in fused if cid not in docs]
+        if missing:
+            docs.update(await asyncio.to_thread(self._get_lexical_hits, [(cid, shard_of[cid]) for cid in missing], libraries))
+        return [docs[cid] for cid in fused if cid in docs]
+
+    def start_index_build(self):
+        #a cold start crawls the docs and builds the index, minutes of work: it runs in the background from the api lifespan
+        #and never under the deadline of a request, which would cancel it every time. a failed build is started again by
+        #the next request
+        if not self.index_ready and (self._index_task is None or self._index_task.done()):
+            self._index_task = asyncio.create_task(self._ensure_index())
+            self._index_task.add_done_callback(_log_index_build)
+        return self._index_task
+
+    async def _ensure_index(self):
+        #the lock avoids a burst of first requests building the same index at the same time
+        if self.index_ready:
+            return
+        async with self._index_lock:
+            if not os.path.exists(corpus_path()):
+                await self._scrapp_data()
+            corpus = corpus_path()
+            indexer = Incremental_Indexer(self.embedded_model)
+            #an index from before the library shards (only the "langchain" collection) exists but the docs_* shards are
+            #empty, it's rebuilt here too
+            if not vector_index_exists() or await asyncio.to_thread(indexer.layout_changed):
+                #docs = await self._load_docs()
+                #splited_data = await self._split_docs(docs)
+                #first build goes through the incremental indexer too, so the chunks get stable ids and a manifest
+                report = await indexer.run(corpus)
+                print(f"Index built with {report['added']} chunks.")
+                self.vector_stores = indexer.vector_stores
+                self.bm25 = None
+                self._bm25_key = None
+            self.index_ready = True
+
+    async def query_docs(self, input, libraries=None, where=None):
         #abstraction to call all the internal steps, just runs the pipeline and returns the query, aka the relevant docs
-        if not os.path.exists('src/data/data.csv'):
-            await self._scrapp_data()
-        if not os.path.exists('./src/chroma_db'):
-            #docs = await self._load_docs()
-            #splited_data = await self._split_docs(docs)
-            splited_data = await self._load_and_split_large_csv('src/data/data.csv', 'text', 'source')
-            await self._embedd_and_vec_store(splited_data)
-        query = await self._retrieve(input)
-        return query
+        return (await self.query_context(input, libraries, where))['documents']
+
+    async def query_context(self, input, libraries=None, where=None, max_tokens=RAG_CONTEXT_TOKENS):
+        #what the final answer gets: the packed context text, the documents in it, per stage seconds and token counts
+        if not self.index_ready:
+            self.start_index_build()
+            raise Index_Building("The documentation index is still being built, retrieval is not available yet.")
+        timings = {}
+        start = time.perf_counter()
+        with span("rag.retrieve", libraries=list(libraries) if libraries else None):
+            candidates = await self.search(input, libraries, where, k=RERANK_CANDIDATES)
+        timings['retrieve'] = time.perf_counter() - start
+        start = time.perf_counter()
+        unique = dedup_chunks(candidates)
+        timings['dedup'] = time.perf_counter() - start
+        start = time.perf_counter()
+        with span("rag.rerank", candidates=len(unique)) as s:
+            ranked, reranked = (unique, False) if self.reranker is None else await self.reranker.rerank(input, unique)
+            s.set("reranked", reranked)
+        timings['rerank'] = time.perf_counter() - start
+        start = time.perf_counter()
+        context, documents = pack_context(ranked, max_tokens)
+        timings['pack'] = time.perf_counter() - start
+        #what went in the prompt before: the top RETRIEVAL_K documents as python objects
+        before = count_tokens(str(candidates[:RETRIEVAL_K]))
+        after = count_tokens(context)
+        stats = {'candidates': len(candidates), 'duplicates': len(candidates) - len(unique), 'documents': len(documents),
+                 'reranked': reranked, 'prompt_tokens': after, 'prompt_tokens_saved': before - after}
+        return {'context': context, 'documents': documents, 'timings': timings, 'stats': stats}
+
+    async def search(self, input, libraries=None, where=None, k=RETRIEVAL_K):
+        #retrieval on the existing index, routed to the shards the question is about
+        if libraries is None and self.library_router is not None:
+            libraries = self.library_router.route(input)
+        fetch_k = max(k, RETRIEVAL_FETCH_K)
+        docs = await self._retrieve(input, k, fetch_k, libraries=libraries, where=where)
+        if libraries and len(docs) < RETRIEVAL_K:
+            #the shard is too small (or the keyword was misleading), better answer from everything than from nothing
+            docs = await self._retrieve(input, k, fetch_k, where=where)
+        return docs
     
 # if __name__ == '__main__':
 #     qd = Rag_Pipeline()
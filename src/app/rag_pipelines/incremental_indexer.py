@@ -0,0 +1,258 @@
+import os
+import time
+import zlib
+import sqlite3
+import asyncio
+import argparse
+import threading
+
+from src.app.core.config import VECTOR_BACKEND, INDEX_MANIFEST_PATH, EMBED_BATCH_SIZE, BM25_DIR
+from src.app.rag_pipelines.chunking import content_hash
+from src.app.rag_pipelines.corpus import Crawl_Too_Small, corpus_path, source_hashes, iter_chunks
+from src.app.rag_pipelines.bm25_index import Bm25_Index
+from src.app.rag_pipelines.library_shards import library_of, layout_id
+from src.app.rag_pipelines.vector_stores import open_vector_store, drop_vector_stores, default_directory, vector_index_exists
+from src.app.rag_pipelines.streaming_ingest import Ingest_Pipeline
+
+#keeps the vector store in sync with the scrapped corpus (corpus.py) without re-embedding what didn't change
+#the manifest is a small sqlite db with the hash of every source and of every chunk that is in the store
+#it lives on disk (not in a dict) so it doesn't grow the memory with the corpus, and since a chunk is only
+#recorded after it was written to the store, it's also the checkpoint: a crashed run just picks up where it stopped
+#every chunk goes to the store of its library shard (see library_shards.py), in the VECTOR_BACKEND (see vector_stores.py)
+
+class Index_Manifest:
+    def __init__(self, path=INDEX_MANIFEST_PATH):
+        #the ingest pipeline writes from worker threads, so one connection guarded by a lock
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.lock = threading.Lock()
+        with self.lock, self.conn:
+            self.conn.execute("CREATE TABLE IF NOT EXISTS sources (source TEXT PRIMARY KEY, hash TEXT)")
+            self.conn.execute("CREATE TABLE IF NOT EXISTS chunks (id TEXT PRIMARY KEY, source TEXT, hash TEXT, run INTEGER)")
+            self.conn.execute("CREATE INDEX IF NOT EXISTS chunks_source ON chunks (source)")
+            self.conn.execute("CREATE INDEX IF NOT EXISTS chunks_run ON chunks (run)")
+            self.conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value REAL)")
+
+    def get_meta(self, key, default=None):
+        with self.lock:
+            row = self.conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else default
+
+    def set_meta(self, key, value):
+        with self.lock, self.conn:
+            self.conn.execute("INSERT OR REPLACE INTO meta VALUES (?, ?)", (key, value))
+
+    def source_hashes(self):
+        with self.lock:
+            return dict(self.conn.execute("SELECT source, hash FROM sources"))
+
+    def set_sources(self, hashes: dict):
+        with self.lock, self.conn:
+            self.conn.execute("DELETE FROM sources")
+            self.conn.executemany("INSERT INTO sources VALUES (?, ?)", hashes.items())
+
+    def chunk_hash(self, cid):
+        with self.lock:
+            row = self.conn.execute("SELECT hash FROM chunks WHERE id = ?", (cid,)).fetchone()
+        return row[0] if row else None
+
+    def touch_source(self, source, run):
+        #marks every chunk of an unchanged source as seen in this run, returns how many
+        with self.lock, self.conn:
+            return self.conn.execute("UPDATE chunks SET run = ? WHERE source = ?", (run, source)).rowcount
+
+    def touch_chunk(self, cid, run):
+        with self.lock, self.conn:
+            self.conn.execute("UPDATE chunks SET run = ? WHERE id = ?", (run, cid))
+
+    def put_chunks(self, rows):
+        #rows: (id, source, hash, run)
+        with self.lock, self.conn:
+            self.conn.executemany("INSERT OR REPLACE INTO chunks VALUES (?, ?, ?, ?)", rows)
+
+    def stale_chunks(self, run):
+        #(id, source), the source tells which shard the chunk is in
+        with self.lock:
+            return self.conn.execute("SELECT id, source FROM chunks WHERE run != ?", (run,)).fetchall()
+
+    def has_chunks(self):
+        with self.lock:
+            return self.conn.execute("SELECT 1 FROM chunks LIMIT 1").fetchone() is not None
+
+    def reset(self):
+        #forgets every source and chunk, the next run writes everything again
+        with self.lock, self.conn:
+            self.conn.execute("DELETE FROM chunks")
+            self.conn.execute("DELETE FROM sources")
+
+    def delete_chunks(self, ids):
+        with self.lock, self.conn:
+            self.conn.executemany("DELETE FROM chunks WHERE id = ?", ((cid,) for cid in ids))
+
+    def close(self):
+        self.conn.close()
+
+class Incremental_Indexer:
+    def __init__(self, embedded_model, persist_directory=None, manifest_path=INDEX_MANIFEST_PATH, batch_size=EMBED_BATCH_SIZE,
+                 store_factory=None, bm25_directory=BM25_DIR, backend=VECTOR_BACKEND):
+        self.embedded_model = embedded_model
+        self.backend = backend
+        self.persist_directory = persist_directory or default_directory(backend)
+        self.manifest_path = manifest_path
+        #None skips the bm25 rebuild
+        self.bm25_directory = bm25_directory
+        self.batch_size = batch_size
+        #library -> store of that shard, opened on first use, store_factory(library) replaces the backend (benchmarks)
+        self.store_factory = store_factory
+        self.vector_stores = {}
+
+    def _open_vector_store(self, library):
+        if library not in self.vector_stores:
+            if self.store_factory is not None:
+                self.vector_stores[library] = self.store_factory(library)
+            else:
+                self.vector_stores[library] = open_vector_store(library, self.embedded_model, self.backend, self.persist_directory)
+        return self.vector_stores[library]
+
+    def _check_layout(self, manifest: Index_Manifest):
+        #an index from before the shards (one "langchain" collection), from another source -> shard mapping or written to
+        #another vector backend: the stores are dropped and the manifest forgotten, so this run writes every chunk to its shard
+        #again (the vectors come from the embedding cache, it's a rewrite, not a re-embedding)
+        if self._layout_matches(manifest):
+            return
+        #a store with no manifest behind it is the old "langchain" collection, dropped as well
+        if manifest.has_chunks() or (self.store_factory is None and vector_index_exists(self.backend, self.persist_directory)):
+            print("Shard layout or vector backend changed, moving every chunk to its library store...")
+            manifest.reset()
+            if self.store_factory is None:
+                drop_vector_stores(self.backend, self.persist_directory)
+                self.vector_stores = {}
+        manifest.set_meta("shard_layout", layout_id())
+        manifest.set_meta("vector_backend", zlib.crc32(self.backend.encode('utf-8')))
+
+    def _layout_matches(self, manifest: Index_Manifest) -> bool:
+        #manifests from before the backends were all chroma
+        return manifest.get_meta("shard_layout") == layout_id() and \
+            manifest.get_meta("vector_backend", zlib.crc32(b"chroma")) == zlib.crc32(self.backend.encode('utf-8'))
+
+    def layout_changed(self) -> bool:
+        #checked at startup: an index written before the shards, with another source -> shard mapping or to another
+        #backend has to go through a run, which moves it to the current layout
+        manifest = Index_Manifest(self.manifest_path)
+        try:
+            return not self._layout_matches(manifest)
+        finally:
+            manifest.close()
+
+    def _changed_chunks(self, file_path, manifest, unchanged, run, report):
+        #lazy generator of the chunks that need to be embedded, everything else is only marked as seen
+        for cid, doc in iter_chunks(file_path, skip=unchanged):
+            h = content_hash(doc.page_content)
+            old_hash = manifest.chunk_hash(cid)
+            if old_hash == h:
+                manifest.touch_chunk(cid, run)
+                report["skipped"] += 1
+                continue
+            report["updated" if old_hash is not None else "added"] += 1
+            doc.metadata["hash"] = h
+            yield cid, doc
+
+    def _write_batch(self, manifest, run):
+        def write(ids, docs, vectors):
+            hashes = [doc.metadata.pop("hash") for doc in docs]
+            #one upsert per shard in the batch, upsert so changed chunks are replaced in place under the same id
+            by_library = {}
+            for i, doc in enumerate(docs):
+                by_library.setdefault(doc.metadata["library"], []).append(i)
+            for library, rows in by_library.items():
+                self._open_vector_store(library).upsert(ids=[ids[i] for i in rows], embeddings=[vectors[i] for i in rows],
+                                                        documents=[docs[i].page_content for i in rows],
+                                                        metadatas=[docs[i].metadata for i in rows])
+            #only recorded after the store has it, that's what makes a crashed run resumable
+            manifest.put_chunks([(cid, doc.metadata["source"], h, run) for cid, doc, h in zip(ids, docs, hashes)])
+        return write
+
+    async def run(self, file_path=None):
+        #file_path is the parquet corpus or an old style csv, None is whichever corpus_path() finds
+        file_path = file_path or corpus_path()
+        manifest = Index_Manifest(self.manifest_path)
+        try:
+            return await self._run(file_path, manifest)
+        finally:
+            manifest.close()
+
+    async def _run(self, file_path, manifest: Index_Manifest):
+        self._check_layout(manifest)
+        run = int(manifest.get_meta("run", 0)) + 1
+        manifest.set_meta("run", run)
+        #first pass, only hashes, so it's cheap and doesn't keep any text in memory
+        hashes = await asyncio.to_thread(source_hashes, file_path)
+        old_sources = manifest.source_hashes()
+        if not hashes and old_sources:
+            #an empty corpus would delete every chunk of the store, it's a broken crawl or the wrong file, not a real change
+            raise ValueError(f"{file_path} has no pages, the index of {len(old_sources)} pages is left as it is")
+        report = {"added": 0, "updated": 0, "deleted": 0, "skipped": 0, "embed_seconds": 0.0}
+
+        #sources that didn't change keep all their chunks, no need to even split them again
+        unchanged = {source for source, h in hashes.items() if old_sources.get(source) == h}
+        for source in unchanged:
+            report["skipped"] += manifest.touch_source(source, run)
+
+        pipeline = Ingest_Pipeline(self.embedded_model, self._write_batch(manifest, run), batch_size=self.batch_size)
+        start = time.perf_counter()
+        stats = await pipeline.run(self._changed_chunks(file_path, manifest, unchanged, run, report))
+        report["embed_seconds"] = time.perf_counter() - start if stats["chunks"] else 0.0
+
+        #chunks that were not seen in this run: their source vanished or got shorter
+        stale = {}
+        for cid, source in manifest.stale_chunks(run):
+            stale.setdefault(library_of(source), []).append(cid)
+        for library, library_stale in stale.items():
+            vector_store = self._open_vector_store(library)
+            for i in range(0, len(library_stale), self.batch_size):
+                ids = library_stale[i:i + self.batch_size]
+                await asyncio.to_thread(vector_store.delete, ids=ids)
+                manifest.delete_chunks(ids)
+        report["deleted"] = sum(len(ids) for ids in stale.values())
+        #the ivf backend builds its index here, chroma already has everything
+        for vector_store in self.vector_stores.values():
+            await asyncio.to_thread(vector_store.persist)
+        #source hashes are only saved at the very end, after all their chunks are in the store
+        manifest.set_sources(hashes)
+
+        #time saved is estimated with the per chunk cost measured in this run (or the last one that embedded something)
+        if stats["chunks"]:
+            manifest.set_meta("seconds_per_chunk", report["embed_seconds"] / stats["chunks"])
+        report["embed_seconds_saved"] = report["skipped"] * manifest.get_meta("seconds_per_chunk", 0.0)
+
+        #the lexical index is rebuilt over the same chunks (same ids), no embeddings involved so a full pass is cheap
+        if self.bm25_directory is not None and (stats["chunks"] or report["deleted"] or not os.path.exists(self.bm25_directory)):
+            await asyncio.to_thread(self._rebuild_bm25, file_path)
+        return report
+
+    def _rebuild_bm25(self, file_path):
+        chunks = ((cid, doc.page_content, doc.metadata["library"]) for cid, doc in iter_chunks(file_path))
+        Bm25_Index.build(chunks).save(self.bm25_directory)
+
+def main():
+    parser = argparse.ArgumentParser(description="Incrementally sync the vector store with the scrapped corpus")
+    parser.add_argument("--corpus", "--csv", dest="corpus", default=None, help="parquet corpus or old style csv, default: the scrapped one")
+    parser.add_argument("--scrape", action="store_true", help="re-scrape every seed before indexing")
+    args = parser.parse_args()
+
+    from src.app.rag_pipelines.general_rag_pipeline import Rag_Pipeline, get_embedded_model
+    if args.scrape:
+        try:
+            asyncio.run(Rag_Pipeline()._scrapp_data())
+        except Crawl_Too_Small as e:
+            #nothing is indexed from a failed crawl, the store stays as it is
+            raise SystemExit(str(e))
+    report = asyncio.run(Incremental_Indexer(get_embedded_model()).run(args.corpus))
+    print(f"added={report['added']} updated={report['updated']} deleted={report['deleted']} skipped={report['skipped']}")
+    print(f"embedding time: {report['embed_seconds']:.2f}s, saved: ~{report['embed_seconds_saved']:.2f}s")
+    embedded_model = get_embedded_model()
+    if hasattr(embedded_model, "hit_rates"):
+        rates = embedded_model.hit_rates()
+        print(f"embedding cache: {rates['document_hits']} hits, {rates['document_misses']} misses ({rates['document_hit_rate']:.0%})")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,295 @@
+import os
+import json
+import time
+import shutil
+import sqlite3
+import logging
+import threading
+import numpy as np
+from langchain_core.documents import Document
+
+from src.app.core.config import IVF_NLIST, IVF_NPROBE, IVF_RESCORE
+from src.app.rag_pipelines.vector_stores import matches_where
+
+#vector store of one shard without chroma: a small sqlite db with the chunks (id, text, metadata, float32 vector) is the
+#source of truth, and persist() builds an index out of it in a directory of .npy files that are memory-mapped when opened:
+#   centroids.npy   (nlist, dim) float32, k-means of a sample of the vectors
+#   offsets.npy     (nlist + 1,) where every list starts, the rows are sorted by list so a list is one contiguous slice
+#   codes.npy       (n, dim) int8, every vector scaled by its own max, scales.npy (n,) the scale
+#   vectors.npy     (n, dim) float32, only read for the candidates that get re-scored
+#   norms.npy       (n,) squared norm of every vector, ids.npy (n,) the chunk ids
+#a query scores the centroids, scans the int8 codes of the nprobe closest lists, re-scores the best IVF_RESCORE with
+#the float vectors and returns exact squared l2 distances, the same metric as chroma
+#opening maps the files and reads nothing else, a new worker is serving in milliseconds and only the pages of the lists
+#it probes end up in memory. writes since the last persist() are searched exhaustively until the next one
+
+SAMPLE_PER_LIST = 64
+MAX_SAMPLE = 200_000
+READ_BATCH = 65536
+
+def nearest_centroids(vectors, centroids, batch=READ_BATCH):
+    #argmin of the l2 distance, ||c||^2 - 2 x.c, ||x||^2 is the same for every centroid
+    half_norms = 0.5 * np.einsum('ij,ij->i', centroids, centroids)
+    return np.concatenate([np.argmax(vectors[start:start + batch] @ centroids.T - half_norms, axis=1)
+                           for start in range(0, len(vectors), batch)]) if len(vectors) else np.zeros(0, dtype=np.int64)
+
+def train_centroids(sample, nlist, iterations=10, seed=0):
+    rng = np.random.default_rng(seed)
+    nlist = min(nlist, len(sample))
+    centroids = sample[rng.choice(len(sample), nlist, replace=False)].copy()
+    for _ in range(iterations):
+        assign = nearest_centroids(sample, centroids)
+        counts = np.bincount(assign, minlength=nlist)
+        order = np.argsort(assign, kind='stable')
+        filled = np.flatnonzero(counts)
+        starts = np.concatenate([[0], np.cumsum(counts)[:-1]])[filled]
+        centroids[filled] = np.add.reduceat(sample[order], starts, axis=0) / counts[filled, None]
+        #an empty list gets a random point, better than a centroid nobody is close to
+        empty = np.flatnonzero(counts == 0)
+        if len(empty):
+            centroids[empty] = sample[rng.choice(len(sample), len(empty))]
+    return centroids.astype(np.float32)
+
+def quantize(vectors):
+    #symmetric int8 per vector, the scale brings the largest component to 127
+    scales = np.maximum(np.abs(vectors).max(axis=1), 1e-12) / 127
+    return np.round(vectors / scales[:, None]).astype(np.int8), scales.astype(np.float32)
+
+class _Ivf_Index:
+    #one built index, read only, shared by every query
+    def __init__(self, path):
+        load = lambda name: np.load(os.path.join(path, name), mmap_mode='r')
+        self.path = path
+        #the centroids are small and scored on every query, those are read for real
+        self.centroids = np.array(load("centroids.npy"))
+        self.centroid_half_norms = 0.5 * np.einsum('ij,ij->i', self.centroids, self.centroids)
+        self.offsets = np.array(load("offsets.npy"))
+        self.codes = load("codes.npy")
+        self.scales = load("scales.npy")
+        self.vectors = load("vectors.npy")
+        self.norms = load("norms.npy")
+        self.ids = load("ids.npy")
+
+    def __len__(self):
+        return len(self.ids)
+
+    def probe(self, queries, nprobe):
+        scores = queries @ self.centroids.T - self.centroid_half_norms
+        nprobe = min(nprobe, len(self.centroids))
+        if nprobe == len(self.centroids):
+            return np.tile(np.arange(nprobe), (len(queries), 1))
+        return np.argpartition(-scores, nprobe - 1, axis=1)[:, :nprobe]
+
+    def search(self, query, query_norm, lists, n_candidates):
+        #-> (rows, exact squared l2 distances), closest first
+        ranges = [(self.offsets[l], self.offsets[l + 1]) for l in np.sort(lists) if self.offsets[l + 1] > self.offsets[l]]
+        if not ranges:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+        rows = np.concatenate([np.arange(start, end) for start, end in ranges])
+        codes = np.concatenate([self.codes[start:end] for start, end in ranges]) if len(ranges) > 1 else self.codes[ranges[0][0]:ranges[0][1]]
+        approx = self.norms[rows] - 2 * (codes.astype(np.float32) @ query) * self.scales[rows]
+        if len(rows) > n_candidates:
+            rows = rows[np.argpartition(approx, n_candidates - 1)[:n_candidates]]
+        #sorted rows, so the float vectors are read front to back
+        rows = np.sort(rows)
+        exact = self.norms[rows] - 2 * (self.vectors[rows] @ query) + query_norm
+        order = np.argsort(exact)
+        return rows[order], exact[order]
+
+class Ivf_Vector_Store:
+    def __init__(self, directory, nlist=IVF_NLIST, nprobe=IVF_NPROBE, rescore=IVF_RESCORE):
+        self.directory = directory
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self.rescore = rescore
+        os.makedirs(directory, exist_ok=True)
+        #queries come from worker threads, one connection guarded by a lock
+        self.conn = sqlite3.connect(os.path.join(directory, "chunks.sqlite"), check_same_thread=False)
+        self.lock = threading.Lock()
+        with self.lock, self.conn:
+            self.conn.execute("CREATE TABLE IF NOT EXISTS chunks (id TEXT PRIMARY KEY, document TEXT, metadata TEXT, vector BLOB)")
+            self.conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value INTEGER)")
+        #what this process wrote since the index was built: new vectors are scanned exhaustively, changed and deleted ids
+        #are dropped from the index hits
+        self.pending = {}
+        self.stale = set()
+        self.index = None
+        self.generation = None
+        self.checked = 0.0
+        self._load()
+
+    def _meta(self, key, default=None):
+        with self.lock:
+            row = self.conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else default
+
+    def _load(self):
+        generation = self._meta("generation")
+        if generation == self.generation:
+            return
+        path = os.path.join(self.directory, f"index-{generation}")
+        self.index = _Ivf_Index(path) if generation is not None and os.path.exists(path) else None
+        self.generation = generation
+        if self._meta("dirty", 0) and not self.pending and not self.stale:
+            logging.warning(f"{self.directory} has writes that are not in its index yet, they show up after the next persist()")
+
+    def _maybe_reload(self):
+        #an index persisted by another process (the indexer cli) is picked up within a second
+        now = time.monotonic()
+        if now - self.checked > 1.0:
+            self.checked = now
+            if not self.pending and not self.stale:
+                self._load()
+
+    def upsert(self, ids, embeddings, documents, metadatas):
+        vectors = np.asarray(embeddings, dtype=np.float32)
+        with self.lock, self.conn:
+            self.conn.executemany("INSERT OR REPLACE INTO chunks VALUES (?, ?, ?, ?)",
+                                  ((cid, text, json.dumps(metadata or {}), vector.tobytes())
+                                   for cid, text, metadata, vector in zip(ids, documents, metadatas, vectors)))
+            self.conn.execute("INSERT OR REPLACE INTO meta VALUES ('dirty', 1)")
+            self.conn.execute("INSERT OR IGNORE INTO meta VALUES ('dim', ?)", (vectors.shape[1],))
+            self.stale.update(ids)
+            self.pending.update(zip(ids, vectors))
+
+    def delete(self, ids):
+        with self.lock, self.conn:
+            self.conn.executemany("DELETE FROM chunks WHERE id = ?", ((cid,) for cid in ids))
+            self.conn.execute("INSERT OR REPLACE INTO meta VALUES ('dirty', 1)")
+            self.stale.update(ids)
+            for cid in ids:
+                self.pending.pop(cid, None)
+
+    def count(self):
+        with self.lock:
+            return self.conn.execute("SELECT COUNT(*) FROM chunks").fetchone()[0]
+
+    def get(self, ids):
+        docs = {}
+        with self.lock:
+            for start in range(0, len(ids), 500):
+                batch = ids[start:start + 500]
+                rows = self.conn.execute(f"SELECT id, document, metadata FROM chunks WHERE id IN ({','.join('?' * len(batch))})", batch)
+                docs.update({cid: Document(page_content=text, metadata=json.loads(metadata)) for cid, text, metadata in rows})
+        return docs
+
+    def query(self, embeddings, k, where=None, documents=True):
+        self._maybe_reload()
+        queries = np.asarray(embeddings, dtype=np.float32).reshape(len(embeddings), -1)
+        index = self.index
+        with self.lock:
+            pending_ids = list(self.pending)
+            pending = np.stack([self.pending[cid] for cid in pending_ids]) if pending_ids else None
+            stale = set(self.stale)
+        probes = index.probe(queries, self.nprobe) if index is not None and len(index) else None
+        #a filter is checked on the metadata after the search, so a filtered query keeps every re-scored candidate
+        keep = max(k, self.rescore) if where else k
+        results = []
+        for i, query in enumerate(queries):
+            query_norm = float(query @ query)
+            hits = []
+            if probes is not None:
+                rows, distances = index.search(query, query_norm, probes[i], max(self.rescore, keep))
+                ids = [cid.decode() for cid in index.ids[rows]]
+                hits += [(cid, float(distance)) for cid, distance in zip(ids, distances) if cid not in stale]
+            if pending is not None:
+                distances = np.einsum('ij,ij->i', pending, pending) - 2 * (pending @ query) + query_norm
+                top = np.argsort(distances)[:keep]
+                hits += [(pending_ids[j], float(distances[j])) for j in top]
+            hits.sort(key=lambda hit: hit[1])
+            results.append(hits[:keep])
+        if not documents and not where:
+            return [[(cid, distance, None) for cid, distance in hits] for hits in results]
+        docs = self.get(list({cid for hits in results for cid, _ in hits}))
+        rows = []
+        for hits in results:
+            hits = [(cid, distance, docs[cid]) for cid, distance in hits
+                    if cid in docs and (not where or matches_where(docs[cid].metadata, where))][:k]
+            rows.append(hits if documents else [(cid, distance, None) for cid, distance, _ in hits])
+        return rows
+
+    def _iter_vectors(self, dim, query="SELECT id, vector FROM chunks ORDER BY rowid", params=()):
+        #(ids, (n, dim) float32) batches, read with a separate cursor so the whole table is never in memory
+        cursor = self.conn.execute(query, params)
+        while True:
+            rows = cursor.fetchmany(READ_BATCH)
+            if not rows:
+                return
+            yield [cid for cid, _ in rows], np.frombuffer(b"".join(vector for _, vector in rows), dtype=np.float32).reshape(-1, dim)
+
+    def persist(self):
+        #builds a new index generation when something was written since the last one, the old one is removed once it's replaced
+        #(a process that still has it mapped keeps reading it, unlinked files stay valid while mapped)
+        if not self._meta("dirty", 0) and self.generation is not None:
+            return
+        with self.lock:
+            n, id_length = self.conn.execute("SELECT COUNT(*), MAX(LENGTH(id)) FROM chunks").fetchone()
+            row = self.conn.execute("SELECT value FROM meta WHERE key = 'dim'").fetchone()
+        generation = (self.generation or 0) + 1
+        path = os.path.join(self.directory, f"index-{generation}")
+        if n:
+            self._build(path, n, row[0], id_length)
+        with self.lock, self.conn:
+            self.conn.execute("INSERT OR REPLACE INTO meta VALUES ('generation', ?)", (generation,))
+            self.conn.execute("INSERT OR REPLACE INTO meta VALUES ('dirty', 0)")
+            self.pending, self.stale = {}, set()
+        self._load()
+        for name in os.listdir(self.directory):
+            if name.startswith("index-") and name != f"index-{generation}":
+                shutil.rmtree(os.path.join(self.directory, name), ignore_errors=True)
+
+    def _centroids(self, n, dim):
+        #the lists of the previous generation are kept while the corpus is within 2x of the size they were trained on,
+        #an incremental run then only costs the assignment and the rewrite, not a new k-means
+        previous = self.index
+        if previous is not None and len(previous) and n / 2 <= len(previous) <= n * 2 and previous.centroids.shape[1] == dim:
+            return previous.centroids
+        #more lists than the usual sqrt(n): each one is smaller, so the same nprobe scans fewer rows and finds more neighbours
+        nlist = self.nlist or int(min(max(2 * np.sqrt(n), 1), 4096))
+        step = max(n // min(max(nlist * SAMPLE_PER_LIST, 10000), MAX_SAMPLE), 1)
+        with self.lock:
+            sample = np.concatenate([vectors for _, vectors in self._iter_vectors(
+                dim, "SELECT id, vector FROM chunks WHERE rowid % ? = 0", (step,))])
+        if len(sample) < nlist:
+            with self.lock:
+                sample = np.concatenate([vectors for _, vectors in self._iter_vectors(dim)])
+        return train_centroids(sample, nlist)
+
+    def _build(self, path, n, dim, id_length):
+        start = time.perf_counter()
+        centroids = self._centroids(n, dim)
+        #first pass: the list of every row, then the rows are laid out list by list
+        ids = np.empty(n, dtype=f"S{id_length}")
+        assign = np.empty(n, dtype=np.int64)
+        position = 0
+        with self.lock:
+            for batch_ids, vectors in self._iter_vectors(dim):
+                ids[position:position + len(batch_ids)] = batch_ids
+                assign[position:position + len(batch_ids)] = nearest_centroids(vectors, centroids)
+                position += len(batch_ids)
+        order = np.argsort(assign, kind='stable')
+        destination = np.empty(n, dtype=np.int64)
+        destination[order] = np.arange(n)
+        os.makedirs(path, exist_ok=True)
+        create = lambda name, dtype, shape: np.lib.format.open_memmap(os.path.join(path, name), mode='w+', dtype=dtype, shape=shape)
+        codes, scales = create("codes.npy", np.int8, (n, dim)), create("scales.npy", np.float32, (n,))
+        vectors_out, norms = create("vectors.npy", np.float32, (n, dim)), create("norms.npy", np.float32, (n,))
+        #second pass writes every batch to its place, the table is read in the same order as the first pass
+        position = 0
+        with self.lock:
+            for batch_ids, vectors in self._iter_vectors(dim):
+                rows = destination[position:position + len(batch_ids)]
+                codes[rows], scales[rows] = quantize(vectors)
+                vectors_out[rows] = vectors
+                norms[rows] = np.einsum('ij,ij->i', vectors, vectors)
+                position += len(batch_ids)
+        for array in (codes, scales, vectors_out, norms):
+            array.flush()
+        del codes, scales, vectors_out, norms
+        np.save(os.path.join(path, "ids.npy"), ids[order])
+        np.save(os.path.join(path, "centroids.npy"), centroids)
+        np.save(os.path.join(path, "offsets.npy"), np.concatenate([[0], np.cumsum(np.bincount(assign, minlength=len(centroids)))]))
+        logging.info(f"Built the ivf index of {self.directory}: {n} vectors, {len(centroids)} lists in {time.perf_counter() - start:.1f}s")
+
+    def close(self):
+        self.conn.close()
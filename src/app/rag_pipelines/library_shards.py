@@ -0,0 +1,46 @@
+import json
+import zlib
+from urllib.parse import urlparse
+
+from src.app.core.config import LIBRARY_SOURCES, LIBRARY_KEYWORDS, GENERAL_LIBRARY
+from src.app.rag_pipelines.bm25_index import tokenize
+
+#the corpus is partitioned per library (sklearn, pandas, the ml guides...), one chroma collection each
+#ingestion derives the shard from the source url, the query side picks the shards from the question with a keyword map,
+#so a pandas question doesn't compete with the tensorflow tutorials and the spark docs
+
+def library_of(source: str) -> str:
+    #longest matching "domain/path" prefix wins, so a guide hosted on a library domain can still get its own shard
+    #a domain also matches its subdomains (docs.pytorch.org is pytorch.org)
+    parsed = urlparse(source)
+    host = parsed.netloc.lower().removeprefix("www.")
+    best, best_length = GENERAL_LIBRARY, 0
+    for library, prefixes in LIBRARY_SOURCES.items():
+        for prefix in prefixes:
+            prefix_host, _, prefix_path = prefix.partition("/")
+            if len(prefix) > best_length and (host == prefix_host or host.endswith("." + prefix_host)) \
+                    and parsed.path.startswith("/" + prefix_path if prefix_path else ""):
+                best, best_length = library, len(prefix)
+    return best
+
+def shard_names() -> list[str]:
+    return list(LIBRARY_SOURCES) + [GENERAL_LIBRARY]
+
+def collection_name(library: str) -> str:
+    return f"docs_{library}"
+
+def layout_id() -> int:
+    #changes when the source -> shard mapping changes, the indexer then moves every chunk to its new shard
+    return zlib.crc32(json.dumps(LIBRARY_SOURCES, sort_keys=True).encode('utf-8'))
+
+class Library_Router:
+    def __init__(self, keywords=LIBRARY_KEYWORDS):
+        #as they are, tokenize would also split "tf.data" into "tf" and "data" and route every question about data
+        self.keywords = {library: frozenset(word.lower() for word in words) for library, words in keywords.items()}
+
+    def route(self, text: str) -> list[str]:
+        #the shards named by the question, [] means search all of them
+        tokens = set(tokenize(text))
+        #"tf.data.Dataset" names tf.data too
+        tokens.update(".".join(parts[:i]) for parts in (token.split(".") for token in list(tokens)) for i in range(2, len(parts)))
+        return [library for library, words in self.keywords.items() if tokens & words]
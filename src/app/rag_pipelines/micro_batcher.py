@@ -0,0 +1,72 @@
+import asyncio
+import logging
+import contextvars
+
+from src.app.core.config import RETRIEVAL_BATCH_MAX_SIZE, RETRIEVAL_BATCH_MAX_WAIT_MS
+from src.app.core.tracing import span, current_span_context
+
+#concurrent requests are collected for a few ms (or until the batch is full) and processed together
+#sentence-transformers and chroma both do one matrix multiply for a whole batch, so 16 queries cost
+#little more than 1, and the work runs in a thread so the event loop keeps serving the other requests
+#only one batch runs at a time, whatever arrives meanwhile waits in the queue and becomes the next batch
+#a batch serves several requests, so its span is a trace of its own, linked to the span of every request in it
+
+class Micro_Batcher:
+    def __init__(self, process_batch, max_batch_size=RETRIEVAL_BATCH_MAX_SIZE, max_wait=RETRIEVAL_BATCH_MAX_WAIT_MS / 1000):
+        #process_batch(items) -> results, same order, it's a plain function and runs in a worker thread
+        self.process_batch = process_batch
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.queue = None
+        self.worker = None
+        self.stats = {"batches": 0, "items": 0, "max_batch": 0}
+
+    async def submit(self, item):
+        #the worker belongs to the loop that started it, a new loop (or a dead worker) gets a new one
+        if self.worker is None or self.worker.done():
+            self.queue = asyncio.Queue()
+            #started in an empty context, or every batch would be traced under the request that happened to start the worker
+            self.worker = contextvars.Context().run(asyncio.create_task, self._run())
+        future = asyncio.get_running_loop().create_future()
+        self.queue.put_nowait((item, future, current_span_context()))
+        return await future
+
+    async def _collect(self):
+        loop = asyncio.get_running_loop()
+        batch = [await self.queue.get()]
+        deadline = loop.time() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            if not self.queue.empty():
+                batch.append(self.queue.get_nowait())
+                continue
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        #callers that gave up (timeout of their graph branch) are not worth computing
+        return [(item, future, link) for item, future, link in batch if not future.done()]
+
+    async def _run(self):
+        while True:
+            batch = await self._collect()
+            if not batch:
+                continue
+            self.stats["batches"] += 1
+            self.stats["items"] += len(batch)
+            self.stats["max_batch"] = max(self.stats["max_batch"], len(batch))
+            try:
+                links = [link for _, _, link in batch if link is not None]
+                with span("retrieval.batch", links=links, size=len(batch)):
+                    results = await asyncio.to_thread(self.process_batch, [item for item, _, _ in batch])
+            except Exception as e:
+                logging.error(f"Batch of {len(batch)} failed: {e}")
+                for _, future, _ in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+            for (_, future, _), result in zip(batch, results):
+                if not future.done():
+                    future.set_result(result)
@@ -0,0 +1,146 @@
+import time
+import zlib
+import asyncio
+import logging
+import threading
+
+from src.app.core.config import (RERANK_MODEL_NAME, RERANK_CANDIDATES, RERANK_BUDGET_MS, RERANK_PROBE_EVERY, DEDUP_THRESHOLD,
+                                 RAG_CONTEXT_TOKENS, CHUNK_OVERLAP)
+from src.app.agent_workflow.conversation_memory import count_tokens, clip_tokens
+
+#what happens between the hybrid retrieval and the prompt of the final answer:
+#   dedup:  the splitter overlaps chunks by CHUNK_OVERLAP chars and the crawl finds the same page under several urls,
+#           so the candidates are full of near copies, the lower ranked copy goes
+#   rerank: a small cross-encoder reads (question, chunk) pairs, far better than the embedding distance for the top spots,
+#           but it's the slow stage, so it has a latency budget and falls back to the retrieval order
+#   pack:   the chunks go in as "[n] source + text" until the token budget, the overlap with a chunk already packed is cut
+
+def shingles(text: str, size=5) -> set:
+    words = text.lower().split()
+    return {zlib.crc32(" ".join(words[i:i + size]).encode('utf-8')) for i in range(max(len(words) - size + 1, 1))}
+
+def dedup_chunks(docs, threshold=DEDUP_THRESHOLD):
+    #keeps the best ranked of every group of near duplicates, containment and not jaccard so a chunk inside a longer one counts
+    kept, kept_shingles = [], []
+    for doc in docs:
+        current = shingles(doc.page_content)
+        if any(len(current & other) / max(min(len(current), len(other)), 1) >= threshold for other in kept_shingles):
+            continue
+        kept.append(doc)
+        kept_shingles.append(current)
+    return kept
+
+def strip_overlap(text: str, packed: list[str], min_chars=50, max_chars=CHUNK_OVERLAP * 2) -> str:
+    #neighbour chunks of a page share up to CHUNK_OVERLAP chars at their edges, the copy already in the prompt is enough
+    for other in packed:
+        for length in range(min(len(other), len(text), max_chars), min_chars - 1, -1):
+            if other.endswith(text[:length]):
+                text = text[length:]
+                break
+        for length in range(min(len(other), len(text), max_chars), min_chars - 1, -1):
+            if other.startswith(text[-length:]):
+                text = text[:-length]
+                break
+    return text.strip()
+
+def pack_context(docs, max_tokens=RAG_CONTEXT_TOKENS, min_tokens=100):
+    #-> (context text, the documents that made it in)
+    blocks, kept, used = [], [], 0
+    packed_by_source = {}
+    for doc in docs:
+        source = doc.metadata.get('source', 'N/A')
+        text = strip_overlap(doc.page_content, packed_by_source.get(source, []))
+        if not text:
+            continue
+        header = f"[{len(kept) + 1}] {source}\n"
+        left = max_tokens - used - count_tokens(header)
+        if left < min_tokens:
+            break
+        text = clip_tokens(text, left)
+        blocks.append(header + text)
+        kept.append(doc)
+        used += count_tokens(blocks[-1])
+        packed_by_source.setdefault(source, []).append(doc.page_content)
+    return "\n\n".join(blocks), kept
+
+class Cross_Encoder_Reranker:
+    def __init__(self, model_name=RERANK_MODEL_NAME, budget=RERANK_BUDGET_MS / 1000, max_candidates=RERANK_CANDIDATES, scorer=None,
+                 probe_every=RERANK_PROBE_EVERY):
+        #scorer(query, texts) -> scores replaces the model (benchmarks)
+        self.model_name = model_name
+        self.budget = budget
+        self.max_candidates = max_candidates
+        self.scorer = scorer
+        self.probe_every = probe_every
+        self._model = None
+        self._model_lock = threading.Lock()
+        #measured cost of one (question, chunk) pair, the head that fits the budget is all that gets re-ranked
+        self.seconds_per_pair = None
+        #the first call pays the lazy loads (the model here, whatever a scorer loads on its first call), it's not measured
+        self._warm = False
+        self._skipped = 0
+        self.stats = {"reranked": 0, "partial": 0, "over_budget": 0, "failed": 0, "probes": 0}
+
+    def _load(self):
+        with self._model_lock:
+            if self._model is None and self.scorer is None:
+                #only needed when re-ranking is on, sentence-transformers is already there for the embeddings
+                from sentence_transformers import CrossEncoder
+                self._model = CrossEncoder(self.model_name, max_length=512)
+
+    def _score(self, query, texts):
+        if self.scorer is not None:
+            return self.scorer(query, texts)
+        self._load()
+        return self._model.predict([(query, text) for text in texts])
+
+    def _timed_score(self, query, texts):
+        #the cost is learned here, in the thread, so a call the caller gave up on still teaches the estimate
+        self._load()
+        start = time.perf_counter()
+        scores = self._score(query, texts)
+        cost = (time.perf_counter() - start) / len(texts)
+        if self._warm:
+            self.seconds_per_pair = cost if self.seconds_per_pair is None else 0.8 * self.seconds_per_pair + 0.2 * cost
+        self._warm = True
+        return scores
+
+    def warmup(self):
+        #loads the model, then measures it, called by the pipeline warmup
+        self._timed_score("warmup", ["warmup"])
+        self._timed_score("warmup", ["warmup"] * 4)
+
+    async def rerank(self, query, docs):
+        #-> (docs, whether the order comes from the cross-encoder)
+        if len(docs) < 2:
+            return docs, False
+        head = docs[:self.max_candidates]
+        if self.seconds_per_pair is not None:
+            #some headroom for the thread hop and the estimate being a bit off
+            fits = int(0.8 * self.budget / max(self.seconds_per_pair, 1e-9))
+            if fits < 2:
+                #a slow moment (or a wrong estimate) would otherwise turn the re-ranking off for good, nothing measures it again
+                self._skipped += 1
+                if self._skipped % self.probe_every:
+                    self.stats["over_budget"] += 1
+                    return docs, False
+                #the probe's measurement replaces the estimate, averaged in it would take dozens of probes to come back
+                self.stats["probes"] += 1
+                self.seconds_per_pair = None
+                fits = 2
+            if fits < len(head):
+                self.stats["partial"] += 1
+                head = head[:fits]
+        try:
+            scores = await asyncio.wait_for(asyncio.to_thread(self._timed_score, query, [doc.page_content for doc in head]),
+                                            timeout=self.budget)
+        except asyncio.TimeoutError:
+            self.stats["over_budget"] += 1
+            return docs, False
+        except Exception as e:
+            logging.error(f"Re-ranking failed, keeping the retrieval order: {e}")
+            self.stats["failed"] += 1
+            return docs, False
+        self.stats["reranked"] += 1
+        order = sorted(range(len(head)), key=lambda i: -float(scores[i]))
+        return [head[i] for i in order] + docs[len(head):], True
@@ -4,11 +4,17 @@ import requests
 import re
 from urllib.parse import urljoin
 
+#never part of the content: code the browser runs, and the menus / footers / sidebars every page of a site repeats
+#(header stays, inside a main or an article it is usually the title)
+BOILERPLATE_TAGS = ["script", "style", "noscript", "template", "svg", "nav", "footer", "aside", "form"]
+
 def robust_html_extractor(html: str) -> str:
     soup = Soup(html, "lxml")
-    important_text = soup.find("main")
+    important_text = soup.find("main") or soup.find("article") or soup.find(attrs={"role": "main"})
     if important_text:
         soup = important_text
+    for tag in soup.find_all(BOILERPLATE_TAGS):
+        tag.decompose()
     return re.sub(r"\s+", " ", soup.text).strip()
 
 #Using user_guide to have all the important data of the site
@@ -1,27 +1,17 @@
-import pandas as pd
-from src.app.rag_pipelines.scrapp_data import scrapp_data
+from src.app.core.config import CORPUS_PATH
+from src.app.rag_pipelines.async_crawler import Async_Crawler
+from src.app.rag_pipelines.corpus import Corpus_Writer
 
 class Scrap_manager():
-    def __init__(self, URLS):
+    def __init__(self, URLS, crawler: Async_Crawler = None, path=CORPUS_PATH):
         self.urls = URLS
+        self.crawler = crawler if crawler is not None else Async_Crawler()
+        self.path = path
 
-    async def _scrapp_all(self):
-        docs = []
-        for url in self.urls:
-            if url != '':
-                loaded_doc = scrapp_data(url)
-                docs.extend(loaded_doc)
-                print(f"Scrapped {url} with {len(loaded_doc)} documents.")
-        return docs
-    
     async def scrapp_and_save(self):
-        docs = await self._scrapp_all()
-        data_to_df = [
-            {
-                'text': doc.page_content,
-                'source': doc.metadata.get('source', 'N/A')
-            }
-            for doc in docs
-        ]
-        df = pd.DataFrame(data_to_df)
-        df.to_csv('data/data.csv', index=False)
\ No newline at end of file
+        #all the seeds are crawled together, so the connection pool and the dedup are shared between them
+        #the chunks of every page go to the parquet corpus as the parse processes hand them back
+        with Corpus_Writer(self.path) as writer:
+            pages = await self.crawler.crawl(self.urls, writer.add_page)
+        print(f"Scrapped {len(self.urls)} seeds with {pages} documents, {writer.chunks} chunks.")
+        return pages
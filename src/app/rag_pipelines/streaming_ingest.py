@@ -0,0 +1,101 @@
+import asyncio
+import logging
+import threading
+
+from src.app.core.config import EMBED_BATCH_SIZE, INGEST_QUEUE_SIZE
+
+#streaming ingestion: chunks -> fixed size batches -> embeddings -> vector store
+#every stage runs at the same time and they talk through bounded queues, so:
+#   - the embedder starts working with the first batch instead of waiting for the whole csv to be parsed
+#   - at most queue_size batches are in memory at once, no matter how big the corpus is
+
+_DONE = object()
+
+class _Stopped(Exception):
+    pass
+
+class Ingest_Pipeline:
+    def __init__(self, embedded_model, write_batch, batch_size=EMBED_BATCH_SIZE, queue_size=INGEST_QUEUE_SIZE):
+        #write_batch(ids, docs, vectors) is called from a worker thread with every embedded batch, in order
+        self.embedded_model = embedded_model
+        self.write_batch = write_batch
+        self.batch_size = batch_size
+        self.queue_size = queue_size
+
+    def _produce(self, items, queue: asyncio.Queue, loop, stop: threading.Event):
+        #runs in a thread, the csv parsing and splitting never blocks the event loop
+        def put(value):
+            #blocks this thread while the queue is full, that's the backpressure
+            if stop.is_set():
+                raise _Stopped()
+            future = asyncio.run_coroutine_threadsafe(queue.put(value), loop)
+            while True:
+                try:
+                    return future.result(timeout=0.1)
+                except TimeoutError:
+                    #the other stages died or the run was cancelled, nobody will ever read this queue again
+                    if stop.is_set():
+                        future.cancel()
+                        raise _Stopped()
+        batch = []
+        try:
+            for item in items:
+                batch.append(item)
+                if len(batch) >= self.batch_size:
+                    put(batch)
+                    batch = []
+            if batch:
+                put(batch)
+            put(_DONE)
+        except _Stopped:
+            pass
+
+    async def _embed(self, in_queue: asyncio.Queue, out_queue: asyncio.Queue):
+        while True:
+            batch = await in_queue.get()
+            if batch is _DONE:
+                await out_queue.put(_DONE)
+                return
+            texts = [doc.page_content for _, doc in batch]
+            vectors = await asyncio.to_thread(self.embedded_model.embed_documents, texts)
+            await out_queue.put((batch, vectors))
+
+    async def _write(self, queue: asyncio.Queue, stats: dict):
+        while True:
+            item = await queue.get()
+            if item is _DONE:
+                return
+            batch, vectors = item
+            ids = [cid for cid, _ in batch]
+            docs = [doc for _, doc in batch]
+            await asyncio.to_thread(self.write_batch, ids, docs, vectors)
+            stats["chunks"] += len(batch)
+            stats["batches"] += 1
+
+    async def run(self, items):
+        #items is a (lazy) iterator of (chunk_id, Document)
+        loop = asyncio.get_running_loop()
+        to_embed = asyncio.Queue(maxsize=self.queue_size)
+        to_write = asyncio.Queue(maxsize=self.queue_size)
+        stats = {"chunks": 0, "batches": 0}
+        stop = threading.Event()
+        tasks = [
+            asyncio.ensure_future(asyncio.to_thread(self._produce, items, to_embed, loop, stop)),
+            asyncio.ensure_future(self._embed(to_embed, to_write)),
+            asyncio.ensure_future(self._write(to_write, stats)),
+        ]
+        try:
+            await asyncio.gather(*tasks)
+        except BaseException as e:
+            #a stage failed, or the caller gave up on the run (cancelled, timed out): the producer thread has to be told,
+            #otherwise it waits forever on a queue nobody reads and holds a thread of the default executor for good
+            if isinstance(e, asyncio.CancelledError):
+                logging.warning(f"Ingestion cancelled after {stats['chunks']} chunks")
+            else:
+                logging.error(f"Ingestion stopped after {stats['chunks']} chunks: {e}")
+            stop.set()
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            raise
+        return stats
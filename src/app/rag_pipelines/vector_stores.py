@@ -0,0 +1,91 @@
+import os
+import shutil
+from langchain_core.documents import Document
+from langchain_community.vectorstores import Chroma
+
+from src.app.core.config import VECTOR_BACKEND, CHROMA_DIR, IVF_DIR
+from src.app.rag_pipelines.library_shards import collection_name
+
+#what the retrieval and the indexer need from the vector store of a library shard, every backend has these:
+#   upsert(ids, embeddings, documents, metadatas)   replaces the chunks that already have the id
+#   delete(ids)
+#   query(embeddings, k, where=None, documents=True) -> for every embedding [(id, squared l2 distance, Document or None)],
+#       closest first. documents=False only gives ids and distances. the distances compare across the shards of a backend
+#   get(ids) -> {id: Document} of the ids that are in the store
+#   count() -> chunks in the store
+#   persist()   end of an indexer run, for the backends that build their index then (ivf)
+#where is a {metadata field: value} filter
+
+def chroma_where(where: dict) -> dict:
+    #chroma takes a single field as is, several of them have to be and-ed explicitly
+    if len(where) == 1:
+        return where
+    return {"$and": [{field: value} for field, value in where.items()]}
+
+def matches_where(metadata: dict, where: dict) -> bool:
+    return all(metadata.get(field) == value for field, value in where.items())
+
+class Chroma_Vector_Store:
+    #one chroma collection, queried straight through the collection: the langchain wrapper drops the ids and we need them
+    #to fuse with bm25
+    def __init__(self, library, embedded_model=None, directory=CHROMA_DIR):
+        #chroma keeps one client per path string for the whole process, a relative path would hand out the client of
+        #whatever directory it pointed to first
+        self.chroma = Chroma(collection_name=collection_name(library), persist_directory=os.path.abspath(directory),
+                             embedding_function=embedded_model)
+
+    def upsert(self, ids, embeddings, documents, metadatas):
+        self.chroma._collection.upsert(ids=ids, embeddings=embeddings, documents=documents, metadatas=metadatas)
+
+    def delete(self, ids):
+        self.chroma.delete(ids=ids)
+
+    def query(self, embeddings, k, where=None, documents=True):
+        include = ['documents', 'metadatas', 'distances'] if documents else ['distances']
+        result = self.chroma._collection.query(query_embeddings=embeddings, n_results=k, include=include,
+                                               where=chroma_where(where) if where else None)
+        rows = []
+        for row, ids in enumerate(result['ids']):
+            docs = [Document(page_content=text, metadata=metadata or {}) for text, metadata
+                    in zip(result['documents'][row], result['metadatas'][row])] if documents else [None] * len(ids)
+            rows.append(list(zip(ids, result['distances'][row], docs)))
+        return rows
+
+    def get(self, ids):
+        result = self.chroma._collection.get(ids=ids, include=['documents', 'metadatas'])
+        return {cid: Document(page_content=text, metadata=metadata or {})
+                for cid, text, metadata in zip(result['ids'], result['documents'], result['metadatas'])}
+
+    def count(self):
+        return self.chroma._collection.count()
+
+    def persist(self):
+        #chroma writes as it goes
+        pass
+
+def default_directory(backend=VECTOR_BACKEND):
+    return CHROMA_DIR if backend == "chroma" else IVF_DIR
+
+def open_vector_store(library, embedded_model=None, backend=VECTOR_BACKEND, directory=None):
+    directory = directory or default_directory(backend)
+    if backend == "chroma":
+        return Chroma_Vector_Store(library, embedded_model, directory)
+    if backend == "ivf":
+        from src.app.rag_pipelines.ivf_store import Ivf_Vector_Store
+        return Ivf_Vector_Store(os.path.join(directory, collection_name(library)))
+    raise ValueError(f"Unknown vector backend {backend!r}, expected 'chroma' or 'ivf'")
+
+def vector_index_exists(backend=VECTOR_BACKEND, directory=None):
+    return os.path.exists(directory or default_directory(backend))
+
+def drop_vector_stores(backend=VECTOR_BACKEND, directory=None):
+    #every shard of the backend, used when the shard layout changes
+    directory = directory or default_directory(backend)
+    if not os.path.exists(directory):
+        return
+    if backend == "chroma":
+        client = Chroma(persist_directory=os.path.abspath(directory))._client
+        for collection in client.list_collections():
+            client.delete_collection(getattr(collection, "name", collection))
+    else:
+        shutil.rmtree(directory)
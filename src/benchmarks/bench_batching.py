@@ -0,0 +1,73 @@
+import time
+import random
+import asyncio
+import argparse
+import tempfile
+import numpy as np
+
+from src.app.rag_pipelines.general_rag_pipeline import Rag_Pipeline
+from src.app.rag_pipelines.vector_stores import open_vector_store
+from src.benchmarks.bench_router import percentile
+from src.benchmarks.fakes import Fake_Embeddings
+
+#dense retrieval QPS and p99 at 1, 16 and 64 concurrent clients, one embedding + chroma query per request vs micro-batched
+#chroma is real (a temp dir with random vectors), the embedder is the fake with a per call + per text cost, like
+#MiniLM on a cpu where a batch of 32 costs a few times a single query, not 32 times
+#run with: python -m src.benchmarks.bench_batching
+
+def make_store(directory, embedder, chunks, dim, seed=0):
+    store = open_vector_store("general", embedder, "chroma", directory)
+    rng = np.random.default_rng(seed)
+    for start in range(0, chunks, 5000):
+        n = min(5000, chunks - start)
+        vectors = rng.standard_normal((n, dim)).astype(np.float32)
+        vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+        store.upsert(ids=[f"chunk-{start + i}" for i in range(n)], embeddings=vectors.tolist(),
+                     documents=[f"chunk {start + i}" for i in range(n)],
+                     metadatas=[{"source": f"https://example.org/docs/{start + i}"} for i in range(n)])
+    return store
+
+async def load(rag, clients, seconds, k):
+    latencies = []
+    stop = time.perf_counter() + seconds
+
+    async def client(i):
+        rng = random.Random(i)
+        while time.perf_counter() < stop:
+            start = time.perf_counter()
+            await rag._dense_search(f"question {rng.randint(0, 10 ** 9)} about pandas", k)
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*[client(i) for i in range(clients)])
+    return len(latencies) / (time.perf_counter() - start), latencies
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--clients", default="1,16,64")
+    parser.add_argument("--seconds", type=float, default=5)
+    parser.add_argument("--chunks", type=int, default=20000)
+    parser.add_argument("--k", type=int, default=20)
+    parser.add_argument("--call-latency", type=float, default=0.008)
+    parser.add_argument("--text-latency", type=float, default=0.0005)
+    args = parser.parse_args()
+
+    embedder = Fake_Embeddings(call_latency=args.call_latency, text_latency=args.text_latency)
+    with tempfile.TemporaryDirectory() as tmp:
+        rag = Rag_Pipeline(embedder)
+        #a single shard, this is about batching and not about routing
+        rag.shards = ["general"]
+        rag.vector_stores = {"general": make_store(tmp, embedder, args.chunks, embedder.dim)}
+        batcher = rag.dense_batcher
+        print(f"{args.chunks} chunks, embedder cost {args.call_latency * 1000:.1f}ms/call + {args.text_latency * 1000:.2f}ms/text")
+        for clients in [int(c) for c in args.clients.split(",")]:
+            for name, dense_batcher in (("unbatched", None), ("batched", batcher)):
+                rag.dense_batcher = dense_batcher
+                await load(rag, clients, 0.5, args.k)
+                qps, latencies = await load(rag, clients, args.seconds, args.k)
+                print(f"  clients={clients:<3} {name:<9} qps={qps:7.1f}  p50={percentile(latencies, 50) * 1000:7.1f}ms  "
+                      f"p99={percentile(latencies, 99) * 1000:7.1f}ms")
+        print(f"batcher stats: {batcher.stats}")
+
+if __name__ == "__main__":
+    asyncio.run(main())
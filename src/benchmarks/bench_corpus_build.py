@@ -0,0 +1,113 @@
+import os
+import csv
+import time
+import asyncio
+import argparse
+import tempfile
+import multiprocessing
+
+from src.app.rag_pipelines.async_crawler import Async_Crawler, process_page
+from src.app.rag_pipelines.scrapping_manager import Scrap_manager
+from src.app.rag_pipelines.incremental_indexer import Incremental_Indexer
+from src.app.rag_pipelines.scrapp_data import robust_html_extractor
+from src.app.rag_pipelines.corpus import iter_chunks, source_hashes
+from src.benchmarks.fakes import Fake_Embeddings, Fake_Vector_Store
+from src.benchmarks.fixture_server import Fixture_Server, build_link_graph, render_page
+
+#corpus build from a local fixture site: crawl (fetch + extraction + boilerplate stripping + chunking) into the parquet
+#corpus, then the indexer on it (fake embedder and store, so what's left is reading, hashing and bm25), for every
+#number of parse processes (0 = the parsing in a thread of the crawler, like before)
+#then the same pages as the old data.csv against the parquet corpus: size on disk, the indexer's hash pass and a full read
+#the fixture server runs in its own process, its threads would otherwise fight the crawler for the gil
+#run with: python -m src.benchmarks.bench_corpus_build --workers 0,1,2,4
+
+def serve_fixture(graph, latency, paragraphs, ports):
+    with Fixture_Server(graph, latency=latency, paragraphs=paragraphs) as server:
+        ports.put(server.httpd.server_address[1])
+        while True:
+            time.sleep(3600)
+
+def build(seeds, args, workers, directory):
+    path = os.path.join(directory, f"corpus-{workers}.parquet")
+    crawler = Async_Crawler(max_depth=args.depth, max_concurrency=args.concurrency, max_per_host=args.per_host, parse_workers=workers)
+    start = time.perf_counter()
+    pages = asyncio.run(Scrap_manager(seeds, crawler, path=path).scrapp_and_save())
+    crawl_seconds = time.perf_counter() - start
+    indexer = Incremental_Indexer(Fake_Embeddings(), manifest_path=os.path.join(directory, f"manifest-{workers}.sqlite"),
+                                  store_factory=lambda library: Fake_Vector_Store(), bm25_directory=os.path.join(directory, f"bm25-{workers}"))
+    start = time.perf_counter()
+    report = asyncio.run(indexer.run(path))
+    return path, pages, crawl_seconds, time.perf_counter() - start, report["added"]
+
+def write_csv(path, base_url, graph, paragraphs, sources):
+    #what the old scrapp_and_save wrote for the same pages: one row per page with its whole text
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow(["text", "source"])
+        for source in sources:
+            page = source[len(base_url):]
+            writer.writerow([robust_html_extractor(render_page(page, graph[page], paragraphs)), source])
+
+def parse_cost(graph, paragraphs, base_url, n=200):
+    #seconds per page of what the parse processes do, on one core: the part of the crawl that more cores can take
+    pages = list(graph.items())[:n]
+    start = time.perf_counter()
+    for path, links in pages:
+        process_page(render_page(path, links, paragraphs), base_url + path, base_url)
+    return (time.perf_counter() - start) / len(pages)
+
+def read_times(path):
+    start = time.perf_counter()
+    hashes = source_hashes(path)
+    hash_seconds = time.perf_counter() - start
+    start = time.perf_counter()
+    chunks = sum(1 for _ in iter_chunks(path))
+    return len(hashes), chunks, hash_seconds, time.perf_counter() - start
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--workers", default="0,1,2,4", help="parse processes to compare, 0 = a thread")
+    parser.add_argument("--sites", type=int, default=8)
+    parser.add_argument("--pages", type=int, default=150)
+    parser.add_argument("--fanout", type=int, default=8)
+    parser.add_argument("--depth", type=int, default=4)
+    parser.add_argument("--paragraphs", type=int, default=300, help="per page, 300 is about 30KB of html")
+    parser.add_argument("--latency", type=float, default=0.002, help="fixture server seconds per page, fetching is not the bottleneck")
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--per-host", type=int, default=8)
+    args = parser.parse_args()
+
+    graph = build_link_graph(args.sites, args.pages, args.fanout)
+    context = multiprocessing.get_context("spawn")
+    ports = context.Queue()
+    server = context.Process(target=serve_fixture, args=(graph, args.latency, args.paragraphs, ports), daemon=True)
+    server.start()
+    try:
+        base_url = f"http://127.0.0.1:{ports.get(timeout=60)}"
+        seeds = [f"{base_url}/{site}/" for site in sorted({path.split('/')[1] for path in graph})]
+        print(f"{os.cpu_count()} cpus, fixture site of {len(graph)} pages, crawl depth {args.depth}")
+        seconds = parse_cost(graph, args.paragraphs, base_url)
+        print(f"  extraction + chunking alone: {seconds * 1000:.1f}ms per page on one core ({1 / seconds:.0f} pages/s per process)")
+        with tempfile.TemporaryDirectory() as directory:
+            base = None
+            for workers in [int(w) for w in args.workers.split(",")]:
+                path, pages, crawl_seconds, index_seconds, chunks = build(seeds, args, workers, directory)
+                total = crawl_seconds + index_seconds
+                base = base or total
+                name = "thread" if workers == 0 else f"{workers} process{'es' if workers > 1 else ''}"
+                print(f"  {name:<12} crawl {pages} pages in {crawl_seconds:6.2f}s ({pages / crawl_seconds:6.1f} pages/s)  "
+                      f"index {chunks} chunks in {index_seconds:5.2f}s  end to end {total:6.2f}s ({base / total:.2f}x)")
+
+            sources = sorted({doc.metadata["source"] for _, doc in iter_chunks(path)})
+            csv_path = os.path.join(directory, "data.csv")
+            write_csv(csv_path, base_url, graph, args.paragraphs, sources)
+            print("  same pages, old data.csv vs the parquet corpus:")
+            for name, corpus in (("data.csv", csv_path), ("parquet", path)):
+                n_sources, n_chunks, hash_seconds, read_seconds = read_times(corpus)
+                print(f"    {name:<9} {os.path.getsize(corpus) / 2**20:6.1f}MB  hash pass {hash_seconds * 1000:7.1f}ms  "
+                      f"all {n_chunks} chunks of {n_sources} pages {read_seconds * 1000:7.1f}ms")
+    finally:
+        server.terminate()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,55 @@
+import argparse
+import asyncio
+import time
+
+from src.app.rag_pipelines.async_crawler import Async_Crawler
+from src.benchmarks.fixture_server import Fixture_Server, build_link_graph
+
+#compares the old sequential scrape (requests probe + RecursiveUrlLoader per seed) with the async crawler
+#run with: python -m src.benchmarks.bench_crawler
+
+def run_sequential(seeds):
+    from src.app.rag_pipelines.scrapp_data import scrapp_data
+    docs = []
+    for url in seeds:
+        docs.extend(scrapp_data(url))
+    return docs
+
+def run_concurrent(seeds, depth, concurrency, per_host, parse_workers):
+    crawler = Async_Crawler(max_depth=depth, max_concurrency=concurrency, max_per_host=per_host, parse_workers=parse_workers)
+    sources = set()
+    asyncio.run(crawler.crawl(seeds, lambda source, page_hash, chunks: sources.add(source)))
+    return sources
+
+def report(name, sources, elapsed):
+    pages = len(sources)
+    print(f"{name:<12} pages={pages:<6} time={elapsed:7.2f}s  pages/sec={pages / elapsed:8.1f}")
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sites", type=int, default=8)
+    parser.add_argument("--pages", type=int, default=60)
+    parser.add_argument("--fanout", type=int, default=6)
+    parser.add_argument("--latency", type=float, default=0.02)
+    #the sequential path is hardcoded to depth 2, so keep the same depth to compare the same pages
+    parser.add_argument("--depth", type=int, default=2)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--per-host", type=int, default=8)
+    #0 parses in a thread, bench_corpus_build compares the process counts
+    parser.add_argument("--parse-workers", type=int, default=0)
+    parser.add_argument("--skip-sequential", action="store_true")
+    args = parser.parse_args()
+
+    graph = build_link_graph(args.sites, args.pages, args.fanout)
+    with Fixture_Server(graph, latency=args.latency) as server:
+        seeds = server.seeds()
+        if not args.skip_sequential:
+            start = time.perf_counter()
+            docs = run_sequential(seeds)
+            report("sequential", {doc.metadata['source'] for doc in docs}, time.perf_counter() - start)
+        start = time.perf_counter()
+        sources = run_concurrent(seeds, args.depth, args.concurrency, args.per_host, args.parse_workers)
+        report("concurrent", sources, time.perf_counter() - start)
+
+if __name__ == "__main__":
+    main()
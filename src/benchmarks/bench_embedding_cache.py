@@ -0,0 +1,84 @@
+import os
+import time
+import random
+import shutil
+import asyncio
+import argparse
+import tempfile
+
+from src.app.rag_pipelines.embedding_cache import Cached_Embeddings
+from src.app.rag_pipelines.incremental_indexer import Incremental_Indexer
+from src.benchmarks.bench_ingest import make_csv
+from src.benchmarks.bench_router import percentile
+from src.benchmarks.fakes import Fake_Embeddings, Fake_Vector_Store
+
+#full rebuild of an unchanged corpus with and without the embedding cache, then a query stream with repeated questions
+#a full rebuild is what happens when the chroma dir / manifest are wiped, e.g. after a chroma upgrade
+#the fake embedder sleeps --text-latency seconds per text to stand in for MiniLM on a cpu
+#run with: python -m src.benchmarks.bench_embedding_cache
+
+async def rebuild(embedder, csv_path, work_dir):
+    #fresh manifest and store every time, so the indexer has to embed everything again
+    manifest_path = os.path.join(work_dir, "manifest.sqlite")
+    if os.path.exists(manifest_path):
+        os.remove(manifest_path)
+    indexer = Incremental_Indexer(embedder, manifest_path=manifest_path, store_factory=lambda library: Fake_Vector_Store(),
+                                  bm25_directory=None)
+    start = time.perf_counter()
+    report = await indexer.run(csv_path)
+    return time.perf_counter() - start, report["added"]
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--size-mb", type=int, default=4)
+    parser.add_argument("--text-latency", type=float, default=0.003)
+    parser.add_argument("--queries", type=int, default=2000)
+    parser.add_argument("--distinct-queries", type=int, default=300)
+    args = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp(prefix="embedding_cache_bench_")
+    try:
+        csv_path = os.path.join(work_dir, "corpus.csv")
+        make_csv(csv_path, args.size_mb)
+
+        plain = Fake_Embeddings(text_latency=args.text_latency)
+        seconds, chunks = await rebuild(plain, csv_path, work_dir)
+        print(f"{chunks} chunks, text latency {args.text_latency * 1000:.1f}ms")
+        print(f"  no cache        rebuild {seconds:7.2f}s  ({plain.texts_embedded} texts embedded)")
+
+        inner = Fake_Embeddings(text_latency=args.text_latency)
+        cached = Cached_Embeddings(inner, model_name="fake", directory=os.path.join(work_dir, "cache"))
+        for name in ("cache, cold", "cache, warm"):
+            before = inner.texts_embedded
+            seconds, _ = await rebuild(cached, csv_path, work_dir)
+            print(f"  {name:<15} rebuild {seconds:7.2f}s  ({inner.texts_embedded - before} texts embedded)")
+        cached.close()
+
+        #reopened from disk, like a new process after a deploy
+        inner = Fake_Embeddings(text_latency=args.text_latency)
+        cached = Cached_Embeddings(inner, model_name="fake", directory=os.path.join(work_dir, "cache"))
+        seconds, _ = await rebuild(cached, csv_path, work_dir)
+        print(f"  cache, reopened rebuild {seconds:7.2f}s  ({inner.texts_embedded} texts embedded), "
+              f"document hit rate {cached.hit_rates()['document_hit_rate']:.0%}")
+
+        #questions follow a skewed popularity, a few are asked over and over
+        rng = random.Random(0)
+        questions = [f"how do I use feature {i} of the library" for i in range(args.distinct_queries)]
+        weights = [1 / (i + 1) for i in range(args.distinct_queries)]
+        stream = rng.choices(questions, weights=weights, k=args.queries)
+        for name, embedder in (("no cache", Fake_Embeddings(text_latency=args.text_latency)), ("cache", cached)):
+            latencies = []
+            for question in stream:
+                start = time.perf_counter()
+                embedder.embed_query(question)
+                latencies.append(time.perf_counter() - start)
+            print(f"  queries {name:<8} p50={percentile(latencies, 50) * 1000:6.3f}ms  p95={percentile(latencies, 95) * 1000:6.3f}ms")
+        rates = cached.hit_rates()
+        print(f"  query hit rate {rates['query_hit_rate']:.0%} (memory {rates['query_memory_hits']}, disk {rates['query_disk_hits']}, "
+              f"misses {rates['query_misses']})")
+        cached.close()
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+if __name__ == "__main__":
+    asyncio.run(main())
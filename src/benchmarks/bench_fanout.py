@@ -0,0 +1,57 @@
+import time
+import asyncio
+import argparse
+
+from src.app.agent_workflow.agent_graph import ChatState, create_graph
+from src.benchmarks.fakes import Fake_Chat_Model, Fake_Rag, Fake_Sandbox
+
+#the router picks both tools and the graph runs them in parallel, so the tool phase should cost max(branch), not sum(branch)
+#second part: one branch is way slower than its deadline and the answer still comes back on time
+#run with: python -m src.benchmarks.bench_fanout
+
+QUESTION = "why does this sklearn pipeline raise ValueError?"
+
+def responder(prompt: str) -> str:
+    if "You are a router" in prompt:
+        return "rag_retriever, code_interpreter"
+    if "split in text and code" in prompt:
+        return "Pipeline([('scaler', StandardScaler())]).fit(X) / fits a pipeline on X"
+    return "The pipeline raises ValueError because X has missing values, impute them first."
+
+def make_graph(args, rag_latency, timeouts):
+    llm = Fake_Chat_Model(responder=responder, first_token_latency=args.llm_latency)
+    return create_graph("fake-key", Fake_Rag(rag_latency), lambda model, temperature: llm,
+                        sandbox=Fake_Sandbox(args.sandbox_latency), tool_timeouts=timeouts)
+
+async def run(graph):
+    start = time.perf_counter()
+    state = await graph.ainvoke(ChatState(input=QUESTION))
+    return time.perf_counter() - start, state
+
+def report(name, wall, state):
+    timings = state["timings"]
+    branches = {node: seconds for node, seconds in timings.items() if node in ("rag_retriever", "code_interpreter")}
+    tools_wall = wall - timings["router"] - timings["final_answer"]
+    print(f"{name}: wall {wall:.2f}s, " + ", ".join(f"{node} {seconds:.2f}s" for node, seconds in timings.items()))
+    print(f"  tool phase {tools_wall:.2f}s vs max(branch) {max(branches.values()):.2f}s, sum(branch) {sum(branches.values()):.2f}s")
+    for result in state["tool_results"]:
+        if result.get("error"):
+            print(f"  {result['tool']}: {result['output']}")
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--llm-latency", type=float, default=0.05)
+    parser.add_argument("--rag-latency", type=float, default=0.5)
+    parser.add_argument("--sandbox-latency", type=float, default=0.6)
+    parser.add_argument("--slow-rag-latency", type=float, default=5.0)
+    parser.add_argument("--timeout", type=float, default=1.0)
+    args = parser.parse_args()
+
+    wall, state = await run(make_graph(args, args.rag_latency, {"rag_retriever": 10, "code_interpreter": 10}))
+    report("parallel tools", wall, state)
+
+    wall, state = await run(make_graph(args, args.slow_rag_latency, {"rag_retriever": args.timeout, "code_interpreter": 10}))
+    report(f"rag at {args.slow_rag_latency}s with a {args.timeout}s deadline", wall, state)
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,94 @@
+import os
+import csv
+import sys
+import json
+import time
+import random
+import asyncio
+import argparse
+import resource
+import subprocess
+
+from src.app.rag_pipelines.chunking import iter_csv_chunks
+from src.app.rag_pipelines.streaming_ingest import Ingest_Pipeline
+from src.benchmarks.fakes import Fake_Embeddings
+
+#ingests synthetic csvs of growing size and records throughput and peak RSS
+#every (size, mode) runs in its own process, ru_maxrss is a high-water mark so it can't be shared
+#run with: python -m src.benchmarks.bench_ingest --sizes-mb 256,1024,4096
+
+WORDS = ("model data train test split feature label regression classification gradient descent loss "
+         "tensor pandas numpy matplotlib overfitting validation accuracy precision recall pipeline").split()
+
+def make_csv(path, size_mb, page_chars=20000, seed=0):
+    #one row per "page", like the scrapper output
+    if os.path.exists(path) and os.path.getsize(path) >= size_mb * 1024 * 1024:
+        return
+    rng = random.Random(seed)
+    target = size_mb * 1024 * 1024
+    with open(path, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        writer.writerow(['text', 'source'])
+        page = 0
+        while f.tell() < target:
+            words = []
+            length = 0
+            while length < page_chars:
+                word = rng.choice(WORDS)
+                words.append(word)
+                length += len(word) + 1
+            writer.writerow([" ".join(words), f"https://example.org/docs/page{page}"])
+            page += 1
+
+def peak_rss_mb():
+    #linux reports ru_maxrss in KB
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+def run_streaming(csv_path, batch_size):
+    embedder = Fake_Embeddings()
+    pipeline = Ingest_Pipeline(embedder, lambda ids, docs, vectors: None, batch_size=batch_size)
+    return asyncio.run(pipeline.run(iter_csv_chunks(csv_path)))["chunks"]
+
+def run_materialized(csv_path, batch_size):
+    #the old way: whole corpus in a list, then everything goes to the embedder
+    embedder = Fake_Embeddings()
+    docs = [doc for _, doc in iter_csv_chunks(csv_path)]
+    for i in range(0, len(docs), batch_size):
+        embedder.embed_documents([doc.page_content for doc in docs[i:i + batch_size]])
+    return len(docs)
+
+def worker(args):
+    start = time.perf_counter()
+    run = run_streaming if args.mode == "streaming" else run_materialized
+    chunks = run(args.csv, args.batch_size)
+    elapsed = time.perf_counter() - start
+    size_mb = os.path.getsize(args.csv) / (1024 * 1024)
+    print(json.dumps({"mode": args.mode, "size_mb": round(size_mb), "chunks": chunks, "seconds": round(elapsed, 2),
+                      "mb_per_sec": round(size_mb / elapsed, 2), "chunks_per_sec": round(chunks / elapsed),
+                      "peak_rss_mb": round(peak_rss_mb(), 1)}))
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes-mb", default="64,256,1024")
+    parser.add_argument("--modes", default="streaming,materialized")
+    parser.add_argument("--batch-size", type=int, default=64)
+    parser.add_argument("--data-dir", default="/tmp/ml_tutorbot_bench")
+    parser.add_argument("--worker", action="store_true")
+    parser.add_argument("--mode")
+    parser.add_argument("--csv")
+    args = parser.parse_args()
+    if args.worker:
+        return worker(args)
+
+    os.makedirs(args.data_dir, exist_ok=True)
+    for size in [int(s) for s in args.sizes_mb.split(",")]:
+        csv_path = os.path.join(args.data_dir, f"corpus_{size}mb.csv")
+        make_csv(csv_path, size)
+        for mode in args.modes.split(","):
+            cmd = [sys.executable, "-m", "src.benchmarks.bench_ingest", "--worker", "--mode", mode,
+                   "--csv", csv_path, "--batch-size", str(args.batch_size)]
+            result = subprocess.run(cmd, capture_output=True, text=True)
+            print(result.stdout.strip() or result.stderr.strip().splitlines()[-1])
+
+if __name__ == "__main__":
+    main()
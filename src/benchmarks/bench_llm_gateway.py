@@ -0,0 +1,87 @@
+import time
+import random
+import asyncio
+import argparse
+
+from src.app.agent_workflow.llm_gateway import Llm_Gateway
+from src.benchmarks.bench_router import percentile
+from src.benchmarks.fake_llm_server import Fake_Llm_Server
+from src.benchmarks.fakes import Http_Chat_Model
+
+#throughput of llm calls against a provider that rate limits and goes through a "429 storm" halfway through
+#   naive:   a new client per call (like the nodes used to do), no limits, no retries
+#   gateway: reused clients, concurrency cap + token bucket under the provider quota, jittered retries, in-flight dedup
+#run with: python -m src.benchmarks.bench_llm_gateway
+
+def workload(n, duplicates, seed=0):
+    #some prompts are the same router prompt for a popular question, asked at the same time by many users
+    rng = random.Random(seed)
+    popular = [f"route: what is overfitting? #{i}" for i in range(5)]
+    return [rng.choice(popular) if rng.random() < duplicates else f"route: question {i}" for i in range(n)]
+
+async def run(prompts, concurrency, invoke):
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies, failures = [], 0
+
+    async def one(prompt):
+        nonlocal failures
+        async with semaphore:
+            start = time.perf_counter()
+            try:
+                await invoke(prompt)
+                latencies.append(time.perf_counter() - start)
+            except Exception:
+                failures += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*[one(prompt) for prompt in prompts])
+    return time.perf_counter() - start, latencies, failures
+
+def report(name, elapsed, latencies, failures, server):
+    ok = len(latencies)
+    print(f"{name:<8} ok={ok:<4} failed={failures:<4} wall={elapsed:6.2f}s  goodput={ok / elapsed:6.1f}/s  "
+          f"p50={percentile(latencies, 50) * 1000 if ok else 0:7.1f}ms  p99={percentile(latencies, 99) * 1000 if ok else 0:7.1f}ms")
+    print(f"         provider saw {server.stats['requests']} requests on {server.stats['connections']} connections, "
+          f"429s: {server.stats['rejected_quota']} quota + {server.stats['rejected_storm']} storm")
+
+def make_server(args):
+    return Fake_Llm_Server(latency=args.latency, quota_per_second=args.quota, max_in_flight=args.provider_in_flight,
+                           storm_start=args.storm_start, storm_seconds=args.storm_seconds, storm_rejection=args.storm_rejection)
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=400)
+    parser.add_argument("--concurrency", type=int, default=64)
+    parser.add_argument("--duplicates", type=float, default=0.2)
+    parser.add_argument("--latency", type=float, default=0.1)
+    parser.add_argument("--quota", type=int, default=50)
+    parser.add_argument("--provider-in-flight", type=int, default=16)
+    parser.add_argument("--storm-start", type=float, default=2.0)
+    parser.add_argument("--storm-seconds", type=float, default=3.0)
+    parser.add_argument("--storm-rejection", type=float, default=0.6)
+    args = parser.parse_args()
+    prompts = workload(args.requests, args.duplicates)
+    print(f"{args.requests} calls at concurrency {args.concurrency}, provider quota {args.quota}/s and {args.provider_in_flight} in flight, "
+          f"429 storm ({args.storm_rejection:.0%}) from {args.storm_start}s for {args.storm_seconds}s")
+
+    with make_server(args) as server:
+        async def naive(prompt):
+            return await Http_Chat_Model(base_url=server.base_url, reuse_session=False).ainvoke(prompt)
+        report("naive", *await run(prompts, args.concurrency, naive), server)
+
+    with make_server(args) as server:
+        clients = []
+        def factory(model, temperature):
+            clients.append(Http_Chat_Model(base_url=server.base_url, model_name=model, temperature=temperature))
+            return clients[-1]
+        #a bit under the provider quota, the retries are for what's left (the storm)
+        gateway = Llm_Gateway(factory, max_concurrency=args.provider_in_flight, rate_per_second=args.quota * 0.9,
+                              burst=args.provider_in_flight, max_retries=8, backoff_base=0.2, backoff_max=4)
+        llm = gateway.get_llm("fake", 0)
+        report("gateway", *await run(prompts, args.concurrency, llm.ainvoke), server)
+        print(f"         gateway stats: {gateway.stats}")
+        for client in clients:
+            await client.aclose()
+
+if __name__ == "__main__":
+    asyncio.run(main())
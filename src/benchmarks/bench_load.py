@@ -0,0 +1,363 @@
+import os
+import sys
+import csv
+import json
+import time
+import random
+import socket
+import asyncio
+import argparse
+import statistics
+import platform
+import tempfile
+import subprocess
+import aiohttp
+
+from src.benchmarks.bench_router import percentile
+
+#offline load test of the whole /chat stack: a uvicorn server running the real app (lifespan, middleware, graph, llm
+#gateway, hybrid retrieval on a chroma index of the fixture corpus, response cache, sandbox pool, sessions db) where only
+#the llm, the embedder and the re-ranker model are fakes, driven over http by closed-loop clients with a mix of rag, code
+#and plain questions
+#per concurrency level: requests/s, p50/p95/p99 (overall and per kind), per node p50/p95 from the timings the responses
+#carry, server rss (and its sandbox workers), errors
+#--save writes the results as json, --baseline compares the run with a saved one and exits with 1 on a regression
+#run with: python -m src.benchmarks.bench_load --concurrency 1,8,32 --save load.json
+#          python -m src.benchmarks.bench_load --concurrency 1,8,32 --baseline load.json
+
+DATA_DIR = os.path.join(os.path.dirname(__file__), "data")
+KINDS = {"rag_retriever": "rag", "code_interpreter": "code", "final_answer": "plain"}
+#what the fake llm writes, the final answer is about the size of a real short answer
+CODE_SPLIT = "print(sum(x * x for x in range(100))) / sums the squares of the numbers from 0 to 99"
+EXPLANATION = "The code sums the squares of the numbers from 0 to 99 and prints 328350."
+ANSWER = ("Short answer: it depends on the data. Start from the documented defaults, check the shapes of your inputs, "
+          "and validate on data the model has not seen. ") * 4
+
+def load_questions():
+    #labeled routing questions plus the retrieval questions, -> {kind: [questions]} and {question: route}
+    questions, routes = {"rag": [], "code": [], "plain": []}, {}
+    with open(os.path.join(DATA_DIR, "routing_eval.jsonl"), encoding="utf-8") as f:
+        for line in f:
+            row = json.loads(line)
+            questions[KINDS[row["label"]]].append(row["input"])
+            routes[row["input"]] = row["label"]
+    with open(os.path.join(DATA_DIR, "retrieval_queries.jsonl"), encoding="utf-8") as f:
+        for line in f:
+            query = json.loads(line)["query"]
+            questions["rag"].append(query)
+            routes[query] = "rag_retriever"
+    return questions, routes
+
+def make_responder(routes):
+    #the llm router answers with the label of the question (the local router gets most of them before that)
+    def responder(prompt: str) -> str:
+        if "You are a router" in prompt:
+            return next((route for question, route in routes.items() if f"Input: {question}" in prompt), "final_answer")
+        if "split in text and code" in prompt:
+            return CODE_SPLIT
+        if "the code that was run" in prompt:
+            return EXPLANATION
+        return ANSWER.strip()
+    return responder
+
+def parse_mix(mix: str) -> dict:
+    weights = {kind: float(weight) for kind, weight in (part.split("=") for part in mix.split(","))}
+    unknown = set(weights) - set(KINDS.values())
+    if unknown:
+        raise ValueError(f"Unknown request kinds {sorted(unknown)}, expected {sorted(KINDS.values())}")
+    return weights
+
+def make_schedule(questions, mix, n, seed):
+    #same requests in the same order for a given seed, so two runs (and a run and its baseline) send the same load
+    rng = random.Random(seed)
+    kinds = list(mix)
+    return [(kind, rng.choice(questions[kind])) for kind in rng.choices(kinds, [mix[kind] for kind in kinds], k=n)]
+
+def write_corpus(path, filler):
+    #fixture chunks (real library urls, so they land in their shards) plus synthetic chunks to give the index some size
+    from src.benchmarks.bench_sharding import make_corpus
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow(["source", "text"])
+        with open(os.path.join(DATA_DIR, "retrieval_corpus.jsonl"), encoding="utf-8") as corpus:
+            for line in corpus:
+                row = json.loads(line)
+                writer.writerow([row["source"], row["text"]])
+        for _, text, source, _ in make_corpus(filler):
+            writer.writerow([source, text])
+
+async def build_rag(workdir, embedder, filler):
+    #the index goes through the real indexer, every shard is then opened in the work dir (never the default one)
+    from src.app.rag_pipelines.general_rag_pipeline import Rag_Pipeline
+    from src.app.rag_pipelines.incremental_indexer import Incremental_Indexer
+    from src.app.rag_pipelines.bm25_index import Bm25_Index
+    from src.app.rag_pipelines.reranker import Cross_Encoder_Reranker
+    from src.app.rag_pipelines.vector_stores import open_vector_store
+    from src.benchmarks.fakes import Fake_Cross_Encoder
+    csv_path, chroma_dir, bm25_dir = (os.path.join(workdir, name) for name in ("data.csv", "chroma", "bm25"))
+    write_corpus(csv_path, filler)
+    await Incremental_Indexer(embedder, persist_directory=chroma_dir, manifest_path=os.path.join(workdir, "manifest.sqlite"),
+                              bm25_directory=bm25_dir, backend="chroma").run(csv_path)
+    rag = Rag_Pipeline(embedder)
+    for library in rag.shards:
+        rag.vector_stores[library] = open_vector_store(library, embedder, "chroma", chroma_dir)
+    rag.bm25 = Bm25_Index.load(bm25_dir)
+    rag.index_ready = True
+    if rag.reranker is not None:
+        rag.reranker = Cross_Encoder_Reranker(scorer=Fake_Cross_Encoder())
+    return rag
+
+def serve(args, port, workdir):
+    #the server process: builds the fakes and the fixture index, then runs the app like the Dockerfile does
+    import uvicorn
+    from src.main import app
+    from src.app.api.response_cache import Response_Cache
+    from src.benchmarks.fakes import Fake_Chat_Model, Fake_Embeddings
+    _, routes = load_questions()
+    embedder = Fake_Embeddings(text_latency=args.embed_latency)
+    llm = Fake_Chat_Model(responder=make_responder(routes), first_token_latency=args.llm_latency, token_latency=args.token_latency)
+    rag = asyncio.run(build_rag(workdir, embedder, args.filler_chunks))
+    app.state.overrides = {
+        "rag": rag,
+        "llm_factory": lambda model, temperature: llm,
+        "gateway_options": {"rate_per_second": args.llm_rate},
+        "session_db_path": os.path.join(workdir, "sessions.sqlite"),
+        #entries are stale as soon as they are written: lookups and stores are paid but no request is answered from the cache
+        "response_cache": None if args.response_cache else Response_Cache(embedder, ttl=-1)}
+    uvicorn.run(app, host="127.0.0.1", port=port, log_level="warning")
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def rss_mb(pid):
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return 0.0
+
+def children(pid):
+    try:
+        with open(f"/proc/{pid}/task/{pid}/children") as f:
+            return [int(child) for child in f.read().split()]
+    except OSError:
+        return []
+
+def memory(pid):
+    #(server rss, rss of everything it started: the sandbox workers), MB
+    return rss_mb(pid), sum(rss_mb(child) for child in children(pid))
+
+async def wait_ready(session, base_url, server, timeout):
+    start = time.perf_counter()
+    while time.perf_counter() - start < timeout:
+        if server.poll() is not None:
+            raise RuntimeError(f"Server exited with {server.returncode} before it was ready")
+        try:
+            async with session.get(f"{base_url}/llm/stats") as response:
+                if response.status == 200:
+                    return time.perf_counter() - start
+        except aiohttp.ClientError:
+            pass
+        await asyncio.sleep(0.2)
+    raise RuntimeError(f"Server not ready after {timeout}s")
+
+async def send(session, base_url, kind, question):
+    start = time.perf_counter()
+    try:
+        async with session.get(f"{base_url}/chat", params={"input": question}) as response:
+            body = await response.json() if response.status == 200 else None
+            status = response.status
+    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+        body, status = None, type(e).__name__
+    return {"kind": kind, "seconds": time.perf_counter() - start, "status": status,
+            "timings": (body or {}).get("timings") or {}, "tools": [call["tool"] for call in (body or {}).get("tool_calls", [])]}
+
+async def run_level(session, base_url, pid, schedule, concurrency, repeats=1):
+    #closed loop: every client sends its next request as soon as the previous one is answered
+    #the schedule is sent repeats times, the latencies of every pass are pooled and the rps is the median pass
+    results, rps = [], []
+    peak = [0.0, 0.0]
+
+    async def client(queue, ok):
+        for kind, question in queue:
+            result = await send(session, base_url, kind, question)
+            results.append(result)
+            ok[0] += result["status"] == 200
+
+    async def sample():
+        while True:
+            peak[:] = [max(a, b) for a, b in zip(peak, memory(pid))]
+            await asyncio.sleep(0.25)
+
+    sampler = asyncio.create_task(sample())
+    for _ in range(repeats):
+        queue, ok = iter(schedule), [0]
+        start = time.perf_counter()
+        await asyncio.gather(*[client(queue, ok) for _ in range(concurrency)])
+        rps.append(ok[0] / (time.perf_counter() - start))
+    sampler.cancel()
+    server, sandbox = memory(pid)
+    return summarize(results, statistics.median(rps), concurrency, {"server_peak": max(peak[0], server), "server_end": server,
+                                                                    "sandbox_end": sandbox})
+
+def latency_stats(seconds) -> dict:
+    if not seconds:
+        return {"count": 0}
+    return {"count": len(seconds), "p50": percentile(seconds, 50) * 1000, "p95": percentile(seconds, 95) * 1000,
+            "p99": percentile(seconds, 99) * 1000, "mean": sum(seconds) / len(seconds) * 1000}
+
+def summarize(results, rps, concurrency, memory_mb) -> dict:
+    ok = [r for r in results if r["status"] == 200]
+    nodes = {}
+    for r in ok:
+        for node, seconds in r["timings"].items():
+            nodes.setdefault(node, []).append(seconds)
+    tools = {}
+    for r in ok:
+        route = ",".join(sorted(r["tools"])) or "none"
+        tools[f"{r['kind']}->{route}"] = tools.get(f"{r['kind']}->{route}", 0) + 1
+    return {"concurrency": concurrency, "requests": len(results), "errors": len(results) - len(ok), "rps": rps, "latency_ms": latency_stats([r["seconds"] for r in ok]),
+            "kinds": {kind: latency_stats([r["seconds"] for r in ok if r["kind"] == kind]) for kind in sorted({r["kind"] for r in ok})},
+            "nodes": {node: latency_stats(seconds) for node, seconds in sorted(nodes.items())},
+            "routes": tools, "memory_mb": memory_mb}
+
+def print_level(level):
+    latency = level["latency_ms"]
+    print(f"  concurrency {level['concurrency']:>3}: {level['rps']:7.1f} req/s  p50={latency.get('p50', 0):7.1f}ms  "
+          f"p95={latency.get('p95', 0):7.1f}ms  p99={latency.get('p99', 0):7.1f}ms  errors={level['errors']}  "
+          f"rss server {level['memory_mb']['server_peak']:.0f}MB peak, sandbox workers {level['memory_mb']['sandbox_end']:.0f}MB")
+    for kind, stats in level["kinds"].items():
+        print(f"      {kind:<6} n={stats['count']:<5} p50={stats['p50']:7.1f}ms  p95={stats['p95']:7.1f}ms  p99={stats['p99']:7.1f}ms")
+    print("      nodes: " + ", ".join(f"{node} {stats['p50']:.1f}/{stats['p95']:.1f}ms" for node, stats in level["nodes"].items()))
+
+#(metric, path in a level, True when higher is worse)
+COMPARED = [("rps", ("rps",), False), ("p50", ("latency_ms", "p50"), True), ("p95", ("latency_ms", "p95"), True),
+            ("p99", ("latency_ms", "p99"), True), ("server rss peak", ("memory_mb", "server_peak"), True)]
+
+def lookup(level, path):
+    for key in path:
+        level = (level or {}).get(key)
+    return level
+
+def compare(current, baseline, tolerance, min_delta_ms) -> list:
+    #-> the regressions, a metric regresses when it is worse by more than tolerance (relative), latencies also need
+    #min_delta_ms more so a 1ms -> 1.3ms jitter is not one
+    if current["settings"] != baseline["settings"]:
+        changed = sorted(key for key in set(current["settings"]) | set(baseline["settings"])
+                         if current["settings"].get(key) != baseline["settings"].get(key))
+        print(f"warning: the baseline was run with other settings ({', '.join(changed)}), the comparison is not like for like")
+    regressions = []
+    print(f"{'':<22}{'baseline':>12}{'current':>12}{'change':>9}")
+    for concurrency, level in current["levels"].items():
+        base_level = baseline["levels"].get(concurrency)
+        if base_level is None:
+            print(f"concurrency {concurrency}: not in the baseline")
+            continue
+        checks = [(name, path, worse_up) for name, path, worse_up in COMPARED]
+        checks += [(f"{kind} p95", ("kinds", kind, "p95"), True) for kind in level["kinds"]]
+        for name, path, worse_up in checks:
+            before, after = lookup(base_level, path), lookup(level, path)
+            if before is None or after is None:
+                continue
+            change = (after - before) / before if before else 0.0
+            worse = change > tolerance if worse_up else change < -tolerance
+            if worse and path[0] in ("latency_ms", "kinds") and after - before < min_delta_ms:
+                worse = False
+            flag = "REGRESSION" if worse else ""
+            print(f"c={concurrency:<4}{name:<18}{before:12.1f}{after:12.1f}{change:+9.1%}  {flag}")
+            if worse:
+                regressions.append(f"concurrency {concurrency} {name}: {before:.1f} -> {after:.1f} ({change:+.1%})")
+        if level["errors"] > base_level["errors"]:
+            regressions.append(f"concurrency {concurrency} errors: {base_level['errors']} -> {level['errors']}")
+    return regressions
+
+def server_args(args) -> list:
+    return ["--llm-latency", str(args.llm_latency), "--token-latency", str(args.token_latency), "--embed-latency",
+            str(args.embed_latency), "--llm-rate", str(args.llm_rate), "--filler-chunks", str(args.filler_chunks)] + \
+           (["--response-cache"] if args.response_cache else [])
+
+async def drive(args, port, server):
+    questions, _ = load_questions()
+    mix = parse_mix(args.mix)
+    base_url = f"http://127.0.0.1:{port}"
+    timeout = aiohttp.ClientTimeout(total=args.request_timeout)
+    async with aiohttp.ClientSession(timeout=timeout, connector=aiohttp.TCPConnector(limit=0)) as session:
+        startup = await wait_ready(session, base_url, server, args.startup_timeout)
+        idle = memory(server.pid)
+        print(f"server ready in {startup:.1f}s, rss {idle[0]:.0f}MB (+{idle[1]:.0f}MB sandbox workers)")
+        #first requests compile the graph paths and fill the lazy bits, not measured
+        await run_level(session, base_url, server.pid, make_schedule(questions, mix, args.warmup, args.seed + 1), 1)
+        levels = {}
+        for concurrency in [int(c) for c in args.concurrency.split(",")]:
+            level = await run_level(session, base_url, server.pid, make_schedule(questions, mix, args.requests, args.seed), concurrency,
+                                    args.repeats)
+            levels[str(concurrency)] = level
+            print_level(level)
+    settings = {key: getattr(args, key) for key in ("mix", "requests", "repeats", "seed", "llm_latency", "token_latency", "embed_latency",
+                                                     "llm_rate", "filler_chunks", "response_cache")}
+    return {"settings": settings, "machine": {"python": platform.python_version(), "cpus": os.cpu_count(), "platform": platform.platform()},
+            "startup_seconds": startup, "idle_memory_mb": {"server": idle[0], "sandbox": idle[1]}, "levels": levels}
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--concurrency", default="1,8,32")
+    parser.add_argument("--requests", type=int, default=200, help="requests per pass of a concurrency level")
+    parser.add_argument("--repeats", type=int, default=3, help="passes per concurrency level, run to run noise is large on few cores")
+    parser.add_argument("--warmup", type=int, default=20)
+    parser.add_argument("--mix", default="rag=0.5,code=0.2,plain=0.3")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--llm-latency", type=float, default=0.05, help="fake provider seconds before the first token")
+    parser.add_argument("--token-latency", type=float, default=0.0)
+    parser.add_argument("--embed-latency", type=float, default=0.0, help="fake embedder seconds per text")
+    parser.add_argument("--llm-rate", type=float, default=0, help="gateway llm calls per second, 0 = no limit (the config value is the provider quota)")
+    parser.add_argument("--filler-chunks", type=int, default=5000, help="synthetic chunks indexed next to the fixture corpus")
+    parser.add_argument("--response-cache", action="store_true", help="let repeated questions be answered from the cache")
+    parser.add_argument("--request-timeout", type=float, default=120)
+    parser.add_argument("--startup-timeout", type=float, default=300)
+    parser.add_argument("--save", help="write the results to this json file")
+    parser.add_argument("--baseline", help="json of an earlier run to compare with, exits with 1 on a regression")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="relative change that counts as a regression")
+    parser.add_argument("--min-delta-ms", type=float, default=5.0)
+    parser.add_argument("--serve", nargs=2, metavar=("PORT", "WORKDIR"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.serve:
+        return serve(args, int(args.serve[0]), args.serve[1])
+
+    port = free_port()
+    with tempfile.TemporaryDirectory() as workdir:
+        log_path = os.path.join(workdir, "server.log")
+        with open(log_path, "w") as log:
+            server = subprocess.Popen([sys.executable, "-m", "src.benchmarks.bench_load", *server_args(args), "--serve", str(port), workdir],
+                                      stdout=log, stderr=subprocess.STDOUT)
+            try:
+                results = asyncio.run(drive(args, port, server))
+            except Exception:
+                with open(log_path) as f:
+                    print(f.read()[-4000:], file=sys.stderr)
+                raise
+            finally:
+                server.terminate()
+                try:
+                    server.wait(timeout=30)
+                except subprocess.TimeoutExpired:
+                    server.kill()
+    if args.save:
+        with open(args.save, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+        print(f"results saved to {args.save}")
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.tolerance, args.min_delta_ms)
+        if regressions:
+            print("regressions against the baseline:\n  " + "\n  ".join(regressions))
+            sys.exit(1)
+        print("no regression against the baseline")
+
+if __name__ == "__main__":
+    main()
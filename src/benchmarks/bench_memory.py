@@ -0,0 +1,68 @@
+import os
+import asyncio
+import argparse
+import tempfile
+
+from src.app.agent_workflow.agent_graph import create_graph, new_turn
+from src.app.agent_workflow.conversation_memory import count_tokens
+from src.app.api.sessions import Session_Store, open_checkpointer
+from src.benchmarks.fakes import Fake_Chat_Model, Fake_Rag, Fake_Sandbox
+
+#a long session through the graph with the sqlite checkpointer: the final answer prompt must stay flat however many turns,
+#and the session db must not grow with the turns (only the last checkpoint is kept)
+#then idle ttl and session cap eviction
+#run with: python -m src.benchmarks.bench_memory
+
+ANSWER = ("A decision tree splits the data on the feature that best separates the labels, and keeps splitting until the "
+          "leaves are pure or a depth limit is reached. Random forests average many of them to reduce the variance. ") * 2
+
+def make_responder(prompt_tokens: list):
+    def responder(prompt: str) -> str:
+        if "You are a router" in prompt:
+            return "rag_retriever"
+        if "running summary" in prompt:
+            #longer than asked on purpose, the memory has to enforce the budget itself
+            return "The student asked about trees, forests and boosting. " * 60
+        prompt_tokens.append(count_tokens(prompt))
+        return ANSWER.strip()
+    return responder
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--turns", type=int, default=200)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, "sessions.sqlite")
+        sessions = Session_Store(await open_checkpointer(db_path), ttl=3600, max_sessions=3)
+        await sessions.setup()
+        prompt_tokens = []
+        llm = Fake_Chat_Model(responder=make_responder(prompt_tokens))
+        graph = create_graph("fake-key", Fake_Rag(), lambda model, temperature: llm, sandbox=Fake_Sandbox(),
+                             checkpointer=sessions.checkpointer)
+
+        config = sessions.config("long-session")
+        sizes = {}
+        for turn in range(1, args.turns + 1):
+            question = f"question number {turn}: how do gradient boosted trees differ from random forests when the data is noisy?"
+            state = await graph.ainvoke(new_turn(question), config)
+            await sessions.touch("long-session")
+            if turn in (1, 2, 5, 10, 25, 50, 100, 150, 200) or turn == args.turns:
+                #the checkpointer runs sqlite in wal mode, recent writes are still in the -wal file
+                sizes[turn] = sum(os.path.getsize(path) for path in (db_path, db_path + "-wal") if os.path.exists(path))
+                print(f"turn {turn:>4}: final answer prompt ~{prompt_tokens[-1]:>5} tokens, history {len(state['history']):>2} messages, "
+                      f"summary ~{count_tokens(state['summary']):>3} tokens, db {sizes[turn] / 1024:7.1f} KB")
+        print(f"prompt tokens over {args.turns} turns: first {prompt_tokens[0]}, max {max(prompt_tokens)}, "
+              f"last 50 avg {sum(prompt_tokens[-50:]) / len(prompt_tokens[-50:]):.0f}")
+
+        #the ttl and the cap
+        for i in range(5):
+            await graph.ainvoke(new_turn("what is overfitting?"), sessions.config(f"user-{i}"))
+            await sessions.touch(f"user-{i}")
+        print(f"after 5 more sessions with a cap of 3: {await sessions.count()} sessions, stats {sessions.stats}")
+        sessions.ttl = 0
+        print(f"idle eviction with ttl=0 removed {await sessions.evict_idle()} sessions, {await sessions.count()} left")
+        await sessions.close()
+
+if __name__ == "__main__":
+    asyncio.run(main())
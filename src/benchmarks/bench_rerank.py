@@ -0,0 +1,116 @@
+import time
+import asyncio
+import argparse
+import tempfile
+import numpy as np
+
+from src.app.core.config import RETRIEVAL_K, RERANK_BUDGET_MS
+from src.app.rag_pipelines.chunking import split_content, chunk_id
+from src.app.rag_pipelines.reranker import Cross_Encoder_Reranker, dedup_chunks
+from src.app.agent_workflow.conversation_memory import count_tokens
+from src.benchmarks.bench_router import percentile
+from src.benchmarks.bench_sharding import TOPICS, build
+from src.benchmarks.fakes import Fake_Embeddings, Fake_Cross_Encoder
+
+#context of the final answer before (top RETRIEVAL_K hybrid hits, as Document objects in the prompt) and after
+#(over-fetch, dedup, cross-encoder re-rank, packed text in a token budget): prompt tokens, whether the passage the
+#question is about made it in, near duplicates, per stage timings, then the re-ranker under shrinking latency budgets
+#pages are split with the real splitter (so neighbour chunks overlap) and some are mirrored under a second url like the crawl finds
+#run with: python -m src.benchmarks.bench_rerank
+
+def make_pages(n, seed=0, mirrors=0.2):
+    rng = np.random.default_rng(seed)
+    filler = [f"w{i}" for i in range(5000)]
+    pages = []
+    for i in range(n):
+        topic = int(rng.integers(len(TOPICS)))
+        sentences = []
+        for _ in range(40):
+            words = list(rng.choice(TOPICS[topic], 3)) + [filler[min(j, len(filler)) - 1] for j in rng.zipf(1.3, 9)]
+            rng.shuffle(words)
+            sentences.append(" ".join(words) + ".")
+        source = f"https://pandas.pydata.org/docs/user_guide/page-{i}.html"
+        pages.append((source, " ".join(sentences), topic))
+        if rng.random() < mirrors:
+            pages.append((source + "?hl=en", pages[-1][1], topic))
+    return pages
+
+def make_chunks(pages):
+    chunks = []
+    for source, text, topic in pages:
+        for index, doc in enumerate(split_content(text, source)):
+            chunks.append((chunk_id(source, index), doc.page_content, source, topic))
+    return chunks
+
+def make_queries(chunks, n, seed=1):
+    #an 8 word passage from the middle of a chunk, the question is answered when that passage is in the context
+    rng = np.random.default_rng(seed)
+    queries = []
+    for _ in range(n):
+        words = chunks[int(rng.integers(len(chunks)))][1].split()
+        start = int(rng.integers(max(len(words) - 8, 1)))
+        passage = " ".join(words[start:start + 8])
+        queries.append((passage.rstrip("."), passage.rstrip(".")))
+    return queries
+
+async def before_after(rag, queries):
+    rows = {"before": {"tokens": [], "hits": 0, "duplicates": 0}, "after": {"tokens": [], "hits": 0, "duplicates": 0}}
+    timings = {}
+    for query, passage in queries:
+        docs = (await rag.search(query))[:RETRIEVAL_K]
+        rows["before"]["tokens"].append(count_tokens(str(docs)))
+        rows["before"]["hits"] += any(passage in doc.page_content for doc in docs)
+        rows["before"]["duplicates"] += len(docs) - len(dedup_chunks(docs))
+        result = await rag.query_context(query)
+        rows["after"]["tokens"].append(result["stats"]["prompt_tokens"])
+        rows["after"]["hits"] += passage in result["context"]
+        rows["after"]["duplicates"] += result["stats"]["duplicates"]
+        for stage, seconds in result["timings"].items():
+            timings.setdefault(stage, []).append(seconds)
+    for name, row in rows.items():
+        print(f"  {name:<7} prompt tokens p50={percentile(row['tokens'], 50):6.0f}  mean={np.mean(row['tokens']):6.0f}  "
+              f"passage in context {row['hits'] / len(queries):.0%}  near duplicates {row['duplicates']}"
+              f"{' (in the top ' + str(RETRIEVAL_K) + ')' if name == 'before' else ' (dropped from the candidates)'}")
+    saved = np.mean(rows["before"]["tokens"]) - np.mean(rows["after"]["tokens"])
+    print(f"  prompt tokens saved: {saved:.0f} per question ({saved / np.mean(rows['before']['tokens']):.0%})")
+    print("  stages: " + ", ".join(f"{stage} p50={percentile(values, 50) * 1000:.1f}ms p95={percentile(values, 95) * 1000:.1f}ms"
+                                  for stage, values in timings.items()))
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--pages", type=int, default=1500)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--pair-latency", type=float, default=0.002, help="seconds per (question, chunk) pair of the fake cross-encoder")
+    parser.add_argument("--reranker", choices=["fake", "minilm"], default="fake")
+    args = parser.parse_args()
+
+    embedder = Fake_Embeddings()
+    chunks = make_chunks(make_pages(args.pages))
+    queries = make_queries(chunks, args.queries)
+    vectors = np.asarray(embedder.embed_documents([text for _, text, _, _ in chunks]), dtype=np.float32)
+    scorer = Fake_Cross_Encoder(args.pair_latency) if args.reranker == "fake" else None
+    print(f"{len(chunks)} overlapping chunks from {args.pages} pages (+ mirrors), {args.queries} questions, reranker={args.reranker}")
+    with tempfile.TemporaryDirectory() as tmp:
+        rag = build(tmp, embedder, chunks, vectors, sharded=True)
+        rag.index_ready = True
+        rag.reranker = Cross_Encoder_Reranker(scorer=scorer)
+        rag.reranker.warmup()
+        print(f"budget {RERANK_BUDGET_MS}ms")
+        await before_after(rag, queries)
+        print(f"  reranker stats: {rag.reranker.stats}")
+
+        #the same questions with less and less time for the re-ranker: fewer candidates re-ranked, then the retrieval order
+        for budget_ms in (RERANK_BUDGET_MS, 20, 2):
+            rag.reranker = Cross_Encoder_Reranker(budget=budget_ms / 1000, scorer=scorer)
+            rag.reranker.warmup()
+            latencies, hits = [], 0
+            for query, passage in queries:
+                start = time.perf_counter()
+                result = await rag.query_context(query)
+                latencies.append(time.perf_counter() - start)
+                hits += passage in result["context"]
+            print(f"  budget {budget_ms:>4}ms: passage in context {hits / len(queries):.0%}  p50={percentile(latencies, 50) * 1000:6.1f}ms  "
+                  f"p99={percentile(latencies, 99) * 1000:6.1f}ms  {rag.reranker.stats}")
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,120 @@
+import os
+import json
+import time
+import random
+import argparse
+import tempfile
+import numpy as np
+
+from src.app.rag_pipelines.bm25_index import Bm25_Index, reciprocal_rank_fusion
+from src.app.core.config import RRF_K
+from src.benchmarks.bench_router import percentile
+from src.benchmarks.fakes import Fake_Embeddings
+
+#retrieval quality of dense vs bm25 vs hybrid (recall@k on a small labeled set), then bm25 latency at scale
+#   --embedder minilm       uses the real MiniLM (needs sentence-transformers), default is the offline fake
+#   --distractors N         pads the labeled corpus with synthetic chunks, so the relevant ones have to compete
+#   --scale-chunks N        size of the synthetic corpus for the latency part (1000000 works, it just takes a while to build)
+#run with: python -m src.benchmarks.bench_retrieval
+
+DATA_DIR = os.path.join(os.path.dirname(__file__), "data")
+API_NAMES = ["StandardScaler", "pd.merge_asof", "torch.compile", "GridSearchCV", "OneHotEncoder", "DataLoader",
+             "tf.data", "plt.subplots", "np.reshape", "px.scatter", "read_parquet", "groupby", "fillna"]
+
+def load_jsonl(name):
+    with open(os.path.join(DATA_DIR, name), encoding='utf-8') as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+def synthetic_chunks(n, seed=0, vocabulary_size=50000, words_per_chunk=150):
+    #zipf-ish word frequencies like real text, with an api name sprinkled in now and then
+    rng = np.random.default_rng(seed)
+    words = [f"w{i}" for i in range(vocabulary_size)]
+    for i in range(n):
+        ids = np.minimum(rng.zipf(1.3, words_per_chunk), vocabulary_size) - 1
+        text = " ".join(words[j] for j in ids)
+        if i % 50 == 0:
+            text += " " + API_NAMES[i % len(API_NAMES)]
+        yield f"syn-{i}", text
+
+def dense_ranker(embedder, ids, texts):
+    matrix = np.asarray(embedder.embed_documents(texts), dtype=np.float32)
+    matrix /= np.linalg.norm(matrix, axis=1, keepdims=True) + 1e-9
+    def search(query, k):
+        q = np.asarray(embedder.embed_query(query), dtype=np.float32)
+        scores = matrix @ (q / (np.linalg.norm(q) + 1e-9))
+        return [ids[i] for i in np.argsort(-scores)[:k]]
+    return search
+
+def recall_at_k(search, queries, k):
+    hits = 0
+    for row in queries:
+        found = set(search(row["query"], k))
+        hits += len(found & set(row["relevant"])) / len(row["relevant"])
+    return hits / len(queries)
+
+def quality(args, embedder):
+    corpus = load_jsonl("retrieval_corpus.jsonl")
+    queries = load_jsonl("retrieval_queries.jsonl")
+    ids = [row["id"] for row in corpus]
+    texts = [row["text"] for row in corpus]
+    for cid, text in synthetic_chunks(args.distractors, seed=1, vocabulary_size=5000, words_per_chunk=80):
+        ids.append(cid)
+        texts.append(text)
+
+    dense = dense_ranker(embedder, ids, texts)
+    bm25 = Bm25_Index.build(zip(ids, texts))
+    lexical = lambda query, k: [cid for cid, _ in bm25.search(query, k)]
+    hybrid = lambda query, k: reciprocal_rank_fusion([dense(query, args.fetch_k), lexical(query, args.fetch_k)], k=RRF_K)[:k]
+
+    print(f"quality: {len(queries)} queries over {len(ids)} chunks ({args.distractors} distractors), embedder={args.embedder}")
+    for k in (1, 4, 10):
+        print(f"  recall@{k:<3} dense={recall_at_k(dense, queries, k):.2f}  bm25={recall_at_k(lexical, queries, k):.2f}  "
+              f"hybrid={recall_at_k(hybrid, queries, k):.2f}")
+
+def latency(args):
+    start = time.perf_counter()
+    index = Bm25_Index.build(synthetic_chunks(args.scale_chunks))
+    build_seconds = time.perf_counter() - start
+    with tempfile.TemporaryDirectory() as tmp:
+        directory = os.path.join(tmp, "bm25")
+        index.save(directory)
+        del index
+        start = time.perf_counter()
+        index = Bm25_Index.load(directory)
+        load_seconds = time.perf_counter() - start
+
+        rng = random.Random(0)
+        queries = [" ".join([rng.choice(API_NAMES)] + [f"w{rng.randint(0, 2000)}" for _ in range(rng.randint(1, 5))])
+                   for _ in range(args.queries)]
+        index.search(queries[0], args.fetch_k)
+        latencies = []
+        for query in queries:
+            start = time.perf_counter()
+            index.search(query, args.fetch_k)
+            latencies.append(time.perf_counter() - start)
+        postings = len(index.doc_ids)
+        del index
+
+    print(f"latency: {args.scale_chunks} chunks, {postings} postings, build {build_seconds:.1f}s, mmap load {load_seconds * 1000:.1f}ms")
+    print(f"  bm25 top-{args.fetch_k} over {args.queries} queries: p50={percentile(latencies, 50) * 1000:.2f}ms  "
+          f"p95={percentile(latencies, 95) * 1000:.2f}ms")
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--embedder", choices=["fake", "minilm"], default="fake")
+    parser.add_argument("--distractors", type=int, default=2000)
+    parser.add_argument("--fetch-k", type=int, default=20)
+    parser.add_argument("--scale-chunks", type=int, default=200000)
+    parser.add_argument("--queries", type=int, default=500)
+    args = parser.parse_args()
+
+    if args.embedder == "minilm":
+        from src.app.rag_pipelines.general_rag_pipeline import get_embedded_model
+        embedder = get_embedded_model()
+    else:
+        embedder = Fake_Embeddings()
+    quality(args, embedder)
+    latency(args)
+
+if __name__ == "__main__":
+    main()
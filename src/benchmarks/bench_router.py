@@ -0,0 +1,84 @@
+import os
+import json
+import time
+import asyncio
+import argparse
+import statistics
+
+from src.app.agent_workflow.agent_graph import ChatState, router_node, default_llm_factory
+from src.app.agent_workflow.fast_router import Fast_Router
+from src.benchmarks.fakes import Fake_Chat_Model, Fake_Embeddings
+
+#routing accuracy and latency of the local router against the LLM router on a small labeled set
+#   --embedder minilm   uses the real MiniLM (needs sentence-transformers), default is the offline fake
+#   --llm gemini        uses the real router (needs GOOGLE_API_KEY), default is a fake with provider latency
+#run with: python -m src.benchmarks.bench_router
+
+EVAL_PATH = os.path.join(os.path.dirname(__file__), "data", "routing_eval.jsonl")
+POSSIBLE_TOOLS = ['rag_retriever', 'code_interpreter']
+
+def load_eval(path=EVAL_PATH):
+    with open(path, encoding='utf-8') as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))]
+
+def latency_line(name, latencies):
+    print(f"{name:<14} p50={statistics.median(latencies) * 1000:8.2f}ms  p95={percentile(latencies, 95) * 1000:8.2f}ms")
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--embedder", choices=["fake", "minilm"], default="fake")
+    parser.add_argument("--llm", choices=["fake", "gemini"], default="fake")
+    parser.add_argument("--fake-llm-latency", type=float, default=0.4)
+    args = parser.parse_args()
+
+    if args.embedder == "minilm":
+        from src.app.rag_pipelines.general_rag_pipeline import get_embedded_model
+        embedder = get_embedded_model()
+    else:
+        embedder = Fake_Embeddings()
+    if args.llm == "gemini":
+        get_llm = default_llm_factory(os.getenv("GOOGLE_API_KEY"))
+    else:
+        #the fake can't really route, it's only here for the latency side of the comparison
+        fake = Fake_Chat_Model(responder=lambda prompt: "final_answer", first_token_latency=args.fake_llm_latency)
+        get_llm = lambda model, temperature: fake
+
+    router = Fast_Router(embedder)
+    await router.route("warm up the centroids")
+    rows = load_eval()
+
+    local_latencies, llm_latencies = [], []
+    local_hits = local_correct = llm_correct = 0
+    final_correct = 0
+    for row in rows:
+        start = time.perf_counter()
+        decision = await router.route(row["input"])
+        local_latencies.append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        state = await router_node(ChatState(input=row["input"]), get_llm, POSSIBLE_TOOLS)
+        llm_latencies.append(time.perf_counter() - start)
+        next_steps = state.get("next_steps") if isinstance(state, dict) else None
+        llm_step = (next_steps[0] if next_steps else "final_answer") if next_steps is not None else None
+        llm_correct += llm_step == row["label"]
+
+        if decision is not None:
+            local_hits += 1
+            local_correct += decision["next_step"] == row["label"]
+            final_correct += decision["next_step"] == row["label"]
+        else:
+            final_correct += llm_step == row["label"]
+
+    n = len(rows)
+    print(f"eval set: {n} queries, embedder={args.embedder}, llm={args.llm}")
+    print(f"local router answered {local_hits}/{n} ({local_hits / n:.0%}), accuracy on those {local_correct / max(local_hits, 1):.0%}")
+    print(f"llm router accuracy {llm_correct / n:.0%}, local+fallback accuracy {final_correct / n:.0%}")
+    latency_line("local", local_latencies)
+    latency_line("llm", llm_latencies)
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,74 @@
+import time
+import random
+import asyncio
+import argparse
+import statistics
+
+from src.app.code_sandbox.sandbox_pool import Sandbox_Pool
+
+#load test of the code interpreter sandbox: many concurrent snippets, some of them runaway on purpose
+#while it runs, a heartbeat measures how late the event loop wakes up, that's what every other chat request would feel
+#run with: python -m src.benchmarks.bench_sandbox
+
+SNIPPETS = {
+    "ok": "import numpy as np\nnp.arange(1000).reshape(10, 100).sum(axis=0)[:5]",
+    "pandas": "import pandas as pd\npd.DataFrame({'a': range(100)}).describe()",
+    "error": "[1, 2, 3][10]",
+    "cpu_loop": "while True:\n    pass",
+    "memory": "x = bytearray(50 * 1024 ** 3)",
+    "sleep": "import time\ntime.sleep(1000)",
+}
+
+async def heartbeat(lags: list, stop: asyncio.Event, interval=0.01):
+    while not stop.is_set():
+        start = time.perf_counter()
+        await asyncio.sleep(interval)
+        lags.append(time.perf_counter() - start - interval)
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--pool-size", type=int, default=4)
+    parser.add_argument("--runaway-ratio", type=float, default=0.1)
+    parser.add_argument("--cpu-seconds", type=int, default=2)
+    parser.add_argument("--wall-seconds", type=int, default=3)
+    args = parser.parse_args()
+
+    pool = Sandbox_Pool(size=args.pool_size, cpu_seconds=args.cpu_seconds, wall_seconds=args.wall_seconds)
+    start = time.perf_counter()
+    await pool.start()
+    print(f"pool of {args.pool_size} workers ready in {time.perf_counter() - start:.2f}s")
+
+    rng = random.Random(0)
+    kinds = [rng.choice(["cpu_loop", "memory", "sleep"]) if rng.random() < args.runaway_ratio else rng.choice(["ok", "pandas", "error"])
+             for _ in range(args.requests)]
+    semaphore = asyncio.Semaphore(args.concurrency)
+    durations = {kind: [] for kind in SNIPPETS}
+    failures = {kind: 0 for kind in SNIPPETS}
+
+    async def one(kind):
+        async with semaphore:
+            result = await pool.run(SNIPPETS[kind])
+            durations[kind].append(result["duration"])
+            failures[kind] += result["error"] is not None
+
+    lags = []
+    stop = asyncio.Event()
+    beat = asyncio.create_task(heartbeat(lags, stop))
+    start = time.perf_counter()
+    await asyncio.gather(*[one(kind) for kind in kinds])
+    elapsed = time.perf_counter() - start
+    stop.set()
+    await beat
+    await pool.close()
+
+    print(f"{args.requests} snippets in {elapsed:.2f}s ({args.requests / elapsed:.1f}/s), pool stats: {pool.stats}")
+    for kind, values in durations.items():
+        if values:
+            print(f"  {kind:<9} n={len(values):<4} errors={failures[kind]:<4} p50={statistics.median(values) * 1000:8.1f}ms  max={max(values) * 1000:8.1f}ms")
+    lags.sort()
+    print(f"event loop lag: p50={statistics.median(lags) * 1000:.2f}ms  p99={lags[int(len(lags) * 0.99)] * 1000:.2f}ms  max={lags[-1] * 1000:.2f}ms")
+
+if __name__ == "__main__":
+    asyncio.run(main())
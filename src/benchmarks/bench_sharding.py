@@ -0,0 +1,124 @@
+import time
+import asyncio
+import argparse
+import tempfile
+import numpy as np
+
+from src.app.core.config import LIBRARY_SOURCES, LIBRARY_KEYWORDS, RETRIEVAL_K
+from src.app.rag_pipelines.general_rag_pipeline import Rag_Pipeline
+from src.app.rag_pipelines.bm25_index import Bm25_Index
+from src.app.rag_pipelines.library_shards import library_of, shard_names
+from src.app.rag_pipelines.vector_stores import open_vector_store
+from src.benchmarks.bench_router import percentile
+from src.benchmarks.fakes import Fake_Embeddings
+
+#one collection for the whole corpus vs one collection per library with the keyword routing, same chunks and vectors
+#every library has chunks on the same topics ("save a model", "plot a histogram"...), like the real docs do, and a question
+#names its library ("... in pandas"), the chunks rarely do. precision@k is the share of the top k that is from the asked
+#library and about the asked topic (only the topic for the questions that name no library, those search every shard)
+#run with: python -m src.benchmarks.bench_sharding
+
+TOPICS = [["save", "model", "checkpoint", "disk"], ["plot", "histogram", "bins", "axis"], ["load", "csv", "file", "columns"],
+          ["merge", "join", "keys", "tables"], ["gpu", "device", "memory", "cuda"], ["reshape", "dimensions", "shape", "transpose"],
+          ["missing", "values", "impute", "nan"], ["train", "loop", "epochs", "loss"], ["scale", "normalize", "features", "variance"],
+          ["group", "aggregate", "mean", "category"], ["random", "seed", "reproducible", "sample"], ["color", "palette", "legend", "style"],
+          ["sparse", "matrix", "compressed", "rows"], ["distributed", "cluster", "partitions", "workers"], ["export", "html", "image", "figure"],
+          ["tune", "hyperparameters", "search", "grid"], ["evaluate", "metrics", "accuracy", "score"], ["text", "tokens", "vocabulary", "embedding"]]
+
+def library_url(library, i):
+    #a real looking source url, so ingestion has to derive the shard from the domain and path like it does for the crawl
+    prefixes = LIBRARY_SOURCES.get(library, ["example.org/blog"])
+    return f"https://{prefixes[i % len(prefixes)]}/docs/page-{i}.html"
+
+def make_corpus(n, seed=0):
+    rng = np.random.default_rng(seed)
+    libraries = shard_names()
+    filler = [f"w{i}" for i in range(20000)]
+    chunks = []
+    for i in range(n):
+        library = libraries[i % len(libraries)]
+        topic = int(rng.integers(len(TOPICS)))
+        #api names of the library (its keywords minus its name), topic words and zipf filler, the name itself only now and then
+        own = LIBRARY_KEYWORDS.get(library, [library])[1:] or [library]
+        words = list(rng.choice(TOPICS[topic], 6)) + list(rng.choice(own, 2)) + \
+                [filler[min(j, len(filler)) - 1] for j in rng.zipf(1.3, 60)]
+        if rng.random() < 0.1:
+            words.append(library)
+        rng.shuffle(words)
+        source = library_url(library, i)
+        chunks.append((f"chunk-{i}", " ".join(words), source, topic))
+    return chunks
+
+def make_queries(n, seed=1, named=True):
+    rng = np.random.default_rng(seed)
+    routed = list(LIBRARY_KEYWORDS)
+    queries = []
+    for _ in range(n):
+        library, topic = routed[int(rng.integers(len(routed)))], int(rng.integers(len(TOPICS)))
+        words = " ".join(rng.choice(TOPICS[topic], 2, replace=False))
+        queries.append((f"how do I {words} in {library}", library, topic) if named else (f"how do I {words}", None, topic))
+    return queries
+
+def build(directory, embedder, chunks, vectors, sharded, backend="chroma"):
+    rag = Rag_Pipeline(embedder)
+    rag.dense_batcher = None
+    if not sharded:
+        rag.shards = ["general"]
+        rag.library_router = None
+    for library in rag.shards:
+        rag.vector_stores[library] = open_vector_store(library, embedder, backend, directory)
+    rows = {}
+    for i, (cid, text, source, _) in enumerate(chunks):
+        rows.setdefault(library_of(source) if sharded else "general", []).append(i)
+    for library, indexes in rows.items():
+        for start in range(0, len(indexes), 5000):
+            batch = indexes[start:start + 5000]
+            rag.vector_stores[library].upsert(
+                ids=[chunks[i][0] for i in batch], embeddings=vectors[batch].tolist(), documents=[chunks[i][1] for i in batch],
+                metadatas=[{"source": chunks[i][2], "library": library_of(chunks[i][2]), "topic": chunks[i][3]} for i in batch])
+    for store in rag.vector_stores.values():
+        store.persist()
+    rag.bm25 = Bm25_Index.build((cid, text, library_of(source)) if sharded else (cid, text) for cid, text, source, _ in chunks)
+    return rag
+
+async def measure(rag, queries, k):
+    latencies, precision = [], 0.0
+    #first query of a collection loads its hnsw index, a running server has that done long before
+    for library in {library for _, library, _ in queries}:
+        await rag.search(f"warmup {library or ''}")
+    for query, library, topic in queries:
+        start = time.perf_counter()
+        docs = await rag.search(query)
+        latencies.append(time.perf_counter() - start)
+        precision += sum(library in (None, doc.metadata.get("library")) and doc.metadata.get("topic") == topic
+                         for doc in docs[:k]) / k
+    return latencies, precision / len(queries)
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--chunks", type=int, default=30000)
+    parser.add_argument("--queries", type=int, default=300)
+    parser.add_argument("--backend", choices=["chroma", "ivf"], default="chroma")
+    args = parser.parse_args()
+
+    embedder = Fake_Embeddings()
+    chunks = make_corpus(args.chunks)
+    queries = make_queries(args.queries)
+    unnamed = make_queries(args.queries, seed=2, named=False)
+    start = time.perf_counter()
+    vectors = np.asarray(embedder.embed_documents([text for _, text, _, _ in chunks]), dtype=np.float32)
+    print(f"{args.chunks} chunks over {len(shard_names())} libraries, {len(TOPICS)} shared topics, embedded in {time.perf_counter() - start:.1f}s")
+    print(f"{args.queries} questions that name their library and {args.queries} that don't, hybrid retrieval")
+    for name, sharded in (("single", False), ("sharded", True)):
+        with tempfile.TemporaryDirectory() as tmp:
+            start = time.perf_counter()
+            rag = build(tmp, embedder, chunks, vectors, sharded, args.backend)
+            build_seconds = time.perf_counter() - start
+            print(f"  {name} (build {build_seconds:.1f}s)")
+            for label, question_set in (("named", queries), ("unnamed", unnamed)):
+                latencies, precision = await measure(rag, question_set, RETRIEVAL_K)
+                print(f"    {label:<8} precision@{RETRIEVAL_K}={precision:.2f}  "
+                      f"p50={percentile(latencies, 50) * 1000:6.1f}ms  p95={percentile(latencies, 95) * 1000:6.1f}ms")
+
+if __name__ == "__main__":
+    asyncio.run(main())
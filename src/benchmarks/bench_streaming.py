@@ -0,0 +1,62 @@
+import time
+import asyncio
+import argparse
+import statistics
+
+from src.app.agent_workflow.agent_graph import ChatState, create_graph
+from src.app.api.api import stream_chat_events
+from src.app.api.response_cache import Response_Cache
+from src.benchmarks.fakes import Fake_Chat_Model, Fake_Embeddings, Fake_Rag
+
+#time-to-first-token and total latency of the old /chat + ui fake streaming against /chat/stream
+#the llm is a fake that streams word by word with a provider-like latency
+#run with: python -m src.benchmarks.bench_streaming
+
+ANSWER = ("Classification predicts a discrete label, like spam or not spam, while regression predicts a "
+          "continuous value, like the price of a house. Both are supervised learning. ") * 3
+
+def responder(prompt: str) -> str:
+    if "You are a router" in prompt:
+        return "rag_retriever"
+    return ANSWER.strip()
+
+def make_graph(first_token_latency, token_latency, rag_latency):
+    llm = Fake_Chat_Model(responder=responder, first_token_latency=first_token_latency, token_latency=token_latency)
+    return create_graph("fake-key", Fake_Rag(rag_latency), lambda model, temperature: llm)
+
+async def old_path(graph):
+    #/chat returns the whole state, then the ui slices it 5 chars at a time with a 10ms sleep
+    start = time.perf_counter()
+    state = await graph.ainvoke(ChatState(input="difference between classification and regression"))
+    ttft = time.perf_counter() - start
+    total = ttft + (len(state["output"]) // 5) * 0.01
+    return ttft, total
+
+async def new_path(graph):
+    start = time.perf_counter()
+    ttft = None
+    #cache that never matches, so every run goes through the graph
+    cache = Response_Cache(Fake_Embeddings(), threshold=2.0)
+    async for event in stream_chat_events(graph, cache, "difference between classification and regression"):
+        if ttft is None and event.startswith("event: token"):
+            ttft = time.perf_counter() - start
+    return ttft, time.perf_counter() - start
+
+def summary(name, results):
+    ttfts = [r[0] for r in results]
+    totals = [r[1] for r in results]
+    print(f"{name:<22} ttft p50={statistics.median(ttfts) * 1000:7.1f}ms  total p50={statistics.median(totals) * 1000:7.1f}ms")
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--first-token-latency", type=float, default=0.3)
+    parser.add_argument("--token-latency", type=float, default=0.01)
+    parser.add_argument("--rag-latency", type=float, default=0.05)
+    args = parser.parse_args()
+    graph = make_graph(args.first_token_latency, args.token_latency, args.rag_latency)
+    summary("/chat + ui slicing", [await old_path(graph) for _ in range(args.runs)])
+    summary("/chat/stream (SSE)", [await new_path(graph) for _ in range(args.runs)])
+
+if __name__ == "__main__":
+    asyncio.run(main())
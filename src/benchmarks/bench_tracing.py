@@ -0,0 +1,96 @@
+import os
+import json
+import time
+import asyncio
+import argparse
+import tempfile
+
+from src.app.agent_workflow.agent_graph import ChatState, create_graph
+from src.app.agent_workflow.llm_gateway import Llm_Gateway
+from src.app.core.tracing import (tracer, span, SERVER, Metrics_Registry, new_request_id, set_request_id, reset_request_id)
+from src.benchmarks.bench_fanout import QUESTION, responder
+from src.benchmarks.bench_router import percentile
+from src.benchmarks.fakes import Fake_Chat_Model, Fake_Rag, Fake_Sandbox
+
+#cost of the tracing: a bare span in a loop, then a whole graph request (router, both tools, final answer, all fakes with
+#no latency so the overhead isn't hidden behind it) with tracing off, metrics only, and metrics + the otlp file exporter
+#with the file exporter on, the written traces are read back: spans per request, one trace per request, the request id on them
+#run with: python -m src.benchmarks.bench_tracing
+
+MODES = [("off", False, False), ("metrics", False, True), ("metrics + file export", True, True)]
+
+def configure(enabled, metrics_enabled, path):
+    tracer.metrics = Metrics_Registry()
+    tracer.configure(enabled, "file", metrics_enabled, path)
+
+def span_cost(n):
+    start = time.perf_counter()
+    for i in range(n):
+        with span("bench.span", i=i) as s:
+            s.set("tokens.output", 1)
+    return (time.perf_counter() - start) / n
+
+async def request(graph):
+    #what Request_Context_Middleware does around every api request
+    token = set_request_id(new_request_id())
+    try:
+        start = time.perf_counter()
+        with span("GET /chat", SERVER):
+            await graph.ainvoke(ChatState(input=QUESTION))
+        return time.perf_counter() - start
+    finally:
+        reset_request_id(token)
+
+def read_traces(path):
+    spans = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            for resource in json.loads(line)["resourceSpans"]:
+                for scope in resource["scopeSpans"]:
+                    spans += scope["spans"]
+    return spans
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--spans", type=int, default=200000)
+    parser.add_argument("--requests", type=int, default=300)
+    args = parser.parse_args()
+
+    llm = Fake_Chat_Model(responder=responder)
+    #no request rate limit, or the token bucket is all the benchmark measures
+    gateway = Llm_Gateway(lambda model, temperature: llm, rate_per_second=0)
+    graph = create_graph("fake-key", Fake_Rag(), sandbox=Fake_Sandbox(), gateway=gateway,
+                         tool_timeouts={"rag_retriever": 10, "code_interpreter": 10})
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "traces.jsonl")
+        print(f"{args.spans} bare spans, {args.requests} graph requests per mode")
+        base = None
+        for name, enabled, metrics_enabled in MODES:
+            configure(enabled, metrics_enabled, path)
+            cost = span_cost(args.spans)
+            if tracer.exporter is not None:
+                tracer.exporter.flush(timeout=60)
+            #warm up the graph (first compiled run, lazy imports), not measured
+            for _ in range(10):
+                await request(graph)
+            latencies = [await request(graph) for _ in range(args.requests)]
+            p50 = percentile(latencies, 50)
+            base = base or p50
+            print(f"  {name:<22} span {cost * 1e6:5.2f}us   request p50={p50 * 1000:6.2f}ms  p99={percentile(latencies, 99) * 1000:6.2f}ms"
+                  f"  ({(p50 - base) / base:+.1%} vs off)")
+            if tracer.exporter is not None:
+                tracer.exporter.flush()
+        spans = [s for s in read_traces(path) if s["name"] != "bench.span"]
+        traces = {s["traceId"] for s in spans}
+        with_id = sum(any(a["key"] == "request.id" for a in s["attributes"]) for s in spans)
+        print(f"  exported {len(spans)} spans of {len(traces)} traces, {len(spans) / len(traces):.1f} spans per request, "
+              f"{with_id / len(spans):.0%} with the request id")
+        print("  span names: " + ", ".join(sorted({s["name"] for s in spans})))
+        lines = [line for line in tracer.metrics.render().splitlines() if line.startswith("tutorbot_span_duration_seconds_count")]
+        print(f"  /metrics: {len(tracer.metrics.render().splitlines())} lines, e.g.")
+        for line in lines[:4]:
+            print(f"    {line}")
+        tracer.configure(False, metrics_enabled=False)
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,124 @@
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import subprocess
+import numpy as np
+
+from src.app.rag_pipelines.vector_stores import open_vector_store
+from src.benchmarks.bench_router import percentile
+
+#chroma vs the ivf backend (int8 codes in memory-mapped files + float re-scoring) on synthetic 384 dim corpora:
+#build time, disk, recall@10 against an exact numpy search, query p50/p95, and in a fresh process (what a new worker pays)
+#the time until the first answer and the RSS once open and after the queries
+#vectors are a mixture of topics like sentence embeddings, the questions are perturbed corpus vectors
+#run with: python -m src.benchmarks.bench_vector_store --sizes 100000,1000000
+
+DIM = 384
+
+def make_vectors(n, seed=0, topics=2000, noise=1.0):
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((topics, DIM)).astype(np.float32)
+    vectors = np.empty((n, DIM), dtype=np.float32)
+    for start in range(0, n, 100000):
+        end = min(start + 100000, n)
+        vectors[start:end] = centers[rng.integers(topics, size=end - start)] + noise * rng.standard_normal((end - start, DIM))
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors
+
+def make_queries(vectors, n, seed=1, noise=0.3):
+    rng = np.random.default_rng(seed)
+    queries = vectors[rng.integers(len(vectors), size=n)] + noise / np.sqrt(DIM) * rng.standard_normal((n, DIM))
+    return (queries / np.linalg.norm(queries, axis=1, keepdims=True)).astype(np.float32)
+
+def exact_top(vectors, queries, k):
+    #unit vectors, the closest in l2 are the highest dot products
+    return [set(np.argpartition(-(vectors @ query), k)[:k].tolist()) for query in queries]
+
+def build(backend, directory, vectors):
+    store = open_vector_store("general", backend=backend, directory=directory)
+    for start in range(0, len(vectors), 5000):
+        end = min(start + 5000, len(vectors))
+        store.upsert(ids=[str(i) for i in range(start, end)], embeddings=vectors[start:end].tolist() if backend == "chroma" else vectors[start:end],
+                     documents=[f"chunk {i}" for i in range(start, end)], metadatas=[{"source": f"https://example.org/{i}"} for i in range(start, end)])
+    store.persist()
+
+def disk_mb(directory):
+    return sum(os.path.getsize(os.path.join(root, name)) for root, _, names in os.walk(directory) for name in names) / 2**20
+
+def rss_mb():
+    #(anonymous, file backed) resident MB, the mapped index pages are file backed: page cache the kernel can take back
+    rss = {}
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith(("RssAnon:", "RssFile:")):
+                rss[line.split(":")[0]] = int(line.split()[1]) / 1024
+    return np.array([rss["RssAnon"], rss["RssFile"]])
+
+def child(backend, directory, queries_path, k):
+    #fresh process: imports are done before the clock starts, then open, first query, the rest
+    queries = np.load(queries_path)
+    #blas allocates its buffers on the first matrix product, not something either backend should be charged for
+    np.ones((64, 64), dtype=np.float32) @ np.ones((64, 64), dtype=np.float32)
+    base = rss_mb()
+    start = time.perf_counter()
+    store = open_vector_store("general", backend=backend, directory=directory)
+    opened = time.perf_counter() - start
+    rss_open = rss_mb() - base
+    first = store.query([queries[0].tolist()], k, documents=False)
+    ready = time.perf_counter() - start
+    latencies, results = [], [[int(cid) for cid, _, _ in first[0]]]
+    for query in queries[1:]:
+        start = time.perf_counter()
+        row = store.query([query.tolist()], k, documents=False)[0]
+        latencies.append(time.perf_counter() - start)
+        results.append([int(cid) for cid, _, _ in row])
+    rss = rss_mb() - base
+    #same queries again, the pages they need are in memory now, what a worker that has been serving for a while sees
+    warm = []
+    for query in queries:
+        start = time.perf_counter()
+        store.query([query.tolist()], k, documents=False)
+        warm.append(time.perf_counter() - start)
+    print(json.dumps({"open": opened, "ready": ready, "rss_open": rss_open.tolist(), "rss": rss.tolist(), "latencies": latencies,
+                      "warm": warm, "results": results}))
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", default="100000")
+    parser.add_argument("--queries", type=int, default=300)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--backends", default="chroma,ivf")
+    parser.add_argument("--child", nargs=3, metavar=("BACKEND", "DIRECTORY", "QUERIES"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        return child(*args.child, args.k)
+
+    for n in [int(size) for size in args.sizes.split(",")]:
+        vectors = make_vectors(n)
+        queries = make_queries(vectors, args.queries)
+        truth = exact_top(vectors, queries, args.k)
+        print(f"{n} vectors of {DIM} dims, {args.queries} queries, k={args.k}")
+        with tempfile.TemporaryDirectory() as tmp:
+            queries_path = os.path.join(tmp, "queries.npy")
+            np.save(queries_path, queries)
+            for backend in args.backends.split(","):
+                directory = os.path.join(tmp, backend)
+                start = time.perf_counter()
+                build(backend, directory, vectors)
+                build_seconds = time.perf_counter() - start
+                output = subprocess.run([sys.executable, "-m", "src.benchmarks.bench_vector_store", "--k", str(args.k),
+                                         "--child", backend, directory, queries_path], capture_output=True, text=True, check=True)
+                result = json.loads(output.stdout.strip().splitlines()[-1])
+                recall = np.mean([len(truth[i] & set(ids)) / args.k for i, ids in enumerate(result["results"])])
+                print(f"  {backend:<7} build {build_seconds:6.1f}s  disk {disk_mb(directory):6.0f}MB  recall@{args.k}={recall:.3f}  "
+                      f"p50={percentile(result['latencies'], 50) * 1000:6.2f}ms  p95={percentile(result['latencies'], 95) * 1000:6.2f}ms  "
+                      f"(warm p50={percentile(result['warm'], 50) * 1000:.2f}ms)")
+                print(f"          new process: open {result['open'] * 1000:7.1f}ms  first answer {result['ready'] * 1000:7.1f}ms  "
+                      f"rss anon/file +{result['rss_open'][0]:.0f}/{result['rss_open'][1]:.0f}MB open, "
+                      f"+{result['rss'][0]:.0f}/{result['rss'][1]:.0f}MB after the queries")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+import json
+import time
+import random
+import threading
+from http.server import BaseHTTPRequestHandler
+
+from src.benchmarks.fixture_server import _Backlog_Server
+
+#local stand-in for the llm provider: POST /v1/generate {"model", "temperature", "prompt"} -> {"content"}
+#it behaves like a provider under pressure: a quota of requests per second and of requests in flight, and an
+#optional "429 storm" window where a share of the requests is rejected no matter what
+
+class Fake_Llm_Server:
+    def __init__(self, latency=0.1, quota_per_second=50, max_in_flight=16, storm_start=None, storm_seconds=0.0,
+                 storm_rejection=0.5, responder=None, host="127.0.0.1", port=0, seed=0):
+        self.latency = latency
+        self.quota_per_second = quota_per_second
+        self.max_in_flight = max_in_flight
+        self.storm_start = storm_start
+        self.storm_seconds = storm_seconds
+        self.storm_rejection = storm_rejection
+        self.responder = responder or (lambda prompt: f"answer to: {prompt[-40:]}")
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.in_flight = 0
+        self.window = (0, 0)
+        self.started = None
+        self.stats = {"requests": 0, "ok": 0, "rejected_quota": 0, "rejected_storm": 0, "connections": 0}
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def setup(self):
+                super().setup()
+                with server.lock:
+                    server.stats["connections"] += 1
+
+            def _reply(self, status, payload):
+                body = json.dumps(payload).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                if status == 429:
+                    self.send_header("Retry-After", "1")
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_POST(self):
+                request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+                rejected = server._admit()
+                if rejected:
+                    return self._reply(429, {"error": f"Resource has been exhausted ({rejected})"})
+                try:
+                    time.sleep(server.latency)
+                    self._reply(200, {"content": server.responder(request.get("prompt", ""))})
+                finally:
+                    with server.lock:
+                        server.in_flight -= 1
+                        server.stats["ok"] += 1
+
+            def log_message(self, *args):
+                pass
+
+        self.httpd = _Backlog_Server((host, port), Handler)
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+
+    def _admit(self):
+        #returns why the request is rejected, or None when it's accepted (and counted as in flight)
+        with self.lock:
+            self.stats["requests"] += 1
+            now = time.monotonic()
+            elapsed = now - self.started
+            if self.storm_start is not None and self.storm_start <= elapsed < self.storm_start + self.storm_seconds \
+                    and self.rng.random() < self.storm_rejection:
+                self.stats["rejected_storm"] += 1
+                return "storm"
+            second, count = self.window
+            if int(now) != second:
+                second, count = int(now), 0
+            if count >= self.quota_per_second or self.in_flight >= self.max_in_flight:
+                self.stats["rejected_quota"] += 1
+                return "quota"
+            self.window = (second, count + 1)
+            self.in_flight += 1
+            return None
+
+    @property
+    def base_url(self):
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def __enter__(self):
+        self.started = time.monotonic()
+        self.thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self.httpd.shutdown()
+        self.httpd.server_close()
@@ -0,0 +1,225 @@
+import re
+import math
+import time
+import zlib
+import threading
+import asyncio
+import json
+import urllib.request
+from typing import Any, Callable
+import aiohttp
+from pydantic import PrivateAttr
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from langchain_core.language_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+
+#deterministic stand-ins for the heavy/remote pieces, so the benchmarks run offline and fast
+
+class Fake_Embeddings(Embeddings):
+    #hashed bag of words, texts that share words end up close, which is enough to exercise similarity code
+    #text_latency and call_latency stand in for the MiniLM forward pass, seconds per embedded text and per call
+    #a real forward pass already uses every core, so concurrent calls take turns like they would on the cpu
+    def __init__(self, dim=384, text_latency=0.0, call_latency=0.0):
+        self.dim = dim
+        self.text_latency = text_latency
+        self.call_latency = call_latency
+        self._forward_lock = threading.Lock()
+        self._buckets = {}
+        self.calls = 0
+        self.texts_embedded = 0
+
+    def _embed(self, text: str) -> list[float]:
+        vector = [0.0] * self.dim
+        for word in re.findall(r"\w+", text.lower()):
+            bucket = self._buckets.get(word)
+            if bucket is None:
+                h = zlib.crc32(word.encode('utf-8'))
+                bucket = self._buckets[word] = (h % self.dim, 1.0 if h & 1 else -1.0)
+            vector[bucket[0]] += bucket[1]
+        norm = math.sqrt(sum(v * v for v in vector)) or 1.0
+        return [v / norm for v in vector]
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        self.calls += 1
+        self.texts_embedded += len(texts)
+        if self.text_latency or self.call_latency:
+            with self._forward_lock:
+                time.sleep(self.call_latency + self.text_latency * len(texts))
+        return [self._embed(text) for text in texts]
+
+    def embed_query(self, text: str) -> list[float]:
+        return self.embed_documents([text])[0]
+
+class Fake_Chat_Model(BaseChatModel):
+    #answers with responder(prompt) and streams it word by word, with a configurable provider latency
+    responder: Callable[[str], str] = lambda prompt: "final_answer"
+    first_token_latency: float = 0.0
+    token_latency: float = 0.0
+    calls: int = 0
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-chat"
+
+    def _prompt_text(self, messages) -> str:
+        return "\n".join(str(message.content) for message in messages)
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        self.calls += 1
+        text = self.responder(self._prompt_text(messages))
+        time.sleep(self.first_token_latency + self.token_latency * len(text.split(" ")))
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=text))])
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        chunks = [chunk async for chunk in self._astream(messages, stop, run_manager, **kwargs)]
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content="".join(c.message.content for c in chunks)))])
+
+    async def _astream(self, messages, stop=None, run_manager=None, **kwargs):
+        self.calls += 1
+        text = self.responder(self._prompt_text(messages))
+        await asyncio.sleep(self.first_token_latency)
+        for i, word in enumerate(text.split(" ")):
+            token = word if i == 0 else " " + word
+            if i:
+                await asyncio.sleep(self.token_latency)
+            chunk = ChatGenerationChunk(message=AIMessageChunk(content=token))
+            if run_manager:
+                await run_manager.on_llm_new_token(token, chunk=chunk)
+            yield chunk
+
+class Fake_Rag:
+    #same interface as Rag_Pipeline.query_docs / query_context, with a fixed retrieval latency
+    #embedded_model is what the app shares with the router and the response cache, like the real pipeline does
+    def __init__(self, latency=0.0, embedded_model=None):
+        self.latency = latency
+        self.embedded_model = embedded_model
+
+    async def warmup(self):
+        pass
+
+    def start_index_build(self):
+        return None
+
+    async def query_docs(self, input):
+        await asyncio.sleep(self.latency)
+        return [Document(page_content=f"Some documentation about {input}", metadata={"source": "https://example.org/docs"})]
+
+    async def query_context(self, input):
+        documents = await self.query_docs(input)
+        context = "\n\n".join(f"[{i}] {doc.metadata['source']}\n{doc.page_content}" for i, doc in enumerate(documents, start=1))
+        return {'context': context, 'documents': documents, 'timings': {'retrieve': self.latency},
+                'stats': {'candidates': len(documents), 'duplicates': 0, 'documents': len(documents), 'reranked': False,
+                          'prompt_tokens': len(context) // 4, 'prompt_tokens_saved': 0}}
+
+class Fake_Vector_Store:
+    #the vector store calls the indexer makes, kept in a dict
+    def __init__(self):
+        self.rows = {}
+
+    def upsert(self, ids, embeddings, documents, metadatas):
+        for cid, embedding, document, metadata in zip(ids, embeddings, documents, metadatas):
+            self.rows[cid] = (embedding, document, metadata)
+
+    def delete(self, ids):
+        for cid in ids:
+            self.rows.pop(cid, None)
+
+    def count(self):
+        return len(self.rows)
+
+    def persist(self):
+        pass
+
+class Fake_Sandbox:
+    #same interface as Sandbox_Pool.run, with a fixed execution latency
+    def __init__(self, latency=0.0):
+        self.latency = latency
+
+    async def start(self):
+        pass
+
+    async def close(self):
+        pass
+
+    async def run(self, code: str) -> dict:
+        await asyncio.sleep(self.latency)
+        return {"stdout": "", "stderr": "", "result": None, "error": None, "duration": self.latency}
+
+class Fake_Cross_Encoder:
+    #scorer for Cross_Encoder_Reranker: share of the question's word pairs found in the chunk, in order, so it reads the
+    #chunk more closely than the bag of words of Fake_Embeddings. pair_latency seconds per (question, chunk), one call at a time
+    #load_latency is paid by the first call, like the lazy load of the real model
+    def __init__(self, pair_latency=0.0, load_latency=0.0):
+        self.pair_latency = pair_latency
+        self.load_latency = load_latency
+        self._forward_lock = threading.Lock()
+
+    def __call__(self, query: str, texts: list[str]) -> list[float]:
+        with self._forward_lock:
+            if self.load_latency:
+                time.sleep(self.load_latency)
+                self.load_latency = 0.0
+        words = re.findall(r"\w+", query.lower())
+        pairs = {f"{a} {b}" for a, b in zip(words, words[1:])} or set(words)
+        if self.pair_latency:
+            with self._forward_lock:
+                time.sleep(self.pair_latency * len(texts))
+        scores = []
+        for text in texts:
+            normalized = " ".join(re.findall(r"\w+", text.lower()))
+            scores.append(sum(pair in normalized for pair in pairs) / len(pairs) if pairs else 0.0)
+        return scores
+
+class Provider_Error(Exception):
+    def __init__(self, status_code, message):
+        super().__init__(f"{status_code} {message}")
+        self.status_code = status_code
+
+class Http_Chat_Model(BaseChatModel):
+    #chat model that calls the fake llm server, with a kept-alive session or (reuse_session=False) a new one per call,
+    #which is what creating a new ChatGoogleGenerativeAI in every node amounts to
+    base_url: str
+    model_name: str = "fake"
+    temperature: float = 0.0
+    reuse_session: bool = True
+    _session: Any = PrivateAttr(default=None)
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-http-chat"
+
+    def _payload(self, messages) -> dict:
+        prompt = "\n".join(str(message.content) for message in messages)
+        return {"model": self.model_name, "temperature": self.temperature, "prompt": prompt}
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        request = urllib.request.Request(f"{self.base_url}/v1/generate", data=json.dumps(self._payload(messages)).encode(),
+                                         headers={"Content-Type": "application/json"})
+        try:
+            with urllib.request.urlopen(request) as response:
+                content = json.loads(response.read())["content"]
+        except urllib.error.HTTPError as e:
+            raise Provider_Error(e.code, e.read().decode()) from None
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=content))])
+
+    async def _post(self, session, messages):
+        async with session.post(f"{self.base_url}/v1/generate", json=self._payload(messages)) as response:
+            if response.status != 200:
+                raise Provider_Error(response.status, await response.text())
+            return (await response.json())["content"]
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        if self.reuse_session:
+            if self._session is None or self._session.closed:
+                self._session = aiohttp.ClientSession()
+            content = await self._post(self._session, messages)
+        else:
+            async with aiohttp.ClientSession() as session:
+                content = await self._post(session, messages)
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=content))])
+
+    async def aclose(self):
+        if self._session is not None:
+            await self._session.close()
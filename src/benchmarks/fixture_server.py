@@ -0,0 +1,94 @@
+import random
+import threading
+import time
+from collections import Counter
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+#local http server with a synthetic link graph, so the crawler can be measured without touching the internet
+#every site has `pages_per_site` pages and each page links to `fanout` random pages of the same site
+
+def build_link_graph(n_sites=8, pages_per_site=60, fanout=6, seed=42):
+    rng = random.Random(seed)
+    graph = {}
+    for site in range(n_sites):
+        #the index page is the seed of the site
+        graph[f"/site{site}/"] = [f"/site{site}/page{page}.html" for page in range(fanout)]
+        for page in range(pages_per_site):
+            links = [f"/site{site}/page{rng.randrange(pages_per_site)}.html" for _ in range(fanout)]
+            graph[f"/site{site}/page{page}.html"] = links
+    return graph
+
+def render_page(path, links, paragraphs=20):
+    #shaped like a docs page: scripts and styles in the head, a menu and a footer around the main content
+    body = "".join(f"<p>{path} paragraph {i} about gradient descent, overfitting and pandas dataframes.</p>" for i in range(paragraphs))
+    anchors = "".join(f'<a href="{link}">{link}</a>' for link in links)
+    head = f"<title>{path}</title><script>window.dataLayer = [];</script><style>main {{ max-width: 60em; }}</style>"
+    return (f"<html><head>{head}</head><body><nav>menu</nav><main>{body}{anchors}</main>"
+            f"<footer>(c) the authors, generated from the sources</footer></body></html>")
+
+class _Backlog_Server(ThreadingHTTPServer):
+    #the default listen backlog (5) drops connections under a concurrent crawl and adds 1s retransmits
+    request_queue_size = 128
+    daemon_threads = True
+
+class Fixture_Server:
+    def __init__(self, graph=None, latency=0.02, host="127.0.0.1", port=0, paragraphs=20):
+        self.graph = graph if graph is not None else build_link_graph()
+        self.latency = latency
+        self.pages = {path: render_page(path, links, paragraphs).encode() for path, links in self.graph.items()}
+        #what the crawler did: requests per path, and the most requests in flight at once, in total and per Host header
+        self.requests = Counter()
+        self.in_flight = Counter()
+        self.max_in_flight = Counter()
+        self.lock = threading.Lock()
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                #the in flight count covers the latency only, it's down before the client gets its answer and can send the next one
+                host = self.headers.get("Host", "")
+                with server.lock:
+                    server.requests[self.path] += 1
+                    for key in ("", host):
+                        server.in_flight[key] += 1
+                        server.max_in_flight[key] = max(server.max_in_flight[key], server.in_flight[key])
+                try:
+                    #fake network latency, the whole point of the concurrent crawler is to overlap it
+                    time.sleep(server.latency)
+                finally:
+                    with server.lock:
+                        for key in ("", host):
+                            server.in_flight[key] -= 1
+                page = server.pages.get(self.path)
+                if page is None:
+                    self.send_response(404)
+                    self.end_headers()
+                    return
+                self.send_response(200)
+                self.send_header("Content-Type", "text/html; charset=utf-8")
+                self.send_header("Content-Length", str(len(page)))
+                self.end_headers()
+                self.wfile.write(page)
+
+            def log_message(self, *args):
+                pass
+
+        self.httpd = _Backlog_Server((host, port), Handler)
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+
+    @property
+    def base_url(self):
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def seeds(self):
+        sites = sorted({path.split('/')[1] for path in self.graph})
+        return [f"{self.base_url}/{site}/" for site in sites]
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self.httpd.shutdown()
+        self.httpd.server_close()
@@ -0,0 +1,75 @@
+import os
+import csv
+import json
+import asyncio
+import contextlib
+import httpx
+import pytest
+
+from src.benchmarks.fakes import Fake_Chat_Model, Fake_Embeddings, Fake_Rag, Fake_Sandbox
+
+#shared pieces of the tests: the app booted through its real lifespan with fakes in place of the llm, the embedder and
+#the sandbox, served in process (no socket) to an httpx client, and a small corpus of real library urls
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), "benchmarks", "data")
+ANSWER = "Start from the documented defaults and check the shapes of your inputs."
+
+@pytest.fixture
+def workdir(tmp_path, monkeypatch):
+    #every default path of the app (corpus, index, manifest, caches, sessions db) is relative, a test runs in its own dir
+    monkeypatch.chdir(tmp_path)
+    return tmp_path
+
+def write_fixture_corpus(path):
+    #the retrieval fixture corpus as an old style csv, one row per chunk
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path, "w", newline="", encoding="utf-8") as f, open(os.path.join(DATA_DIR, "retrieval_corpus.jsonl"), encoding="utf-8") as corpus:
+        writer = csv.writer(f)
+        writer.writerow(["source", "text"])
+        for line in corpus:
+            row = json.loads(line)
+            writer.writerow([row["source"], row["text"]])
+    return path
+
+def responder(route="rag_retriever", answer=ANSWER):
+    #what the fake llm answers: the given route to the llm router, answer to everything else
+    def respond(prompt: str) -> str:
+        if "You are a router" in prompt:
+            return route
+        if "split in text and code" in prompt:
+            return "print(1 + 1) / prints 2"
+        return answer
+    return respond
+
+@contextlib.asynccontextmanager
+async def serve_app(**overrides):
+    #the app as the Dockerfile runs it (src.main:app, lifespan included), with app.state.overrides on top of the defaults
+    from src.main import app
+    llm = overrides.pop("llm", None) or Fake_Chat_Model(responder=responder())
+    defaults = {"llm_factory": lambda model, temperature: llm, "session_db_path": "sessions.sqlite", "sandbox": Fake_Sandbox()}
+    app.state.overrides = {**defaults, **overrides}
+    try:
+        async with app.router.lifespan_context(app):
+            async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test", timeout=60) as client:
+                yield client
+    finally:
+        app.state.overrides = {}
+
+def parse_sse(text):
+    events = []
+    for block in text.strip().split("\n\n"):
+        lines = dict(line.split(": ", 1) for line in block.splitlines())
+        events.append((lines["event"], json.loads(lines["data"])))
+    return events
+
+def stream(llm, input="What is gradient descent?", request_id="test-request"):
+    #one /chat/stream request to the app with the given llm, the events as (name, data)
+    embedder = Fake_Embeddings()
+
+    async def main():
+        async with serve_app(rag=Fake_Rag(embedded_model=embedder), llm=llm) as client:
+            response = await client.get("/chat/stream", params={"input": input}, headers={"X-Request-ID": request_id})
+            assert response.status_code == 200
+            return parse_sse(response.text)
+
+    return asyncio.run(main())
@@ -0,0 +1,67 @@
+import time
+import asyncio
+
+from src.app.agent_workflow.agent_graph import ChatState, create_graph
+from src.app.rag_pipelines import general_rag_pipeline
+from src.app.rag_pipelines.general_rag_pipeline import Rag_Pipeline
+from src.app.core.config import DATA_CSV_PATH
+from src.benchmarks.fakes import Fake_Chat_Model, Fake_Rag, Fake_Sandbox, Fake_Embeddings
+from src.tests.conftest import responder, write_fixture_corpus
+
+#the tool branches of the graph with fake tools: they run in parallel and each one has its own deadline
+
+QUESTION = "why does this sklearn pipeline raise ValueError?"
+
+def run_graph(rag, sandbox=None, timeouts=None, route="rag_retriever, code_interpreter"):
+    llm = Fake_Chat_Model(responder=responder(route))
+    graph = create_graph("fake-key", rag, lambda model, temperature: llm, sandbox=sandbox or Fake_Sandbox(),
+                         tool_timeouts={"rag_retriever": 10, "code_interpreter": 10, **(timeouts or {})})
+
+    async def main():
+        start = time.perf_counter()
+        state = await graph.ainvoke(ChatState(input=QUESTION))
+        return time.perf_counter() - start, state
+    return asyncio.run(main())
+
+def results_by_tool(state):
+    return {result["tool"]: result for result in state["tool_results"]}
+
+def test_tool_branches_run_in_parallel():
+    wall, state = run_graph(Fake_Rag(latency=0.5), Fake_Sandbox(latency=0.5))
+    results = results_by_tool(state)
+    assert set(results) == {"rag_retriever", "code_interpreter"}
+    assert not any(result.get("error") for result in results.values())
+    #one after the other would take 1s
+    assert wall < 0.9
+
+def test_a_branch_past_its_deadline_becomes_an_error_result():
+    wall, state = run_graph(Fake_Rag(latency=5), Fake_Sandbox(latency=0.2), timeouts={"rag_retriever": 0.3})
+    results = results_by_tool(state)
+    assert results["rag_retriever"]["error"] and "timed out" in results["rag_retriever"]["output"]
+    assert not results["code_interpreter"].get("error")
+    assert state["output"]
+    assert wall < 2
+
+def test_cold_start_build_is_not_cancelled_by_the_deadline(workdir, monkeypatch):
+    #the crawl of a cold start takes way longer than the deadline of the branch, it goes on in the background
+    monkeypatch.setattr(general_rag_pipeline, "RERANK_ENABLED", False)
+
+    async def slow_crawl(self, URLS=None):
+        await asyncio.sleep(1)
+        write_fixture_corpus(DATA_CSV_PATH)
+    monkeypatch.setattr(Rag_Pipeline, "_scrapp_data", slow_crawl)
+
+    async def main():
+        rag = Rag_Pipeline(Fake_Embeddings())
+        graph = create_graph("fake-key", rag, lambda model, temperature: Fake_Chat_Model(responder=responder()),
+                             sandbox=Fake_Sandbox(), tool_timeouts={"rag_retriever": 0.2, "code_interpreter": 10})
+        build = rag.start_index_build()
+        before = await graph.ainvoke(ChatState(input=QUESTION))
+        await asyncio.wait_for(build, timeout=30)
+        after = await graph.ainvoke(ChatState(input=QUESTION))
+        return before, after, rag.start_index_build() is build
+
+    before, after, same_build = asyncio.run(main())
+    assert before["tool_results"][0]["error"] and "still being built" in before["tool_results"][0]["output"]
+    assert not after["tool_results"][0].get("error") and after["tool_results"][0]["documents"] > 0
+    assert same_build
@@ -0,0 +1,48 @@
+import asyncio
+
+from src.app.rag_pipelines.async_crawler import Async_Crawler
+from src.benchmarks.fixture_server import Fixture_Server, build_link_graph
+
+#the crawler against the local fixture server: every page once across all the seeds, only inside its seed and down to
+#max_depth, never more fetches in flight than the global and per host caps, and the same records as the old scrape
+
+def crawl(seeds, **options):
+    crawler = Async_Crawler(**{"parse_workers": 0, **options})
+    pages = {}
+    count = asyncio.run(crawler.crawl(seeds, lambda source, page_hash, chunks: pages.setdefault(source, chunks)))
+    assert count == len(pages)
+    return pages
+
+GRAPH = {
+    "/docs/": ["/docs/a.html", "/docs/guide/p.html", "/other/x.html"],
+    "/docs/a.html": ["/docs/deep.html", "/docs/a.html#section", "/docs/"],
+    "/docs/guide/": ["/docs/guide/p.html"],
+    "/docs/guide/p.html": ["/docs/guide/"],
+    "/docs/deep.html": [],
+    "/other/x.html": [],
+}
+
+def test_pages_are_fetched_once_inside_the_seeds_and_depth():
+    with Fixture_Server(GRAPH, latency=0.01) as server:
+        seeds = [f"{server.base_url}/docs/", f"{server.base_url}/docs/guide/", f"{server.base_url}/docs/", ""]
+        pages = crawl(seeds, max_depth=2)
+        requests = dict(server.requests)
+    #a page linked from two seeds (or from a seed to another one) is fetched once, anchors are the same page
+    assert requests == {"/docs/": 1, "/docs/a.html": 1, "/docs/guide/": 1, "/docs/guide/p.html": 1}
+    assert set(pages) == {f"{server.base_url}{path}" for path in requests}
+    #robust_html_extractor: the main content, no menu, footer or scripts
+    text = " ".join(pages[f"{server.base_url}/docs/a.html"])
+    assert "/docs/a.html paragraph 0 about gradient descent" in text
+    assert not any(boilerplate in text for boilerplate in ("menu", "dataLayer", "the authors"))
+
+def test_fetches_stay_under_the_global_and_per_host_caps():
+    with Fixture_Server(build_link_graph(n_sites=4, pages_per_site=15, fanout=4), latency=0.05) as server:
+        #two names for the same server are two hosts for the connector
+        port = server.httpd.server_address[1]
+        seeds = [f"http://{'127.0.0.1' if i % 2 else 'localhost'}:{port}/site{i}/" for i in range(4)]
+        pages = crawl(seeds, max_depth=3, max_concurrency=3, max_per_host=2)
+        requests, peaks = dict(server.requests), dict(server.max_in_flight)
+    assert len(pages) == len(requests) > 20
+    assert set(requests.values()) == {1}
+    assert 2 <= peaks[""] <= 3
+    assert max(peak for host, peak in peaks.items() if host) <= 2
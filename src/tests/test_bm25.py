@@ -0,0 +1,69 @@
+import os
+import csv
+import asyncio
+
+from src.app.rag_pipelines import general_rag_pipeline
+from src.app.rag_pipelines.general_rag_pipeline import Rag_Pipeline
+from src.app.rag_pipelines.bm25_index import Bm25_Index, reciprocal_rank_fusion
+from src.app.rag_pipelines.incremental_indexer import Incremental_Indexer
+from src.app.core.config import BM25_DIR, DATA_CSV_PATH
+from src.benchmarks.fakes import Fake_Embeddings
+from src.tests.conftest import write_fixture_corpus
+
+#hybrid retrieval: the bm25 index next to the vector store, fused with reciprocal rank fusion
+
+MARKER = "zq_marker_term"
+
+class Dense_Blind_Embeddings(Fake_Embeddings):
+    #the chunk with the marker is as far as it gets from a question about it, only the lexical side can find it
+    def embed_documents(self, texts):
+        vectors = super().embed_documents(texts)
+        away = [-v for v in self._embed(MARKER)]
+        return [away if MARKER in text else vector for text, vector in zip(texts, vectors)]
+
+    def embed_query(self, text):
+        return super().embed_documents([text])[0]
+
+def test_reciprocal_rank_fusion():
+    #in both lists beats the top of a single one, and the weights tip a tie
+    assert reciprocal_rank_fusion([["a", "b", "c"], ["c", "d"]], k=60)[0] == "c"
+    assert reciprocal_rank_fusion([["a"], ["b"]], weights=[1.0, 2.0], k=60) == ["b", "a"]
+    assert reciprocal_rank_fusion([[], []]) == []
+
+def test_lexical_only_hit_surfaces(workdir, monkeypatch):
+    monkeypatch.setattr(general_rag_pipeline, "RERANK_ENABLED", False)
+    write_fixture_corpus(DATA_CSV_PATH)
+    with open(DATA_CSV_PATH, "a", newline="", encoding="utf-8") as f:
+        csv.writer(f).writerow(["https://example.org/notes", f"The {MARKER} option only shows up in these notes."])
+    embedder = Dense_Blind_Embeddings()
+    asyncio.run(Incremental_Indexer(embedder).run(DATA_CSV_PATH))
+
+    async def main():
+        rag = Rag_Pipeline(embedder)
+        dense = [doc for _, doc in await rag._dense_search(f"what does {MARKER} do", 5)]
+        hybrid = await rag._retrieve(f"what does {MARKER} do", k=4, fetch_k=5)
+        return dense, hybrid
+
+    dense, hybrid = asyncio.run(main())
+    assert not any(MARKER in doc.page_content for doc in dense)
+    assert any(MARKER in doc.page_content for doc in hybrid)
+
+def test_save_recovers_from_a_crashed_save(workdir):
+    Bm25_Index.build([("a", "first index")]).save(BM25_DIR)
+    #what a save that died halfway leaves behind
+    for leftover in (BM25_DIR + ".old", BM25_DIR + ".tmp"):
+        os.makedirs(leftover)
+        with open(os.path.join(leftover, "offsets.npy"), "w") as f:
+            f.write("garbage")
+    Bm25_Index.build([("b", "second index")]).save(BM25_DIR)
+    assert Bm25_Index.load(BM25_DIR).search("second", 1)[0][0] == "b"
+    assert not os.path.exists(BM25_DIR + ".old") and not os.path.exists(BM25_DIR + ".tmp")
+
+def test_running_pipeline_picks_up_a_rebuilt_index(workdir):
+    Bm25_Index.build([("a", "scaling features with standardscaler")]).save(BM25_DIR)
+    rag = Rag_Pipeline(Fake_Embeddings())
+    assert rag._open_bm25().search("standardscaler", 1)[0][0] == "a"
+    #the indexer cli rebuilds it from another process
+    Bm25_Index.build([("b", "merging dataframes with merge_asof")]).save(BM25_DIR)
+    rag._bm25_checked = 0.0
+    assert rag._open_bm25().search("merge_asof", 1)[0][0] == "b"
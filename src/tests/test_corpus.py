@@ -0,0 +1,62 @@
+import os
+import asyncio
+import pytest
+
+from src.app.rag_pipelines.corpus import Corpus_Writer, Crawl_Too_Small, source_hashes
+from src.app.rag_pipelines.scrapping_manager import Scrap_manager
+from src.app.rag_pipelines.incremental_indexer import Incremental_Indexer
+from src.benchmarks.fakes import Fake_Embeddings
+from src.app.core.config import DATA_CSV_PATH
+from src.tests.conftest import write_fixture_corpus
+
+#a crawl that failed (every fetch down, no network) must never replace the corpus, the indexer would delete the store after it
+
+class Fake_Crawler:
+    #same interface as Async_Crawler.crawl, every page it was given is handed to the writer
+    def __init__(self, pages):
+        self.pages = pages
+
+    async def crawl(self, urls, on_page):
+        for i in range(self.pages):
+            on_page(f"https://example.org/docs/{i}", f"hash-{i}", [f"chunk of page {i}"])
+        return self.pages
+
+def crawl(path, pages):
+    return asyncio.run(Scrap_manager(["https://example.org/docs"], Fake_Crawler(pages), path=path).scrapp_and_save())
+
+def test_empty_crawl_keeps_the_old_corpus(tmp_path):
+    path = str(tmp_path / "corpus.parquet")
+    assert crawl(path, 10) == 10
+    with pytest.raises(Crawl_Too_Small):
+        crawl(path, 0)
+    assert len(source_hashes(path)) == 10
+    assert not os.path.exists(f"{path}.tmp")
+
+def test_crawl_much_smaller_than_the_corpus_is_rejected(tmp_path):
+    path = str(tmp_path / "corpus.parquet")
+    crawl(path, 10)
+    with pytest.raises(Crawl_Too_Small):
+        crawl(path, 4)
+    assert len(source_hashes(path)) == 10
+    #a few pages gone is a normal recrawl
+    assert crawl(path, 8) == 8
+    assert len(source_hashes(path)) == 8
+
+def test_first_crawl_with_no_page_writes_nothing(tmp_path):
+    path = str(tmp_path / "corpus.parquet")
+    with pytest.raises(Crawl_Too_Small):
+        with Corpus_Writer(path):
+            pass
+    assert os.listdir(tmp_path) == []
+
+def test_indexer_does_not_empty_the_store_on_an_empty_corpus(workdir):
+    corpus = write_fixture_corpus(DATA_CSV_PATH)
+    indexer = Incremental_Indexer(Fake_Embeddings())
+    added = asyncio.run(indexer.run(corpus))["added"]
+    with open("empty.csv", "w") as f:
+        f.write("source,text\n")
+    with pytest.raises(ValueError):
+        asyncio.run(Incremental_Indexer(Fake_Embeddings()).run("empty.csv"))
+    report = asyncio.run(Incremental_Indexer(Fake_Embeddings()).run(corpus))
+    assert added > 0
+    assert (report["added"], report["deleted"], report["skipped"]) == (0, 0, added)
@@ -0,0 +1,59 @@
+import multiprocessing
+import numpy as np
+
+from src.app.rag_pipelines.embedding_cache import Embedding_Store, Cached_Embeddings
+from src.benchmarks.fakes import Fake_Embeddings
+
+#the embedding store is shared by the api and the indexer cli, two processes writing to the same files
+
+DIM = 8
+
+def vector_of(key: str):
+    #every key has its own vector, so a key pointing to the row of another one shows up
+    return np.full(DIM, sum(map(ord, key)) + len(key) * 1000, dtype=np.float32)
+
+def writer(directory, name, batches, batch_size):
+    store = Embedding_Store(directory, initial_rows=4)
+    for b in range(batches):
+        keys = [f"{name}-{b}-{i}" for i in range(batch_size)]
+        store.put(keys, [vector_of(key) for key in keys])
+        #rows the other writer appended since this process mapped the file
+        store.get([f"{other}-{b}-0" for other in ("a", "b", "c")])
+    store.close()
+
+def test_concurrent_writer_processes_keep_every_key_on_its_own_vector(tmp_path):
+    directory = str(tmp_path / "store")
+    Embedding_Store(directory).close()
+    context = multiprocessing.get_context("spawn")
+    processes = [context.Process(target=writer, args=(directory, name, 60, 7)) for name in ("a", "b", "c")]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join(timeout=120)
+    assert [process.exitcode for process in processes] == [0, 0, 0]
+
+    store = Embedding_Store(directory)
+    keys = [f"{name}-{b}-{i}" for name in ("a", "b", "c") for b in range(60) for i in range(7)]
+    found = store.get(keys)
+    assert len(found) == len(keys) == len(store)
+    assert all(np.array_equal(found[key], vector_of(key)) for key in keys)
+
+def test_rows_appended_by_another_store_are_readable(tmp_path):
+    #two handles on the same files stand in for two processes, the first one mapped the file before the second grew it
+    directory = str(tmp_path / "store")
+    first, second = Embedding_Store(directory, initial_rows=2), Embedding_Store(directory, initial_rows=2)
+    first.put(["x"], [vector_of("x")])
+    keys = [f"k{i}" for i in range(50)]
+    second.put(keys, [vector_of(key) for key in keys])
+    first.put(["y"], [vector_of("y")])
+    found = first.get(keys + ["x", "y"])
+    assert all(np.array_equal(found[key], vector_of(key)) for key in keys + ["x", "y"])
+    assert np.array_equal(second.get(["y"])["y"], vector_of("y"))
+
+def test_cached_embeddings_skip_the_model_on_a_hit(tmp_path):
+    model = Fake_Embeddings(dim=DIM)
+    cached = Cached_Embeddings(model, model_name="fake", directory=str(tmp_path))
+    first = cached.embed_documents(["a chunk", "another chunk", "a chunk"])
+    calls = model.texts_embedded
+    assert cached.embed_documents(["another chunk", "a  chunk"]) == [first[1], first[0]]
+    assert model.texts_embedded == calls == 2
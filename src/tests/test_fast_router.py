@@ -0,0 +1,25 @@
+import os
+import json
+import asyncio
+import pytest
+
+from src.app.agent_workflow.fast_router import Fast_Router, looks_like_code
+from src.tests.conftest import DATA_DIR
+
+def routing_eval():
+    with open(os.path.join(DATA_DIR, "routing_eval.jsonl"), encoding="utf-8") as f:
+        return [json.loads(line) for line in f]
+
+@pytest.mark.parametrize("row", routing_eval(), ids=lambda row: row["input"][:40])
+def test_code_detection_matches_the_labels(row):
+    #every labeled snippet is code, and nothing labeled rag or final answer is (api names included)
+    assert looks_like_code(row["input"]) == (row["label"] == "code_interpreter")
+
+@pytest.mark.parametrize("name", ["pd.merge_asof", "torch.compile", "sklearn.preprocessing.StandardScaler", "df['a']", "x[0]"])
+def test_bare_api_names_are_not_code(name):
+    assert not looks_like_code(name)
+
+def test_bare_api_name_is_left_to_the_centroids_or_the_llm():
+    #without an embedder the local router only detects code, anything else goes to the llm router
+    assert asyncio.run(Fast_Router().route("torch.compile")) is None
+    assert asyncio.run(Fast_Router().route("torch.compile(model)"))["next_step"] == "code_interpreter"
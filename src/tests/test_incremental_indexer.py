@@ -0,0 +1,60 @@
+import asyncio
+
+from src.app.rag_pipelines.corpus import Corpus_Writer
+from src.app.rag_pipelines.incremental_indexer import Incremental_Indexer
+from src.benchmarks.fakes import Fake_Embeddings, Fake_Vector_Store
+
+#a second run over a recrawled corpus only embeds the chunks that changed, and removes the ones that are gone
+
+PANDAS = "https://pandas.pydata.org/docs/user_guide"
+TORCH = "https://pytorch.org/docs/stable"
+
+FIRST = {
+    f"{PANDAS}/merging.html": ["merge joins two dataframes on keys", "concat stacks dataframes along an axis"],
+    f"{PANDAS}/groupby.html": ["groupby splits a dataframe by keys", "agg applies functions to every group"],
+    f"{TORCH}/autograd.html": ["backward computes the gradients of a tensor"],
+    f"{TORCH}/optim.html": ["an optimizer updates the parameters of a model"],
+}
+SECOND = {
+    #same page
+    f"{PANDAS}/merging.html": FIRST[f"{PANDAS}/merging.html"],
+    #second chunk edited
+    f"{PANDAS}/groupby.html": ["groupby splits a dataframe by keys", "agg applies one or more functions to every group"],
+    #autograd.html is gone, optim.html got longer and there is a new page
+    f"{TORCH}/optim.html": FIRST[f"{TORCH}/optim.html"] + ["a scheduler changes the learning rate between epochs"],
+    f"{TORCH}/cuda.html": ["tensors are moved to the gpu with to(device)"],
+}
+
+def write_corpus(pages):
+    with Corpus_Writer("corpus.parquet", min_pages_ratio=0) as writer:
+        for source, chunks in pages.items():
+            writer.add_page(source, "|".join(chunks), chunks)
+    return "corpus.parquet"
+
+def test_second_run_only_embeds_what_changed(workdir):
+    embedder = Fake_Embeddings()
+    stores = {}
+
+    def run(pages):
+        indexer = Incremental_Indexer(embedder, store_factory=lambda library: stores.setdefault(library, Fake_Vector_Store()),
+                                      manifest_path="manifest.sqlite", bm25_directory=None, batch_size=2)
+        return asyncio.run(indexer.run(write_corpus(pages)))
+
+    first = run(FIRST)
+    assert (first["added"], first["updated"], first["deleted"], first["skipped"]) == (6, 0, 0, 0)
+    assert embedder.texts_embedded == 6
+    rows = {cid: row for store in stores.values() for cid, row in store.rows.items()}
+
+    second = run(SECOND)
+    assert (second["added"], second["updated"], second["deleted"], second["skipped"]) == (2, 1, 1, 4)
+    #edited chunk, new chunk of optim.html and the new page
+    assert embedder.texts_embedded == 6 + 3
+    documents = {row[1] for store in stores.values() for row in store.rows.values()}
+    assert documents == {text for chunks in SECOND.values() for text in chunks}
+    #unchanged chunks were left as they were, same id and same vector
+    unchanged = {cid: row for store in stores.values() for cid, row in store.rows.items() if cid in rows and row[1] == rows[cid][1]}
+    assert len(unchanged) == 4 and all(row[0] == rows[cid][0] for cid, row in unchanged.items())
+
+    third = run(SECOND)
+    assert (third["added"], third["updated"], third["deleted"], third["skipped"]) == (0, 0, 0, 7)
+    assert embedder.texts_embedded == 9
@@ -0,0 +1,77 @@
+import os
+import random
+import numpy as np
+
+from src.app.rag_pipelines.ivf_store import Ivf_Vector_Store
+from src.benchmarks.fakes import Fake_Embeddings
+
+#the ivf store against an exact float search, and what a second process (the api next to the indexer cli) gets to see
+
+WORDS = ("pandas numpy torch sklearn dataframe tensor array pipeline gradient loss optimizer fit transform merge groupby "
+         "index column shape dtype batch layer model train predict score split encode scale reshape broadcast slice "
+         "join pivot sample cuda device module backward step epoch metric cluster kernel").split()
+
+def fake_corpus(n, seed=0):
+    rng = random.Random(seed)
+    return [" ".join(rng.choices(WORDS, k=8)) for _ in range(n)]
+
+def fill(store, texts, embedder, prefix="chunk"):
+    ids = [f"{prefix}-{i}" for i in range(len(texts))]
+    store.upsert(ids, embedder.embed_documents(texts), texts, [{"source": f"https://example.org/{i}"} for i in range(len(texts))])
+    return ids
+
+def test_recall_against_exact_search(tmp_path):
+    embedder = Fake_Embeddings(dim=64)
+    texts = fake_corpus(3000)
+    store = Ivf_Vector_Store(str(tmp_path / "ivf"))
+    ids = fill(store, texts, embedder)
+    store.persist()
+    vectors = np.asarray(embedder.embed_documents(texts), dtype=np.float32)
+    queries = np.asarray(embedder.embed_documents(fake_corpus(50, seed=1)), dtype=np.float32)
+    k = 10
+    distances = (vectors ** 2).sum(axis=1)[None, :] - 2 * queries @ vectors.T + (queries ** 2).sum(axis=1)[:, None]
+    #bags of words tie a lot, a hit counts when it's as close as the k-th exact neighbour
+    kth = np.sort(distances, axis=1)[:, k - 1]
+    results = store.query(queries, k, documents=False)
+    recall = np.mean([sum(distance <= kth[i] + 1e-4 for _, distance, _ in hits) / k for i, hits in enumerate(results)])
+    assert all(len(hits) == k for hits in results)
+    assert recall >= 0.9
+    #the distances are exact squared l2, the same as chroma
+    cid, distance, _ = results[0][0]
+    assert abs(distance - distances[0][ids.index(cid)]) < 1e-4
+
+def test_upserts_and_deletes_are_in_the_persisted_index(tmp_path):
+    embedder = Fake_Embeddings(dim=64)
+    texts = fake_corpus(500)
+    store = Ivf_Vector_Store(str(tmp_path / "ivf"))
+    ids = fill(store, texts, embedder)
+    store.persist()
+    store.delete(ids[:10])
+    store.upsert([ids[10]], embedder.embed_documents(["cuda kernel backward"]), ["cuda kernel backward"], [{"source": "new"}])
+    store.persist()
+
+    for opened in (store, Ivf_Vector_Store(str(tmp_path / "ivf"))):
+        assert opened.count() == 490 and not opened.pending and not opened.stale
+        hits = opened.query(embedder.embed_documents(texts[:10]), 5)
+        assert not {cid for row in hits for cid, _, _ in row} & set(ids[:10])
+        (cid, distance, doc), *_ = opened.query(embedder.embed_documents(["cuda kernel backward"]), 1)[0]
+        assert (cid, doc.page_content, doc.metadata) == (ids[10], "cuda kernel backward", {"source": "new"})
+        assert distance < 1e-4
+    assert sorted(name for name in os.listdir(tmp_path / "ivf") if name.startswith("index-")) == [f"index-{store.generation}"]
+
+def test_a_second_store_picks_up_a_new_generation(tmp_path):
+    embedder = Fake_Embeddings(dim=64)
+    writer = Ivf_Vector_Store(str(tmp_path / "ivf"))
+    fill(writer, fake_corpus(500), embedder)
+    writer.persist()
+    reader = Ivf_Vector_Store(str(tmp_path / "ivf"))
+    question = embedder.embed_documents(["merge pivot groupby join"])
+    assert reader.query(question, 1)[0][0][0] != "added"
+
+    writer.upsert(["added"], question, ["merge pivot groupby join"], [{}])
+    writer.persist()
+    #checked less than a second ago, the reader is still on the index it has mapped
+    assert reader.query(question, 1)[0][0][0] != "added"
+    reader.checked = 0
+    assert reader.query(question, 1)[0][0][0] == "added"
+    assert reader.generation == writer.generation == 2
@@ -0,0 +1,40 @@
+import os
+import asyncio
+from langchain_community.vectorstores import Chroma
+
+from src.app.rag_pipelines import general_rag_pipeline
+from src.app.rag_pipelines.general_rag_pipeline import Rag_Pipeline
+from src.app.rag_pipelines.library_shards import Library_Router
+from src.app.core.config import CHROMA_DIR, DATA_CSV_PATH
+from src.benchmarks.fakes import Fake_Embeddings
+from src.tests.conftest import write_fixture_corpus
+
+#questions are routed to the shard of the library they name, and an index from before the shards is moved to them
+
+def test_only_unambiguous_names_route_a_question():
+    router = Library_Router()
+    assert router.route("how does tf-idf weight rare words?") == []
+    assert router.route("reshape a tensor to (batch, -1)") == []
+    assert router.route("heatmap of a correlation matrix") == []
+    assert router.route("select rows with df.loc and a condition") == []
+    assert router.route("how do I clean my data before training?") == []
+    assert router.route("loc vs iloc in pandas") == ["pandas"]
+    assert router.route("subclass torch.nn.Module") == ["pytorch"]
+    assert router.route("batch a tf.data.Dataset") == ["tensorflow"]
+
+def test_index_from_before_the_shards_is_rebuilt_at_startup(workdir, monkeypatch):
+    monkeypatch.setattr(general_rag_pipeline, "RERANK_ENABLED", False)
+    write_fixture_corpus(DATA_CSV_PATH)
+    #what the first versions wrote: every chunk in chroma's default "langchain" collection, no manifest
+    old = Chroma.from_texts(["an old chunk"], Fake_Embeddings(), persist_directory=os.path.abspath(CHROMA_DIR))
+
+    async def main():
+        rag = Rag_Pipeline(Fake_Embeddings())
+        await rag.warmup()
+        await asyncio.wait_for(rag.start_index_build(), timeout=60)
+        return await rag.query_context("How do I use StandardScaler in scikit-learn?")
+
+    result = asyncio.run(main())
+    assert result["documents"]
+    collections = [getattr(collection, "name", collection) for collection in old._client.list_collections()]
+    assert "langchain" not in collections
@@ -0,0 +1,108 @@
+import asyncio
+
+from src.app.agent_workflow.llm_gateway import Llm_Gateway, is_transient
+from src.benchmarks.fake_llm_server import Fake_Llm_Server
+from src.benchmarks.fakes import Fake_Chat_Model, Http_Chat_Model, Provider_Error
+from src.tests.conftest import responder, stream
+
+#the llm gateway against the fake provider (rate limits, 429 storms) and through /chat/stream, where a retry must never
+#send the answer twice
+
+def http_gateway(server, **options):
+    clients = []
+
+    def factory(model, temperature):
+        clients.append(Http_Chat_Model(base_url=server.base_url, model_name=model, temperature=temperature))
+        return clients[-1]
+
+    async def close():
+        for client in clients:
+            await client.aclose()
+    return Llm_Gateway(factory, **{"backoff_base": 0.05, "backoff_max": 0.5, **options}), close
+
+def test_calls_through_a_429_storm_are_retried():
+    async def main(server):
+        gateway, close = http_gateway(server, max_retries=8)
+        try:
+            llm = gateway.get_llm("fake", 0.7)
+            return await asyncio.gather(*[llm.ainvoke(f"question {i}") for i in range(20)]), gateway.stats
+        finally:
+            await close()
+
+    with Fake_Llm_Server(latency=0.01, storm_start=0, storm_seconds=60, storm_rejection=0.5) as server:
+        responses, stats = asyncio.run(main(server))
+        assert server.stats["rejected_storm"] > 0
+    assert [response.content for response in responses] == [f"answer to: question {i}" for i in range(20)]
+    assert stats["retries"] > 0 and stats["failures"] == 0
+
+def test_identical_deterministic_calls_in_flight_share_one_request():
+    async def main(server):
+        gateway, close = http_gateway(server)
+        try:
+            llm = gateway.get_llm("fake", 0)
+            return await asyncio.gather(*[llm.ainvoke("You are a router, same prompt") for _ in range(10)]), gateway.stats
+        finally:
+            await close()
+
+    with Fake_Llm_Server(latency=0.2) as server:
+        responses, stats = asyncio.run(main(server))
+        assert server.stats["requests"] == 1
+    assert len({response.content for response in responses}) == 1
+    assert (stats["upstream_calls"], stats["deduplicated"]) == (1, 9)
+
+def test_only_transient_errors_are_retried():
+    wrapped = RuntimeError("Error calling model")
+    wrapped.__cause__ = Provider_Error(503, "upstream unavailable")
+    assert is_transient(Provider_Error(429, "quota"))
+    assert is_transient(wrapped)
+    assert is_transient(RuntimeError("429 Resource has been exhausted (e.g. check quota)."))
+    assert is_transient(asyncio.TimeoutError())
+    #a number in the message is not a status
+    assert not is_transient(ValueError("max 500 tokens allowed, got 2048"))
+    assert not is_transient(Provider_Error(400, "max 500 tokens allowed"))
+
+    def rejecting(prompt):
+        raise ValueError("max 500 tokens allowed, got 2048")
+    gateway = Llm_Gateway(lambda model, temperature: Fake_Chat_Model(responder=rejecting), backoff_base=0.01)
+    try:
+        asyncio.run(gateway.get_llm("fake", 0.7).ainvoke("question"))
+    except ValueError:
+        pass
+    assert (gateway.stats["upstream_calls"], gateway.stats["retries"]) == (1, 0)
+
+class Flaky_Stream_Model(Fake_Chat_Model):
+    #the first final answer call fails with a 503 after fail_after streamed tokens (0: before the first one)
+    fail_after: int = 0
+    failures: int = 1
+
+    async def _astream(self, messages, stop=None, run_manager=None, **kwargs):
+        final = "You are an expert in python" in self._prompt_text(messages)
+        if final and self.failures and not self.fail_after:
+            self.failures -= 1
+            raise Provider_Error(503, "upstream unavailable")
+        streamed = 0
+        async for chunk in super()._astream(messages, stop, run_manager, **kwargs):
+            yield chunk
+            streamed += 1
+            if final and self.failures and streamed == self.fail_after:
+                self.failures -= 1
+                raise Provider_Error(503, "connection reset while streaming")
+
+ANSWER = "Gradient descent takes small steps against the gradient of the loss until it stops going down."
+
+def streamed(events):
+    return "".join(data["text"] for name, data in events if name == "token")
+
+def test_failure_before_the_first_token_is_retried(workdir):
+    events = stream(Flaky_Stream_Model(responder=responder("final_answer", ANSWER)))
+    assert events[-1][0] == "done"
+    assert streamed(events) == events[-1][1]["output"] == ANSWER
+
+def test_failure_after_tokens_went_out_is_not_retried(workdir):
+    llm = Flaky_Stream_Model(responder=responder("final_answer", ANSWER), fail_after=3)
+    events = stream(llm)
+    name, data = events[-1]
+    assert name == "error" and "Provider_Error" in data["error"]
+    #the client got the start of the answer once, never the answer again from a retry
+    assert streamed(events) == " ".join(ANSWER.split(" ")[:3])
+    assert llm.failures == 0
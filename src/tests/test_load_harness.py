@@ -0,0 +1,61 @@
+import time
+import asyncio
+import pytest
+
+from src.benchmarks import bench_load
+from src.benchmarks.fakes import Fake_Chat_Model, Fake_Embeddings
+from src.tests.conftest import serve_app
+
+#the load test harness: the app booted on the fixture index with the fakes answers every kind of request, the summary has
+#the per kind and per node breakdown, and the baseline comparison flags what got worse
+
+def test_mixed_workload_on_the_fixture_index(workdir):
+    questions, routes = bench_load.load_questions()
+    schedule = bench_load.make_schedule(questions, bench_load.parse_mix("rag=0.5,code=0.2,plain=0.3"), 30, seed=0)
+    embedder = Fake_Embeddings()
+
+    async def main():
+        rag = await bench_load.build_rag(str(workdir), embedder, filler=200)
+        llm = Fake_Chat_Model(responder=bench_load.make_responder(routes))
+        results = []
+        async with serve_app(rag=rag, llm=llm) as client:
+            for kind, question in schedule:
+                start = time.perf_counter()
+                response = await client.get("/chat", params={"input": question})
+                body = response.json() if response.status_code == 200 else {}
+                results.append({"kind": kind, "seconds": time.perf_counter() - start, "status": response.status_code,
+                                "timings": body.get("timings") or {}, "tools": [call["tool"] for call in body.get("tool_calls", [])]})
+        return results
+
+    results = asyncio.run(main())
+    level = bench_load.summarize(results, rps=10.0, concurrency=1, memory_mb={})
+    assert level["errors"] == 0 and level["requests"] == 30
+    assert set(level["kinds"]) == {"rag", "code", "plain"}
+    assert sum(stats["count"] for stats in level["kinds"].values()) == 30
+    assert {"router", "rag_retriever", "rag_retriever.retrieve", "code_interpreter", "final_answer"} <= set(level["nodes"])
+    #rag questions went through hybrid retrieval on the index the real indexer built, code ones to the sandbox
+    assert level["routes"]["rag->rag_retriever"] > 0 and level["routes"]["code->code_interpreter"] > 0
+
+def test_schedule_is_the_same_for_a_seed():
+    questions, _ = bench_load.load_questions()
+    mix = bench_load.parse_mix("rag=1,plain=1")
+    assert bench_load.make_schedule(questions, mix, 50, seed=3) == bench_load.make_schedule(questions, mix, 50, seed=3)
+    assert {kind for kind, _ in bench_load.make_schedule(questions, mix, 50, seed=3)} == {"rag", "plain"}
+    with pytest.raises(ValueError):
+        bench_load.parse_mix("rag=1,vision=1")
+
+def run_result(rps, p95, errors=0, rag_p95=None):
+    latency = {"count": 100, "p50": p95 / 2, "p95": p95, "p99": p95 * 1.2, "mean": p95 / 2}
+    level = {"rps": rps, "errors": errors, "latency_ms": latency, "memory_mb": {"server_peak": 300.0},
+             "kinds": {"rag": {**latency, "p95": rag_p95 or p95}}}
+    return {"settings": {"mix": "rag=1"}, "levels": {"8": level}}
+
+def test_baseline_comparison_flags_regressions():
+    baseline = run_result(rps=100, p95=200)
+    assert bench_load.compare(run_result(rps=95, p95=220), baseline, tolerance=0.2, min_delta_ms=5) == []
+    regressions = bench_load.compare(run_result(rps=70, p95=300, errors=2), baseline, tolerance=0.2, min_delta_ms=5)
+    assert any("rps" in line for line in regressions) and any("p95" in line for line in regressions)
+    assert any("errors: 0 -> 2" in line for line in regressions)
+    #a large relative change of a few ms is jitter
+    small = run_result(rps=100, p95=2)
+    assert bench_load.compare(run_result(rps=100, p95=4), small, tolerance=0.2, min_delta_ms=5) == []
@@ -0,0 +1,60 @@
+import asyncio
+
+from src.app.rag_pipelines.micro_batcher import Micro_Batcher
+from src.benchmarks.fakes import Fake_Embeddings
+
+#concurrent queries share one embedding call, and every caller still gets its own answer
+
+QUESTIONS = [f"how do I use feature number {i} of pandas" for i in range(12)]
+
+def test_batched_callers_get_their_own_result():
+    embedder = Fake_Embeddings(call_latency=0.05)
+    batcher = Micro_Batcher(embedder.embed_documents, max_batch_size=32, max_wait=0.01)
+
+    async def main():
+        return await asyncio.gather(*[batcher.submit(question) for question in QUESTIONS])
+
+    vectors = asyncio.run(main())
+    assert vectors == [Fake_Embeddings().embed_query(question) for question in QUESTIONS]
+    assert embedder.calls < len(QUESTIONS)
+    assert batcher.stats["items"] == len(QUESTIONS)
+
+def test_cancelled_caller_is_skipped():
+    embedder = Fake_Embeddings(call_latency=0.2)
+    batcher = Micro_Batcher(embedder.embed_documents, max_batch_size=32, max_wait=0)
+
+    async def main():
+        #the first one keeps the worker busy, the others queue up for the next batch and one of them gives up
+        first = asyncio.ensure_future(batcher.submit(QUESTIONS[0]))
+        await asyncio.sleep(0.05)
+        waiting = [asyncio.ensure_future(batcher.submit(question)) for question in QUESTIONS[1:4]]
+        await asyncio.sleep(0)
+        waiting[1].cancel()
+        results = await asyncio.gather(first, waiting[0], waiting[2])
+        return results, waiting[1].cancelled()
+
+    results, cancelled = asyncio.run(main())
+    assert cancelled
+    assert results == [Fake_Embeddings().embed_query(question) for question in (QUESTIONS[0], QUESTIONS[1], QUESTIONS[3])]
+    assert batcher.stats["items"] == 3 and batcher.stats["batches"] == 2
+
+def test_batch_error_reaches_every_waiter():
+    calls = []
+
+    def failing(items):
+        calls.append(items)
+        if len(calls) == 1:
+            raise RuntimeError("vector store unavailable")
+        return [item.upper() for item in items]
+
+    batcher = Micro_Batcher(failing, max_batch_size=32, max_wait=0.01)
+
+    async def main():
+        results = await asyncio.gather(*[batcher.submit(question) for question in QUESTIONS[:5]], return_exceptions=True)
+        #the worker is still up for the next ones
+        return results, await batcher.submit("after")
+
+    results, after = asyncio.run(main())
+    assert len(calls[0]) == 5
+    assert all(isinstance(result, RuntimeError) for result in results)
+    assert after == "AFTER"
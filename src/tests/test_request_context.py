@@ -0,0 +1,44 @@
+import asyncio
+
+from src.benchmarks.fakes import Fake_Chat_Model, Fake_Embeddings, Fake_Rag
+from src.tests.conftest import responder, serve_app, parse_sse
+
+#every request gets an id (the client's X-Request-ID or a new one) sent back in the header and in the answer, and
+#/metrics has one series per route and not one per session
+
+def run(main):
+    async def serve():
+        async with serve_app(rag=Fake_Rag(embedded_model=Fake_Embeddings()),
+                             llm=Fake_Chat_Model(responder=responder("final_answer"))) as client:
+            return await main(client)
+    return asyncio.run(serve())
+
+def test_request_id_is_echoed_and_returned_in_the_answer(workdir):
+    async def main(client):
+        given = await client.get("/chat", params={"input": "What is a tensor?"}, headers={"X-Request-ID": "client-id-1"})
+        generated = await client.get("/chat", params={"input": "What is a dataframe?"})
+        streamed = await client.get("/chat/stream", params={"input": "What is a gradient?"})
+        return given, generated, streamed
+
+    given, generated, streamed = run(main)
+    assert given.headers["x-request-id"] == given.json()["request_id"] == "client-id-1"
+    request_id = generated.headers["x-request-id"]
+    assert request_id and request_id != "client-id-1"
+    assert generated.json()["request_id"] == request_id
+    name, done = parse_sse(streamed.text)[-1]
+    assert name == "done"
+    assert done["request_id"] == streamed.headers["x-request-id"] not in (request_id, "client-id-1")
+
+def test_metrics_are_labelled_by_route_template(workdir):
+    async def main(client):
+        for session_id in ("session-5f1e", "session-9a0c"):
+            assert (await client.delete(f"/sessions/{session_id}")).status_code == 200
+        assert (await client.get("/no/such/route-77d2")).status_code == 404
+        return await client.get("/metrics")
+
+    response = run(main)
+    assert response.status_code == 200
+    lines = response.text.splitlines()
+    assert 'tutorbot_span_duration_seconds_bucket{span="DELETE /sessions/{session_id}",le="+Inf"}' in " ".join(lines)
+    assert any(line.startswith('tutorbot_span_duration_seconds_count{span="GET unmatched"}') for line in lines)
+    assert not any(raw in response.text for raw in ("session-5f1e", "session-9a0c", "route-77d2"))
@@ -0,0 +1,37 @@
+import asyncio
+from langchain_core.documents import Document
+
+from src.app.rag_pipelines.reranker import Cross_Encoder_Reranker
+from src.benchmarks.fakes import Fake_Cross_Encoder
+
+#the re-ranker learns the cost of a (question, chunk) pair to keep under its latency budget, the lazy load of the model
+#must not count as that cost, and a bad estimate must not turn the re-ranking off for good
+
+QUESTION = "how to fill missing values in a dataframe"
+
+def candidates(n=10):
+    docs = [Document(page_content=f"page {i} about plotting histograms") for i in range(n - 1)]
+    return docs + [Document(page_content="use fillna to fill missing values in a dataframe")]
+
+def test_model_load_is_not_counted_as_the_cost_of_a_pair(workdir):
+    reranker = Cross_Encoder_Reranker(budget=0.3, scorer=Fake_Cross_Encoder(pair_latency=0.001, load_latency=1.0))
+    reranker.warmup()
+    assert reranker.seconds_per_pair < 0.01
+    ranked, reranked = asyncio.run(reranker.rerank(QUESTION, candidates()))
+    assert reranked and "fillna" in ranked[0].page_content
+    assert reranker.stats["over_budget"] == 0
+
+def test_estimate_recovers_after_a_slow_moment(workdir):
+    reranker = Cross_Encoder_Reranker(budget=0.3, scorer=Fake_Cross_Encoder(pair_latency=0.001), probe_every=5)
+    reranker.warmup()
+    #what a stall of the box (or the old timed model load) leaves behind
+    reranker.seconds_per_pair = 10.0
+
+    async def main():
+        return [(await reranker.rerank(QUESTION, candidates()))[1] for _ in range(10)]
+
+    reranked = asyncio.run(main())
+    assert reranked[:4] == [False] * 4
+    #the probe re-ranks a small head and measures again, after that the whole head fits
+    assert reranked[4] and all(reranked[5:])
+    assert reranker.stats["probes"] == 1 and reranker.seconds_per_pair < 0.01
@@ -0,0 +1,66 @@
+import asyncio
+import pytest
+
+from src.app.api.response_cache import Response_Cache, Memory_Cache_Backend, Sqlite_Cache_Backend
+from src.benchmarks.fakes import Fake_Chat_Model, Fake_Embeddings, Fake_Rag
+from src.tests.conftest import serve_app, responder
+
+#repeated and paraphrased questions are answered from the cache without running the graph (no llm call at all),
+#questions with code always run it
+
+QUESTION = "How do I merge two dataframes in pandas?"
+#same words in another order and case: not the same normalized text, so only the similarity match can find it
+PARAPHRASE = "how do I merge two pandas dataframes"
+CODE = "Why does this fail?\n```python\ndf.merge(other, on='id')\n```"
+
+def make_backend(kind, directory):
+    return Memory_Cache_Backend() if kind == "memory" else Sqlite_Cache_Backend(str(directory / "cache.sqlite"))
+
+def run_chat(kind, directory, inputs):
+    #-> (responses, llm calls before each request and after the last one)
+    embedder = Fake_Embeddings()
+    llm = Fake_Chat_Model(responder=responder("final_answer"))
+
+    async def main():
+        cache = Response_Cache(embedder, backend=make_backend(kind, directory))
+        responses, calls = [], []
+        async with serve_app(rag=Fake_Rag(embedded_model=embedder), llm=llm, response_cache=cache) as client:
+            for input in inputs:
+                calls.append(llm.calls)
+                response = await client.get("/chat", params={"input": input})
+                assert response.status_code == 200
+                responses.append(response.json())
+            calls.append(llm.calls)
+            return responses, calls, cache.stats()
+
+    return asyncio.run(main())
+
+@pytest.mark.parametrize("kind", ["memory", "sqlite"])
+def test_repeated_question_skips_the_graph(kind, workdir):
+    responses, calls, stats = run_chat(kind, workdir, [QUESTION, QUESTION, f"  {QUESTION.upper()} "])
+    assert [response.get("cached", False) for response in responses] == [False, True, True]
+    assert calls[1] > calls[0] and calls[3] == calls[1]
+    assert responses[1]["output"] == responses[2]["output"] == responses[0]["output"]
+    assert stats["hits_exact"] == 2
+
+@pytest.mark.parametrize("kind", ["memory", "sqlite"])
+def test_paraphrased_question_skips_the_graph(kind, workdir):
+    responses, calls, stats = run_chat(kind, workdir, [QUESTION, PARAPHRASE, "What is gradient descent?"])
+    assert [response.get("cached", False) for response in responses] == [False, True, False]
+    assert calls[2] == calls[1]
+    assert calls[3] > calls[2]
+    assert stats["hits_semantic"] == 1
+
+@pytest.mark.parametrize("kind", ["memory", "sqlite"])
+def test_code_bypasses_the_cache(kind, workdir):
+    responses, calls, stats = run_chat(kind, workdir, [CODE, CODE])
+    assert [response.get("cached", False) for response in responses] == [False, False]
+    assert calls[2] > calls[1] > calls[0]
+    assert stats["bypassed"] == 2 and stats["entries"] == 0
+
+def test_sqlite_cache_survives_a_restart(workdir):
+    embedder = Fake_Embeddings()
+    backend = Sqlite_Cache_Backend(str(workdir / "cache.sqlite"))
+    asyncio.run(Response_Cache(embedder, backend=backend).store(QUESTION, {"output": "use merge"}))
+    restarted = Response_Cache(embedder, backend=Sqlite_Cache_Backend(str(workdir / "cache.sqlite")))
+    assert asyncio.run(restarted.lookup(PARAPHRASE)) == {"output": "use merge"}
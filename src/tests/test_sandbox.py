@@ -0,0 +1,80 @@
+import asyncio
+import pytest
+
+from src.app.code_sandbox.sandbox_pool import Sandbox_Pool
+
+#the sandbox pool with real worker processes (nothing preloaded, so they start fast)
+
+def run_in_pool(main, **options):
+    async def wrapper():
+        pool = Sandbox_Pool(**{"size": 1, "preload": [], **options})
+        await pool.start()
+        try:
+            return await main(pool)
+        finally:
+            await pool.close()
+    return asyncio.run(wrapper())
+
+def test_runs_code_and_returns_the_last_expression():
+    async def main(pool):
+        return await pool.run("print('hi')\n1 + 1")
+    result = run_in_pool(main)
+    assert (result["stdout"], result["result"], result["error"]) == ("hi\n", "2", None)
+
+def test_server_environment_does_not_reach_the_code(monkeypatch):
+    monkeypatch.setenv("GOOGLE_API_KEY", "secret-key")
+
+    async def main(pool):
+        return await pool.run("import os\nos.environ.get('GOOGLE_API_KEY')")
+    result = run_in_pool(main)
+    assert result["error"] is None and result["result"] is None
+
+def test_server_files_do_not_reach_the_code(workdir):
+    (workdir / ".env").write_text("GOOGLE_API_KEY=secret-key\n")
+
+    async def main(pool):
+        return await pool.run("import os\nprint(os.listdir('.'))\nopen('.env').read()")
+    result = run_in_pool(main)
+    assert result["stdout"] == "[]\n"
+    assert result["error"].startswith("Traceback") and "FileNotFoundError" in result["error"]
+
+def test_changes_to_module_state_do_not_reach_the_next_user():
+    async def main(pool):
+        await pool.run("import builtins\nbuiltins.len = lambda x: 42")
+        patched_len = await pool.run("len([1, 2, 3])")
+        await pool.run("import json\njson.dumps = lambda *args, **kwargs: 'not json'")
+        patched_json = await pool.run("1 + 1")
+        return patched_len, patched_json, pool.stats
+    patched_len, patched_json, stats = run_in_pool(main)
+    assert patched_len["result"] == "3"
+    assert patched_json["result"] == "2"
+    #one worker did all of it, nothing was replaced
+    assert stats["crashes"] == 0
+
+def test_cpu_limit_only_takes_the_snippet_down():
+    async def main(pool):
+        runaway = await pool.run("while True:\n    pass")
+        return runaway, await pool.run("sum(range(10))"), pool.stats
+    runaway, after, stats = run_in_pool(main, cpu_seconds=1)
+    assert runaway["error"].startswith("TimeoutError")
+    assert after["result"] == "45"
+    assert stats["crashes"] == 0 and stats["timeouts"] == 0
+
+def test_cancelled_callers_do_not_starve_the_pool():
+    #branch deadlines or disconnected clients give up while their code still runs, as many times as there are workers
+    async def main(pool):
+        for _ in range(2):
+            with pytest.raises(asyncio.TimeoutError):
+                await asyncio.wait_for(pool.run("import time\ntime.sleep(30)"), timeout=0.2)
+        return await asyncio.wait_for(pool.run("1 + 1"), timeout=10), pool.stats
+    result, stats = run_in_pool(main, size=2)
+    assert result["result"] == "2"
+    assert stats["cancelled"] == 2
+
+def test_wall_clock_limit_replaces_the_worker():
+    async def main(pool):
+        slow = await pool.run("import time\ntime.sleep(30)")
+        return slow, await pool.run("'still here'")
+    slow, after = run_in_pool(main, wall_seconds=1)
+    assert slow["error"].startswith("TimeoutError")
+    assert after["result"] == "'still here'"
@@ -0,0 +1,90 @@
+import os
+import asyncio
+
+from src.app.agent_workflow.agent_graph import create_graph, new_turn
+from src.app.agent_workflow.conversation_memory import count_tokens
+from src.app.api.sessions import Session_Store, open_checkpointer
+from src.app.core.config import MEMORY_TOKEN_BUDGET, MEMORY_SUMMARY_TOKENS
+from src.benchmarks.fakes import Fake_Chat_Model, Fake_Rag, Fake_Sandbox
+
+#sessions through the graph with the sqlite checkpointer and a fake llm: the prompt of a long session stays flat,
+#idle and over the cap sessions are evicted with their checkpoints
+
+ANSWER = ("A decision tree splits the data on the feature that best separates the labels, and keeps splitting until the "
+          "leaves are pure or a depth limit is reached. Random forests average many of them to reduce the variance.")
+
+def make_responder(prompt_tokens: list):
+    def responder(prompt: str) -> str:
+        if "You are a router" in prompt:
+            return "rag_retriever"
+        if "running summary" in prompt:
+            #longer than asked on purpose, the memory has to enforce the budget itself
+            return "The student asked about trees, forests and boosting. " * 60
+        prompt_tokens.append(count_tokens(prompt))
+        return ANSWER
+    return responder
+
+def run_sessions(tmp_path, main, **options):
+    async def wrapper():
+        sessions = Session_Store(await open_checkpointer(str(tmp_path / "sessions.sqlite")), **options)
+        await sessions.setup()
+        prompt_tokens = []
+        llm = Fake_Chat_Model(responder=make_responder(prompt_tokens))
+        graph = create_graph("fake-key", Fake_Rag(), lambda model, temperature: llm, sandbox=Fake_Sandbox(),
+                             checkpointer=sessions.checkpointer)
+        try:
+            return await main(graph, sessions), prompt_tokens
+        finally:
+            await sessions.close()
+    return asyncio.run(wrapper())
+
+async def chat(graph, sessions, session_id, question="what is overfitting?"):
+    state = await graph.ainvoke(new_turn(question), sessions.config(session_id))
+    await sessions.touch(session_id)
+    return state
+
+def test_prompt_stays_flat_over_a_long_session(tmp_path):
+    db_path = str(tmp_path / "sessions.sqlite")
+
+    async def main(graph, sessions):
+        sizes = {}
+        for turn in range(1, 201):
+            state = await chat(graph, sessions, "long-session", f"question number {turn}: how do boosted trees differ from forests?")
+            if turn in (50, 200):
+                sizes[turn] = sum(os.path.getsize(path) for path in (db_path, db_path + "-wal") if os.path.exists(path))
+        return state, sizes
+
+    (state, sizes), prompt_tokens = run_sessions(tmp_path, main)
+    assert len(prompt_tokens) == 200
+    #the conversation in the prompt is capped by the memory budgets, whatever the number of turns
+    assert max(prompt_tokens) <= prompt_tokens[0] + MEMORY_TOKEN_BUDGET + MEMORY_SUMMARY_TOKENS
+    assert max(prompt_tokens[100:]) <= max(prompt_tokens[25:100]) * 1.05
+    assert count_tokens(state["summary"]) <= MEMORY_SUMMARY_TOKENS
+    #only the last checkpoint of the session is kept
+    assert sizes[200] <= sizes[50] * 1.5
+
+def test_sessions_over_the_cap_are_evicted_oldest_first(tmp_path):
+    async def main(graph, sessions):
+        for i in range(5):
+            await chat(graph, sessions, f"user-{i}")
+        kept = [bool((await graph.aget_state(sessions.config(f"user-{i}"))).values.get("history")) for i in range(5)]
+        return await sessions.count(), kept, sessions.stats
+
+    (count, kept, stats), _ = run_sessions(tmp_path, main, max_sessions=3)
+    assert count == 3
+    assert kept == [False, False, True, True, True]
+    assert stats["evicted_cap"] == 2
+
+def test_idle_sessions_are_evicted_after_the_ttl(tmp_path):
+    async def main(graph, sessions):
+        for i in range(3):
+            await chat(graph, sessions, f"user-{i}")
+        kept = await sessions.evict_idle()
+        sessions.ttl = 0
+        evicted = await sessions.evict_idle()
+        state = await graph.aget_state(sessions.config("user-0"))
+        return kept, evicted, await sessions.count(), state.values.get("history")
+
+    (kept, evicted, count, history), _ = run_sessions(tmp_path, main, ttl=3600)
+    assert (kept, evicted, count) == (0, 3, 0)
+    assert not history
@@ -0,0 +1,61 @@
+import time
+import asyncio
+import threading
+
+from src.app.api.response_cache import Response_Cache
+from src.app.rag_pipelines import general_rag_pipeline
+from src.app.rag_pipelines.incremental_indexer import Incremental_Indexer
+from src.app.core.config import DATA_CSV_PATH
+from src.benchmarks.fakes import Fake_Embeddings
+from src.tests.conftest import serve_app, write_fixture_corpus
+
+#the embedding model is loaded once per process and shared by every request, never once per request
+
+QUESTIONS = ["How do I use StandardScaler in scikit-learn?", "How to merge two dataframes in pandas?",
+             "How do I make a heatmap with seaborn?", "How to build a custom training loop in PyTorch?",
+             "What does GridSearchCV return?", "How do I read a parquet file with pandas?",
+             "How to create a subplot grid in matplotlib?", "How do I use numpy broadcasting?"]
+
+class Counting_Embeddings(Fake_Embeddings):
+    #stands in for HuggingFaceEmbeddings, a slow constructor so two loads racing each other would both get through
+    loads = 0
+
+    def __init__(self, model_name=None, **kwargs):
+        type(self).loads += 1
+        time.sleep(0.05)
+        super().__init__()
+
+def use_counting_model(monkeypatch):
+    Counting_Embeddings.loads = 0
+    monkeypatch.setattr(general_rag_pipeline, "HuggingFaceEmbeddings", Counting_Embeddings)
+    monkeypatch.setattr(general_rag_pipeline, "_embedded_model", None)
+    monkeypatch.setattr(general_rag_pipeline, "EMBEDDING_CACHE_ENABLED", False)
+    monkeypatch.setattr(general_rag_pipeline, "RERANK_ENABLED", False)
+
+def test_concurrent_get_embedded_model_loads_once(monkeypatch):
+    use_counting_model(monkeypatch)
+    models = []
+    threads = [threading.Thread(target=lambda: models.append(general_rag_pipeline.get_embedded_model())) for _ in range(16)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert Counting_Embeddings.loads == 1
+    assert all(model is models[0] for model in models)
+
+def test_burst_of_rag_requests_loads_the_model_once(workdir, monkeypatch):
+    use_counting_model(monkeypatch)
+    #the index is there already (built with another instance of the same fake), like a deployed app
+    asyncio.run(Incremental_Indexer(Fake_Embeddings()).run(write_fixture_corpus(DATA_CSV_PATH)))
+
+    async def burst():
+        #responses are never served from the cache, every request goes through the graph and the retriever
+        async with serve_app(response_cache=Response_Cache(Fake_Embeddings(), ttl=-1)) as client:
+            return await asyncio.gather(*[client.get("/chat", params={"input": question}) for question in QUESTIONS * 4])
+
+    responses = asyncio.run(burst())
+    assert [response.status_code for response in responses] == [200] * len(QUESTIONS) * 4
+    for response in responses:
+        results = [result for result in response.json()["tool_results"] if result["tool"] == "rag_retriever"]
+        assert results and not results[0].get("error") and results[0]["documents"] > 0
+    assert Counting_Embeddings.loads == 1
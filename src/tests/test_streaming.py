@@ -0,0 +1,27 @@
+from src.benchmarks.fakes import Fake_Chat_Model
+from src.tests.conftest import responder, stream
+
+#/chat/stream: progress events, the answer token by token and "done", or an "error" event when the request fails mid-stream
+
+def test_answer_is_streamed_then_done(workdir):
+    events = stream(Fake_Chat_Model(responder=responder("final_answer")))
+    names = [name for name, _ in events]
+    assert names[0] == "progress" and names[-1] == "done" and "token" in names
+    tokens = "".join(data["text"] for name, data in events if name == "token")
+    assert tokens == events[-1][1]["output"]
+    assert events[-1][1]["request_id"] == "test-request"
+
+def test_failure_mid_stream_ends_with_an_error_event(workdir):
+    answer = responder("final_answer")
+
+    def failing(prompt):
+        if "You are an expert in python" in prompt:
+            raise ValueError("provider rejected the prompt")
+        return answer(prompt)
+
+    events = stream(Fake_Chat_Model(responder=failing))
+    name, data = events[-1]
+    assert name == "error"
+    assert data["request_id"] == "test-request"
+    assert "ValueError" in data["error"]
+    assert "done" not in [name for name, _ in events]
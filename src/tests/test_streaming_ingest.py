@@ -0,0 +1,56 @@
+import os
+import time
+import asyncio
+import threading
+import pytest
+from langchain_core.documents import Document
+
+from src.app.rag_pipelines.streaming_ingest import Ingest_Pipeline
+from src.benchmarks.fakes import Fake_Embeddings
+
+def chunks(n, consumed):
+    for i in range(n):
+        consumed.append(i)
+        yield f"chunk-{i}", Document(page_content=f"text of chunk {i}", metadata={"source": "https://example.org"})
+
+def test_every_chunk_is_written_in_order():
+    written = []
+    pipeline = Ingest_Pipeline(Fake_Embeddings(), lambda ids, docs, vectors: written.extend(ids), batch_size=8, queue_size=2)
+    stats = asyncio.run(pipeline.run(chunks(100, [])))
+    assert stats == {"chunks": 100, "batches": 13}
+    assert written == [f"chunk-{i}" for i in range(100)]
+
+def test_failing_writer_stops_the_producer():
+    consumed = []
+
+    def write(ids, docs, vectors):
+        raise OSError("disk full")
+
+    pipeline = Ingest_Pipeline(Fake_Embeddings(), write, batch_size=8, queue_size=2)
+    with pytest.raises(OSError):
+        asyncio.run(pipeline.run(chunks(100000, consumed)))
+    #the producer stopped at the queues' worth of batches and not at the end of the corpus
+    assert len(consumed) < 100
+
+def test_cancelled_runs_release_the_producer_threads():
+    #a slow embedder and a corpus that never ends, every run is cancelled mid-ingest (a request deadline, a shutdown)
+    #more cancelled runs than the default executor has threads: a producer left blocked on its queue would use one up for good
+    runs = (os.cpu_count() or 1) + 5
+    producers = []
+
+    async def main():
+        for _ in range(runs):
+            consumed = []
+            producers.append(consumed)
+            pipeline = Ingest_Pipeline(Fake_Embeddings(text_latency=0.01), lambda ids, docs, vectors: None, batch_size=4, queue_size=1)
+            with pytest.raises(asyncio.TimeoutError):
+                await asyncio.wait_for(pipeline.run(chunks(10 ** 9, consumed)), timeout=0.05)
+        #the executor still has threads for everything else (embeddings and searches of the api go through it)
+        assert await asyncio.wait_for(asyncio.to_thread(lambda: 1), timeout=5) == 1
+
+    asyncio.run(main())
+    #and the producers stopped reading the corpus
+    counts = [len(consumed) for consumed in producers]
+    time.sleep(0.3)
+    assert counts == [len(consumed) for consumed in producers]
+    assert threading.active_count() < 50